@@ -0,0 +1,273 @@
+"""
+Historical backfill: load a selector's history from Prometheus into the
+history store (metric_values / metric_chunks, see STORAGE_BACKEND).
+
+The range is split into step-aligned chunks fetched in parallel under a
+token-bucket rate limit, so a large backfill does not starve the live
+detector's Prometheus queries. Each chunk is bulk-loaded in its own
+transaction and recorded in a JSON checkpoint; re-running the same command
+after an interruption skips the chunks already loaded. Points that are already
+stored are not inserted twice.
+
+Usage (from the `app` directory):
+
+    PYTHONPATH=. python backfill.py --query node_load1 --hours 720
+    PYTHONPATH=. python backfill.py --query 'up{job="node"}' --start 2024-01-01T00:00:00 --end 2024-01-08T00:00:00
+    PYTHONPATH=. python backfill.py --query node_load1 --hours 168 --snapshot history.npz
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from core.config import settings
+from core.database import SessionLocal, engine
+from core.fingerprint import metric_id_from_labels
+from clients.prometheus import PrometheusClient, parse_step
+from clients.sources import load_sources
+from models.base import Base
+from models.metric import MetricModel
+from services.calendar_features import to_epoch_seconds
+from services.history_cache import HistoryCache
+from services.storage import storage
+
+# Prometheus refuses query_range requests with more points per series than this
+MAX_POINTS_PER_REQUEST = 11000
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second, bursts of up to `burst`."""
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """Chunks already loaded for one backfill job, persisted as JSON after every chunk."""
+    def __init__(self, path: str, job: dict):
+        self.path = path
+        self.job = job
+        self.done = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('job') == job:
+                self.done = {int(k): v for k, v in data.get('done', {}).items()}
+            else:
+                logging.warning(f"Checkpoint {path} belongs to another job, starting over")
+
+    def is_done(self, chunk_start: int) -> bool:
+        return chunk_start in self.done
+
+    def mark(self, chunk_start: int, points: int):
+        with self._lock:
+            self.done[chunk_start] = points
+            if not self.path:
+                return
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'job': self.job, 'done': {str(k): v for k, v in sorted(self.done.items())}}, f)
+            os.replace(tmp, self.path)
+
+
+def parse_time(value: str) -> int:
+    """'now', 'now-7d', epoch seconds or an ISO datetime (naive = UTC) -> epoch seconds."""
+    value = str(value).strip()
+    if value.startswith('now'):
+        offset = value[3:]
+        return int(time.time()) - (parse_step(offset.lstrip('-')) if offset else 0)
+    try:
+        return int(float(value))
+    except ValueError:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return int(dt.timestamp())
+
+
+def plan_chunks(start_s: int, end_s: int, step_s: int, chunk_hours: float) -> list:
+    """Step-aligned, non-overlapping [start, end] ranges (both inclusive, as query_range is) covering the range."""
+    first = -(-start_s // step_s) * step_s
+    steps = max(1, min(int(chunk_hours * 3600) // step_s, MAX_POINTS_PER_REQUEST))
+    span = steps * step_s
+    chunks = []
+    s = first
+    while s <= end_s:
+        chunks.append((s, min(s + span - step_s, end_s)))
+        s += span
+    return chunks
+
+
+def register_series(session, label_sets: list, registry: dict) -> dict:
+    """fingerprint -> metric id for every label set, creating missing MetricModel rows."""
+    fingerprints = {metric_id_from_labels(labels): labels for labels in label_sets}
+    missing = [fp for fp in fingerprints if fp not in registry]
+    if missing:
+        known = session.query(MetricModel.metric_fingerprint, MetricModel.id).filter(MetricModel.metric_fingerprint.in_(missing)).all()
+        registry.update(dict(known))
+        new = [MetricModel(metric_fingerprint=fp, job=fingerprints[fp].get('job'), instance=fingerprints[fp].get('instance'))
+               for fp in missing if fp not in registry]
+        if new:
+            session.add_all(new)
+            session.flush()
+            registry.update({m.metric_fingerprint: m.id for m in new})
+    return {fp: registry.get(fp) for fp in fingerprints}
+
+
+def load_chunk(session, df: pd.DataFrame, chunk, registry: dict, register: bool = True) -> int:
+    """Store one fetched chunk; returns the number of new points written."""
+    if df.empty:
+        return 0
+    label_cols = [c for c in df.columns if c not in ('ds', 'y')]
+    groups = []
+    for key, group in df.groupby(label_cols, dropna=False):
+        key = key if isinstance(key, tuple) else (key,)
+        labels = {k: str(v) for k, v in zip(label_cols, key) if not pd.isna(v)}
+        groups.append((labels, group[['ds', 'y']]))
+
+    if register:
+        ids = register_series(session, [labels for labels, _ in groups], registry)
+    else:
+        ids = {fp: registry.get(fp) for fp in (metric_id_from_labels(labels) for labels, _ in groups)}
+
+    batches = [(ids[metric_id_from_labels(labels)], frame) for labels, frame in groups]
+    batches = [(m_id, frame) for m_id, frame in batches if m_id is not None]
+    if not batches:
+        return 0
+
+    # Skip points that are already stored (overlap with the live detector or an earlier partial run)
+    lo = datetime.fromtimestamp(chunk[0], tz=timezone.utc).replace(tzinfo=None)
+    hi = datetime.fromtimestamp(chunk[1] + 1, tz=timezone.utc).replace(tzinfo=None)
+    existing = storage.read_range(session, lo, hi, metric_ids=[m for m, _ in batches])
+    if not existing.empty:
+        seen = set(zip(existing['metric_id'].tolist(), to_epoch_seconds(existing['ds']).tolist()))
+        batches = [(m_id, frame[[(m_id, t) not in seen for t in to_epoch_seconds(frame['ds']).tolist()]]) for m_id, frame in batches]
+    written = storage.write(session, [(m_id, frame) for m_id, frame in batches if not frame.empty])
+    session.commit()
+    return written
+
+
+def run_backfill(prom, query: str, start_s: int, end_s: int, step: str = '5m', chunk_hours: float = 6,
+                 workers: int = 4, rate: float = 2.0, checkpoint_path: str = None, register: bool = True) -> dict:
+    step_s = parse_step(step)
+    chunks = plan_chunks(start_s, end_s, step_s, chunk_hours)
+    checkpoint = Checkpoint(checkpoint_path, {'query': query, 'start': start_s, 'end': end_s, 'step': step_s})
+    pending = [c for c in chunks if not checkpoint.is_done(c[0])]
+    summary = {'chunks': len(chunks), 'skipped': len(chunks) - len(pending), 'loaded': 0, 'failed': 0, 'points': 0}
+    logging.info(f"📥 [Backfill] {query}: {len(chunks)} chunks of {chunk_hours}h, {summary['skipped']} already done")
+
+    bucket = TokenBucket(rate)
+
+    def fetch(chunk):
+        bucket.acquire()
+        return prom.fetch_metric_series(query, chunk[0], chunk[1], step, raise_errors=True)
+
+    registry = {}
+    session = SessionLocal()
+    started = time.perf_counter()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            queue = list(pending)
+            in_flight = {}
+            while queue or in_flight:
+                # Bounded look-ahead keeps memory flat while the single writer catches up
+                while queue and len(in_flight) < workers * 2:
+                    chunk = queue.pop(0)
+                    in_flight[executor.submit(fetch, chunk)] = chunk
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    chunk = in_flight.pop(future)
+                    try:
+                        points = load_chunk(session, future.result(), chunk, registry, register)
+                    except Exception as e:
+                        session.rollback()
+                        storage.reset()
+                        summary['failed'] += 1
+                        logging.error(f"[Backfill] Chunk {chunk[0]}-{chunk[1]} failed (will retry on the next run): {e}")
+                        continue
+                    checkpoint.mark(chunk[0], points)
+                    summary['loaded'] += 1
+                    summary['points'] += points
+                    if summary['loaded'] % 10 == 0:
+                        logging.info(f"📥 [Backfill] {summary['loaded']}/{len(pending)} chunks, {summary['points']} points")
+    finally:
+        session.close()
+
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    logging.info(f"✅ [Backfill] {query}: {summary['loaded']} chunks loaded, {summary['points']} points, {summary['failed']} failed")
+    return summary
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill Prometheus history into the detector's history store.")
+    parser.add_argument('--query', required=True, help="PromQL selector, e.g. node_load1 or up{job=\"node\"}")
+    parser.add_argument('--start', help="Start: ISO datetime (UTC), epoch seconds or now-<duration>")
+    parser.add_argument('--end', default='now', help="End (default: now)")
+    parser.add_argument('--hours', type=float, help="Backfill the last N hours instead of --start")
+    parser.add_argument('--step', default='5m', help="Resolution (default 5m, same as the detector)")
+    parser.add_argument('--chunk-hours', type=float, default=6, help="Hours of data per request")
+    parser.add_argument('--workers', type=int, default=settings.BACKFILL_WORKERS, help="Parallel fetches")
+    parser.add_argument('--rate', type=float, default=settings.BACKFILL_RATE_LIMIT, help="Max Prometheus requests per second (0 = unlimited)")
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.json', help="Checkpoint file ('' to disable)")
+    parser.add_argument('--no-register', action='store_true', help="Only load series already registered in `metrics`")
+    parser.add_argument('--snapshot', help="Afterwards, write the analysis window as a HistoryCache snapshot (.npz)")
+    parser.add_argument('--prom-url', default=settings.PROM_URL)
+    parser.add_argument('--source', help="Name of a PROM_SOURCES source (its url, and `__source__` in the fingerprints)")
+    args = parser.parse_args(argv)
+
+    if not args.start and not args.hours:
+        parser.error("one of --start or --hours is required")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    end_s = parse_time(args.end)
+    start_s = end_s - int(args.hours * 3600) if args.hours else parse_time(args.start)
+    if start_s >= end_s:
+        parser.error("start must be before end")
+
+    Base.metadata.create_all(bind=engine)
+    if args.source:
+        source = next((s for s in load_sources() if s.name == args.source), None)
+        if source is None:
+            parser.error(f"unknown source {args.source!r} (see PROM_SOURCES)")
+        prom = source.client
+    else:
+        prom = PrometheusClient(args.prom_url, verify_ssl=not settings.PROM_SKIP_SSL)
+    summary = run_backfill(prom, args.query, start_s, end_s, args.step, args.chunk_hours, args.workers, args.rate,
+                           args.checkpoint or None, register=not args.no_register)
+
+    if args.snapshot:
+        since = datetime.fromtimestamp(int(time.time()) - settings.ANALYSIS_WINDOW_HOURS * 3600, tz=timezone.utc).replace(tzinfo=None)
+        summary['snapshot_points'] = HistoryCache.save_snapshot(args.snapshot, storage.read_since(engine, since))
+        logging.info(f"💾 [Backfill] Wrote {summary['snapshot_points']} points to snapshot {args.snapshot}")
+
+    print(json.dumps(summary, indent=2))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
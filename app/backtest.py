@@ -0,0 +1,194 @@
+"""
+Offline backtest: replay stored history through the detector and the k-of-n
+alert rule for a grid of settings, to pick CONTAMINATION,
+ANALYSIS_WINDOW_HOURS and ALERT_MIN_HITS / ALERT_WINDOW_SIZE before changing
+them in production.
+
+History comes from the database (metric_values / metric_chunks, whatever
+STORAGE_BACKEND is) or from the Parquet archive. Every combination reports
+alert volume, flapping (re-fire within --flap-window steps of a resolve) and,
+when anomalies are labelled (--labels) or injected (--inject), recall and mean
+time to detect.
+
+Usage (from the `app` directory):
+
+    PYTHONPATH=. python backtest.py --hours 336 --contamination 0.01,0.02,0.05 --rules 3/5,2/3,4/6
+    PYTHONPATH=. python backtest.py --source archive --start 2024-01-01 --end 2024-02-01 --match '^node_load' --inject 200
+"""
+import argparse
+import csv
+import json
+import logging
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from backfill import parse_time
+from core.config import settings
+from core.database import SessionLocal, engine
+from core.fingerprint import metric_name_from_fingerprint
+from clients.prometheus import parse_step
+from models.metric import MetricModel
+from services.archive import archive
+from services.backtest import align_matrix, counter_rates, sweep
+from services.calendar_features import to_epoch_seconds
+from services.counters import is_counter
+from services.storage import storage
+
+
+def _naive(epoch_s: int) -> datetime:
+    return datetime.fromtimestamp(epoch_s, tz=timezone.utc).replace(tzinfo=None)
+
+
+def load_history(source: str, start_s: int, end_s: int, step_s: int, match: str = None):
+    """(fingerprints, t0, Y) for every stored series whose metric name matches `match`."""
+    pattern = re.compile(match) if match else None
+    start, end = _naive(start_s), _naive(end_s)
+    parts = []
+    if source == 'archive':
+        for family in archive.families():
+            if pattern and not pattern.search(family):
+                continue
+            df = archive.read(family, start, end)
+            if pattern:
+                df = df[[bool(pattern.search(metric_name_from_fingerprint(fp))) for fp in df['fingerprint']]]
+            if not df.empty:
+                parts.append((df['fingerprint'].to_numpy(dtype=object), to_epoch_seconds(df['ds']), df['y'].to_numpy(dtype=np.float64)))
+    else:
+        session = SessionLocal()
+        try:
+            fingerprints = dict(session.query(MetricModel.id, MetricModel.metric_fingerprint).all())
+        finally:
+            session.close()
+        if pattern:
+            fingerprints = {m: fp for m, fp in fingerprints.items() if pattern.search(metric_name_from_fingerprint(fp))}
+        for df in storage.read_since(engine, start):
+            df = df[(df['ds'] < end) & df['metric_id'].isin(fingerprints.keys())]
+            if not df.empty:
+                parts.append((df['metric_id'].map(fingerprints).to_numpy(dtype=object), to_epoch_seconds(df['ds']), df['y'].to_numpy(dtype=np.float64)))
+
+    if not parts:
+        return np.array([], dtype=object), start_s, np.empty((0, 0))
+    ids = np.concatenate([p[0] for p in parts])
+    ts = np.concatenate([p[1] for p in parts])
+    values = np.concatenate([p[2] for p in parts])
+    return align_matrix(ids, ts, values, step_s, start_s, end_s - 1)
+
+
+def load_labels(path: str, fingerprints, t0: int, step_s: int) -> np.ndarray:
+    """CSV with `fingerprint,start` rows (start: ISO datetime or epoch seconds) -> onset slot per series (-1 = none)."""
+    index = {fp: i for i, fp in enumerate(fingerprints)}
+    onsets = np.full(len(fingerprints), -1)
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            i = index.get(row['fingerprint'])
+            if i is None:
+                continue
+            slot = (parse_time(row['start']) - t0) // step_s
+            if onsets[i] < 0 or slot < onsets[i]:
+                onsets[i] = slot
+    return onsets
+
+
+def inject_shifts(Y: np.ndarray, candidates: np.ndarray, n: int, magnitude: float, min_slot: int, seed: int = 0) -> np.ndarray:
+    """
+    Add a level shift of `magnitude` standard deviations to `n` random series
+    (from `candidates`) starting at a random slot after `min_slot`; modifies Y
+    in place and returns the onset slot per series (-1 = untouched).
+    """
+    rng = np.random.default_rng(seed)
+    onsets = np.full(len(Y), -1)
+    T = Y.shape[1]
+    if T <= min_slot + 1 or not len(candidates):
+        return onsets
+    chosen = rng.choice(candidates, size=min(n, len(candidates)), replace=False)
+    for i in chosen:
+        std = np.nanstd(Y[i])
+        onsets[i] = rng.integers(min_slot, T - 1)
+        Y[i, onsets[i]:] += magnitude * (std if std > 0 else max(1.0, abs(np.nanmean(Y[i]))))
+    return onsets
+
+
+def _floats(value: str) -> list:
+    return [float(x) for x in value.split(',') if x.strip()]
+
+
+def _rules(value: str) -> list:
+    out = []
+    for part in value.split(','):
+        hits, of = part.strip().split('/')
+        out.append((int(hits), int(of)))
+    return out
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Replay stored history through the detector for a grid of settings.")
+    parser.add_argument('--source', choices=['db', 'archive'], default='db', help="Where to read history from")
+    parser.add_argument('--start', help="Start: ISO datetime (UTC), epoch seconds or now-<duration>")
+    parser.add_argument('--end', default='now', help="End (default: now)")
+    parser.add_argument('--hours', type=float, help="Replay the last N hours instead of --start (default: LOOKBACK_HOURS)")
+    parser.add_argument('--step', default='5m', help="Detection interval to replay (default 5m)")
+    parser.add_argument('--match', help="Regex on the metric name, e.g. '^node_(load|memory)'")
+    parser.add_argument('--contamination', default=str(settings.CONTAMINATION), help="Comma-separated CONTAMINATION values")
+    parser.add_argument('--window-hours', default=str(settings.ANALYSIS_WINDOW_HOURS), help="Comma-separated ANALYSIS_WINDOW_HOURS values")
+    parser.add_argument('--rules', default=f'{settings.ALERT_MIN_HITS}/{settings.ALERT_WINDOW_SIZE}', help="Comma-separated k/n firing rules, e.g. 3/5,2/3")
+    parser.add_argument('--flap-window', type=int, default=12, help="A re-fire within this many steps of a resolve counts as a flap")
+    parser.add_argument('--labels', help="CSV of known incidents: fingerprint,start")
+    parser.add_argument('--inject', type=int, default=0, help="Inject level shifts into N random series to measure recall / time to detect")
+    parser.add_argument('--inject-sigma', type=float, default=4.0, help="Size of injected shifts in standard deviations")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--block-size', type=int, default=2000, help="Series scored per batch (bounds memory)")
+    parser.add_argument('--output', help="Also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    step_s = parse_step(args.step)
+    end_s = parse_time(args.end)
+    start_s = parse_time(args.start) if args.start else end_s - int((args.hours or settings.LOOKBACK_HOURS) * 3600)
+    if start_s >= end_s:
+        parser.error("start must be before end")
+    if args.labels and args.inject:
+        parser.error("use either --labels or --inject")
+
+    started = time.perf_counter()
+    fingerprints, t0, Y = load_history(args.source, start_s, end_s, step_s, args.match)
+    if not len(fingerprints):
+        logging.warning("⚠️ [Backtest] No history in the selected range")
+        return 1
+    names = [metric_name_from_fingerprint(fp) for fp in fingerprints]
+    counters = np.array([is_counter(n) for n in names], dtype=bool)
+    if counters.any() and settings.COUNTER_RATE_ENABLED:
+        Y[counters] = counter_rates(Y[counters], step_s)
+    up_rows = np.array([n == 'up' for n in names], dtype=bool)
+    logging.info(f"📚 [Backtest] {len(fingerprints)} series x {Y.shape[1]} steps loaded in {time.perf_counter() - started:.1f}s "
+                 f"({int(counters.sum())} counters, {int(up_rows.sum())} up series)")
+
+    onsets = None
+    if args.labels:
+        onsets = load_labels(args.labels, fingerprints, t0, step_s)
+    elif args.inject:
+        # Leave the first analysis window untouched so the baseline is learnt on clean data
+        warmup = int(max(_floats(args.window_hours)) * 3600 // step_s)
+        onsets = inject_shifts(Y, np.flatnonzero(~up_rows), args.inject, args.inject_sigma, min(warmup, Y.shape[1] // 2), args.seed)
+
+    started = time.perf_counter()
+    results = sweep(Y, up_rows, step_s, _floats(args.contamination), _floats(args.window_hours), _rules(args.rules),
+                    args.flap_window, onsets, args.block_size)
+    logging.info(f"✅ [Backtest] {len(results)} combinations evaluated in {time.perf_counter() - started:.1f}s")
+
+    columns = ['contamination', 'window_hours', 'rule', 'alerts', 'alerts_per_series_day', 'flap_rate', 'firing_fraction']
+    if onsets is not None:
+        columns += ['recall', 'mean_ttd_steps', 'alerts_unlabelled']
+    print(pd.DataFrame(results)[columns].to_string(index=False))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'series': len(fingerprints), 'steps': int(Y.shape[1]), 'step_seconds': step_s, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1 @@
+"""Benchmark harnesses for the detector (not collected by pytest)."""
@@ -0,0 +1,407 @@
+"""
+End-to-end cycle benchmark.
+
+Runs the real `main.run_cycle` (discovery -> `run_once` per query -> alerting
+-> status -> pruning) against a local FakePrometheus and a throw-away database,
+and reports per cycle: wall time, cumulative per-stage time, peak RSS, DB rows
+written and HTTP requests made. Results are printed / written as JSON so two
+runs can be compared with `--compare`.
+
+Usage (from the `app` directory):
+
+    PYTHONPATH=. python benchmarks/bench_cycle.py --scenario series-1k --scenario steady-state
+    PYTHONPATH=. python benchmarks/bench_cycle.py --output new.json --compare old.json
+
+Each scenario runs in a fresh (spawned) process so module singletons such as
+`history_cache` start empty and the peak RSS belongs to that scenario alone.
+By default a temporary SQLite file is used; pass `--database-url` to run
+against Postgres or another SQLite file (its detector tables are DROPPED and
+recreated, so this needs `--allow-reset`). In-memory SQLite is rejected: the
+cycle's worker threads would each see their own empty database.
+"""
+import argparse
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import requests
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from benchmarks.fake_prometheus import FakePrometheus, SyntheticDataset  # noqa: E402
+from sqlalchemy.engine import make_url  # noqa: E402
+
+
+# name -> dataset shape and cycle plan. The first cycle of every scenario is a
+# cold start (empty DB, full LOOKBACK_HOURS backfill); later cycles are steady state.
+SCENARIOS = {
+    'series-100': {'series': 100, 'metrics': 5, 'lookback_hours': 6, 'cycles': 3},
+    'series-1k': {'series': 1000, 'metrics': 10, 'lookback_hours': 6, 'cycles': 3},
+    'series-10k': {'series': 10000, 'metrics': 20, 'lookback_hours': 6, 'cycles': 3},
+    'series-50k': {'series': 50000, 'metrics': 50, 'lookback_hours': 6, 'cycles': 2},
+    'cold-start': {'series': 1000, 'metrics': 10, 'lookback_hours': 168, 'cycles': 1},
+    'steady-state': {'series': 1000, 'metrics': 10, 'lookback_hours': 168, 'cycles': 4, 'restart': True},
+}
+DEFAULT_SCENARIOS = ['series-100', 'series-1k', 'cold-start', 'steady-state']
+
+
+def _peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return int(peak / 1024) if sys.platform == 'darwin' else int(peak)
+
+
+class StageTimer:
+    """Accumulates wall time per stage across worker threads."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def add(self, stage, elapsed):
+        with self._lock:
+            self.seconds[stage] += elapsed
+            self.calls[stage] += 1
+
+    def wrap(self, stage, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def snapshot_and_reset(self):
+        with self._lock:
+            out = {k: {'seconds': round(v, 6), 'calls': self.calls[k]} for k, v in sorted(self.seconds.items())}
+            self.seconds.clear()
+            self.calls.clear()
+        return out
+
+
+class DbCounter:
+    """Counts rows written (per statement execution) and time spent in SQL via engine events."""
+    def __init__(self, engine, timer: StageTimer):
+        from sqlalchemy import event
+
+        self.timer = timer
+        self._lock = threading.Lock()
+        self.rows = defaultdict(int)
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+        event.listen(engine, 'after_execute', self._count)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.start = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - getattr(self._local, 'start', time.perf_counter())
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        self.timer.add('db_write' if verb in ('INSERT', 'UPDATE', 'DELETE') else 'db_read', elapsed)
+
+    def _count(self, conn, clauseelement, multiparams, params, execution_options, result):
+        # Fires once per Connection.execute(), so batched (insertmanyvalues) inserts count once.
+        if getattr(clauseelement, 'is_insert', False):
+            verb, n = 'insert', len(multiparams) or 1
+        elif getattr(clauseelement, 'is_update', False):
+            verb, n = 'update', max(result.rowcount, 0)
+        elif getattr(clauseelement, 'is_delete', False):
+            verb, n = 'delete', max(result.rowcount, 0)
+        else:
+            return
+        with self._lock:
+            self.rows[verb] += n
+
+    def snapshot_and_reset(self):
+        with self._lock:
+            out = dict(self.rows)
+            self.rows.clear()
+        return out
+
+
+def _server_call(prom_url, action):
+    return requests.get(f"{prom_url}/-/{action}", timeout=10).json()
+
+
+def _run_scenario(name, spec, workdir, result_queue):
+    """Child-process body: set up DB, seed the registry, run the cycles and report."""
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    os.chdir(workdir)
+    try:
+        import main
+        from sqlalchemy import func, insert
+        from core.config import settings
+        from core.database import SessionLocal, engine
+        from models.base import Base
+        from models.metric import MetricModel
+        from services.history_cache import history_cache
+        from services.storage import storage
+        from clients.prometheus import PrometheusClient
+        from clients.llm import LLMClient
+        from receivers import AlertManager
+        from services.anomaly_service import AnomalyEngine
+
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+
+        # The detector only analyses series registered in `metrics`, so register them all.
+        dataset = SyntheticDataset(series=spec['series'], metrics=spec['metrics'], labels=spec.get('labels', 2))
+        rows = []
+        for label_sets in dataset.series.values():
+            for labels in label_sets:
+                rows.append({
+                    'metric_fingerprint': main.metric_id_from_labels(labels),
+                    'job': labels.get('job'),
+                    'instance': labels.get('instance'),
+                })
+        with engine.begin() as conn:
+            conn.execute(insert(MetricModel), rows)
+
+        timer = StageTimer()
+        db = DbCounter(engine, timer)
+
+        prom_client = PrometheusClient(settings.PROM_URL)
+        prom_client.discover_metrics = timer.wrap('discovery', prom_client.discover_metrics)
+        prom_client.fetch_instant_metric = timer.wrap('instant_fetch', prom_client.fetch_instant_metric)
+        prom_client.fetch_metric_series = timer.wrap('range_fetch', prom_client.fetch_metric_series)
+        engine_service = AnomalyEngine()
+        engine_service.train_and_detect = timer.wrap('detection', engine_service.train_and_detect)
+        history_cache.update = timer.wrap('cache_update', history_cache.update)
+        alert_manager = AlertManager()
+        alert_manager.async_broadcast = timer.wrap('alerting', alert_manager.async_broadcast)
+        llm = LLMClient()
+        llm.explain_anomaly = timer.wrap('explanation', llm.explain_anomaly)
+        main.run_once = timer.wrap('run_once', main.run_once)
+        main.update_status_json = timer.wrap('status', main.update_status_json)
+        main.save_state = timer.wrap('state', main.save_state)
+        main.load_state = timer.wrap('state', main.load_state)
+        main.prune_history = timer.wrap('prune', main.prune_history)
+
+        start = time.perf_counter()
+        history_cache.initialize(engine, settings.ANALYSIS_WINDOW_HOURS)
+        history_init_s = time.perf_counter() - start
+        timer.snapshot_and_reset()
+        db.snapshot_and_reset()
+
+        # Virtual clock: consecutive cycles are `interval` seconds apart, like the real loop,
+        # so steady-state cycles see one new step of data instead of none.
+        interval = spec.get('interval', 300)
+        clock = int(time.time()) - interval * spec['cycles']
+
+        cycles = []
+        warm_start_s = None
+        for i in range(spec['cycles']):
+            _server_call(settings.PROM_URL, 'reset')
+            rss_before = _peak_rss_kb()
+            start = time.perf_counter()
+            main.run_cycle(prom_client, alert_manager, engine_service, llm, now_ts=clock + i * interval)
+            wall = time.perf_counter() - start
+            http = _server_call(settings.PROM_URL, 'stats')
+            cycles.append({
+                'cycle': i,
+                'phase': 'cold' if i == 0 else 'steady',
+                'wall_s': round(wall, 6),
+                'stages': timer.snapshot_and_reset(),
+                'db_rows_written': db.snapshot_and_reset(),
+                'http_requests': http['total_requests'],
+                'http_requests_by_endpoint': http['requests'],
+                'http_bytes': http['bytes_sent'],
+                'peak_rss_kb': _peak_rss_kb(),
+                'peak_rss_growth_kb': _peak_rss_kb() - rss_before,
+            })
+            if i == 0 and spec.get('restart'):
+                # Simulate a process restart: drop the in-memory cache and warm it from the DB.
+                history_cache._cache.clear()
+                start = time.perf_counter()
+                history_cache.initialize(engine, settings.ANALYSIS_WINDOW_HOURS)
+                warm_start_s = round(time.perf_counter() - start, 6)
+                timer.snapshot_and_reset()
+                db.snapshot_and_reset()
+
+        session = SessionLocal()
+        try:
+            stored_points = sum(storage.count_points(session).values())
+        finally:
+            session.close()
+
+        result_queue.put({
+            'scenario': name,
+            'series': dataset.series_count,
+            'storage_backend': storage.name,
+            'metrics': dataset.metrics,
+            'labels_per_series': 4 + dataset.extra_labels,
+            'lookback_hours': spec['lookback_hours'],
+            'history_init_s': round(history_init_s, 6),
+            'warm_start_s': warm_start_s,
+            'stored_points': stored_points,
+            'peak_rss_kb': _peak_rss_kb(),
+            'cycles': cycles,
+        })
+    except Exception as e:
+        logging.exception(f"Scenario {name} failed")
+        result_queue.put({'scenario': name, 'error': repr(e)})
+
+
+def run_scenarios(names, overrides, database_url=None, workers=None):
+    results = []
+    server = FakePrometheus(SyntheticDataset(series=1, metrics=1)).start()
+    try:
+        for name in names:
+            spec = dict(SCENARIOS[name])
+            spec.update({k: v for k, v in overrides.items() if v is not None})
+            server.dataset = SyntheticDataset(series=spec['series'], metrics=spec['metrics'], labels=spec.get('labels', 2))
+
+            with tempfile.TemporaryDirectory(prefix=f'bench-{name}-') as workdir:
+                # Settings are read from the environment at import time in the child.
+                env = {
+                    'PROM_URL': server.url,
+                    'DATABASE_URL': database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+                    'LOOKBACK_HOURS': str(spec['lookback_hours']),
+                    'ANALYSIS_WINDOW_HOURS': str(min(spec['lookback_hours'], int(os.environ.get('ANALYSIS_WINDOW_HOURS', 168)))),
+                    'METRIC_DISCOVERY_ENABLED': 'true',
+                    'METRIC_DISCOVERY_PATTERN': '.*',
+                    'TELEGRAM_ENABLED': 'false',
+                    'EMAIL_ENABLED': 'false',
+                }
+                if workers:
+                    env['MAX_WORKERS'] = str(workers)
+                saved = {k: os.environ.get(k) for k in env}
+                os.environ.update(env)
+                try:
+                    ctx = multiprocessing.get_context('spawn')
+                    queue = ctx.Queue()
+                    proc = ctx.Process(target=_run_scenario, args=(name, spec, workdir, queue))
+                    start = time.perf_counter()
+                    proc.start()
+                    result = queue.get()
+                    proc.join()
+                    result['process_wall_s'] = round(time.perf_counter() - start, 6)
+                finally:
+                    for k, v in saved.items():
+                        if v is None:
+                            os.environ.pop(k, None)
+                        else:
+                            os.environ[k] = v
+            logging.info(f"[bench] {name}: {_summary_line(result)}")
+            results.append(result)
+    finally:
+        server.stop()
+    return results
+
+
+def _summary_line(result):
+    if 'error' in result:
+        return f"ERROR {result['error']}"
+    parts = []
+    for c in result['cycles']:
+        parts.append(f"{c['phase']}#{c['cycle']}={c['wall_s']:.2f}s/{c['http_requests']}req/{sum(c['db_rows_written'].values())}rows")
+    return f"{result['series']} series, peak RSS {result['peak_rss_kb'] / 1024:.0f} MiB, " + ', '.join(parts)
+
+
+def compare(current, baseline, tolerance):
+    """Compare wall time and peak RSS per scenario/cycle; return list of regressions."""
+    base_map = {}
+    for r in baseline.get('results', []):
+        for c in r.get('cycles', []):
+            base_map[(r['scenario'], c['cycle'])] = (c, r)
+    regressions = []
+    for r in current['results']:
+        for c in r.get('cycles', []):
+            old = base_map.get((r['scenario'], c['cycle']))
+            if not old:
+                continue
+            old_c, old_r = old
+            for key, new_v, old_v in (
+                ('wall_s', c['wall_s'], old_c['wall_s']),
+                ('http_requests', c['http_requests'], old_c['http_requests']),
+                ('peak_rss_kb', r['peak_rss_kb'], old_r['peak_rss_kb']),
+            ):
+                ratio = new_v / old_v if old_v else 1.0
+                line = f"{r['scenario']:<14} cycle {c['cycle']} {key:<14} {old_v:>12} -> {new_v:>12} ({ratio:.2f}x)"
+                print(line)
+                if ratio > 1.0 + tolerance:
+                    regressions.append(line)
+    return regressions
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the detector cycle against a local Prometheus stand-in.")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS) + ['all'],
+                        help=f"Scenario to run (repeatable). Default: {', '.join(DEFAULT_SCENARIOS)}")
+    parser.add_argument('--series', type=int, help="Override the number of series")
+    parser.add_argument('--metrics', type=int, help="Override the number of metric names")
+    parser.add_argument('--labels', type=int, help="Override the number of extra labels per series")
+    parser.add_argument('--lookback-hours', type=int, help="Override LOOKBACK_HOURS (cold-start backfill size)")
+    parser.add_argument('--cycles', type=int, help="Override the number of cycles per scenario")
+    parser.add_argument('--interval', type=int, help="Virtual seconds between cycles (default 300)")
+    parser.add_argument('--workers', type=int, help="MAX_WORKERS for the cycle thread pool")
+    parser.add_argument('--database-url', help="Run against this database (PostgreSQL or file-backed SQLite) instead of a temporary SQLite file")
+    parser.add_argument('--allow-reset', action='store_true', help="Allow dropping detector tables in --database-url")
+    parser.add_argument('--output', help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument('--compare', help="Previous JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression for --compare")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.database_url and not args.allow_reset:
+        parser.error("--database-url drops and recreates the detector tables; pass --allow-reset to confirm")
+    # Same check as core.database, which cannot be imported here (it creates the engine of this process's DATABASE_URL)
+    url = make_url(args.database_url) if args.database_url else None
+    if url is not None and url.get_backend_name() == 'sqlite' and (url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'):
+        parser.error("--database-url: in-memory SQLite is not supported (worker threads would each get an empty database); "
+                     "use a file, e.g. sqlite:////tmp/bench.db")
+
+    names = args.scenario or DEFAULT_SCENARIOS
+    if 'all' in names:
+        names = list(SCENARIOS)
+    overrides = {
+        'series': args.series,
+        'metrics': args.metrics,
+        'labels': args.labels,
+        'lookback_hours': args.lookback_hours,
+        'cycles': args.cycles,
+        'interval': args.interval,
+    }
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': run_scenarios(names, overrides, args.database_url, args.workers),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
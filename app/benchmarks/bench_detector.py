@@ -0,0 +1,222 @@
+"""
+Detector micro-benchmark and accuracy harness for AnomalyEngine.
+
+Builds labelled synthetic corpora on top of `tests.test_anomaly.generate_data`
+(spikes, trends, level shifts, gaps, flat/binary `up` series, counters), then:
+
+* times `preprocess`, `add_time_features`, `detect` and `train_and_detect`
+  per series and as throughput (series/second);
+* replays the last `--horizon` points of every series as the detector would
+  see them cycle by cycle and reports precision, recall and detection latency
+  (points and minutes after the anomaly onset), overall and per kind.
+
+Usage (from the `app` directory):
+
+    PYTHONPATH=. python benchmarks/bench_detector.py --size 200 --output detector.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from tests.test_anomaly import generate_data  # noqa: E402
+from services.anomaly_service import AnomalyEngine  # noqa: E402
+
+
+STEP_MINUTES = 5
+# kind -> whether series of that kind carry an anomaly starting at the onset point
+KINDS = {
+    'normal': False,
+    'gaps': False,
+    'flat_up': False,
+    'counter': False,
+    'spike': True,
+    'trend': True,
+    'level_shift': True,
+    'up_down': True,
+}
+
+
+class Sample:
+    __slots__ = ('kind', 'fingerprint', 'df', 'onset')
+
+    def __init__(self, kind, fingerprint, df, onset=None):
+        self.kind = kind
+        self.fingerprint = fingerprint
+        self.df = df
+        self.onset = onset  # index of the first anomalous point, None for normal series
+
+
+def make_sample(kind: str, i: int, n: int, horizon: int) -> Sample:
+    """One labelled series of `n` points; anomalies start `horizon` points before the end."""
+    onset = n - horizon - 1
+    instance = f'host-{i}:9100'
+    fingerprint = f'__name__=bench_gauge|instance={instance}|job=node'
+
+    if kind == 'gaps':
+        df = generate_data(n=n, gaps=True)
+    else:
+        df = generate_data(n=n)
+    y = df['y'].to_numpy(dtype=float, copy=True)
+
+    if kind == 'spike':
+        y[onset] += 30.0
+    elif kind == 'trend':
+        y[onset:] -= np.linspace(0, 40, n - onset)
+    elif kind == 'level_shift':
+        y[onset:] += 25.0
+    elif kind in ('flat_up', 'up_down'):
+        y[:] = 1.0
+        if kind == 'up_down':
+            y[onset:] = 0.0
+        fingerprint = f'__name__=up|instance={instance}|job=node'
+    elif kind == 'counter':
+        # Cumulative counter: positive per-step increments around the base pattern
+        y = np.cumsum(np.abs(np.nan_to_num(y, nan=50.0)))
+        fingerprint = f'__name__=bench_requests_total|instance={instance}|job=node'
+
+    df['y'] = y
+    return Sample(kind, fingerprint, df, onset if KINDS[kind] else None)
+
+
+def build_corpus(size: int, n: int, horizon: int, kinds=None, seed: int = 0) -> list:
+    np.random.seed(seed)
+    kinds = kinds or list(KINDS)
+    return [make_sample(kind, i, n, horizon) for kind in kinds for i in range(size)]
+
+
+def _best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_stages(engine: AnomalyEngine, corpus: list, repeat: int = 3) -> dict:
+    """Time each engine stage over the whole corpus; inputs are copied outside the timed region."""
+    n_series = len(corpus)
+    fresh = lambda: [s.df.copy() for s in corpus]  # noqa: E731
+
+    inputs = [fresh() for _ in range(repeat)]
+    it = iter(inputs)
+    t_pre = _best_of(repeat, lambda: [engine.preprocess(df) for df in next(it)])
+
+    pre = [engine.preprocess(df) for df in fresh()]
+    t_feat = _best_of(repeat, lambda: [engine.add_time_features(df) for df in pre])
+
+    feats = [engine.add_time_features(df) for df in pre]
+    t_detect = _best_of(repeat, lambda: [engine.detect(df, fingerprint=s.fingerprint) for df, s in zip(feats, corpus)])
+
+    inputs = [fresh() for _ in range(repeat)]
+    it = iter(inputs)
+    t_total = _best_of(repeat, lambda: [engine.train_and_detect(df, fingerprint=s.fingerprint) for df, s in zip(next(it), corpus)])
+
+    out = {}
+    for stage, seconds in (('preprocess', t_pre), ('add_time_features', t_feat), ('detect', t_detect), ('train_and_detect', t_total)):
+        out[stage] = {
+            'seconds': round(seconds, 6),
+            'us_per_series': round(seconds / n_series * 1e6, 2),
+            'series_per_second': round(n_series / seconds, 1) if seconds else None,
+        }
+    return out
+
+
+def evaluate(engine: AnomalyEngine, corpus: list, horizon: int, contamination=None) -> dict:
+    """
+    Replay the last `horizon + 1` cycles of every series. A series counts as
+    detected if any replayed cycle flags it; latency is measured from the onset.
+    """
+    per_kind = {}
+    for s in corpus:
+        n = len(s.df)
+        fired_at = None
+        for end in range(n - horizon - 1, n):
+            res = engine.train_and_detect(s.df.iloc[:end + 1].copy(), contamination=contamination, fingerprint=s.fingerprint)
+            if res['is_anomaly']:
+                fired_at = end
+                break
+
+        stats = per_kind.setdefault(s.kind, {'series': 0, 'tp': 0, 'fp': 0, 'fn': 0, 'tn': 0, 'latencies': []})
+        stats['series'] += 1
+        if s.onset is not None:
+            if fired_at is not None and fired_at >= s.onset:
+                stats['tp'] += 1
+                stats['latencies'].append(fired_at - s.onset)
+            else:
+                stats['fn'] += 1
+        else:
+            stats['fp' if fired_at is not None else 'tn'] += 1
+
+    def summarize(stats):
+        tp, fp, fn = stats['tp'], stats['fp'], stats['fn']
+        lat = stats['latencies']
+        return {
+            'series': stats['series'],
+            'tp': tp, 'fp': fp, 'fn': fn, 'tn': stats['tn'],
+            'precision': round(tp / (tp + fp), 4) if tp + fp else None,
+            'recall': round(tp / (tp + fn), 4) if tp + fn else None,
+            'false_positive_rate': round(fp / (fp + stats['tn']), 4) if fp + stats['tn'] else None,
+            'mean_latency_points': round(float(np.mean(lat)), 3) if lat else None,
+            'mean_latency_minutes': round(float(np.mean(lat)) * STEP_MINUTES, 1) if lat else None,
+            'p95_latency_points': float(np.percentile(lat, 95)) if lat else None,
+        }
+
+    total = {'series': 0, 'tp': 0, 'fp': 0, 'fn': 0, 'tn': 0, 'latencies': []}
+    for stats in per_kind.values():
+        for k in ('series', 'tp', 'fp', 'fn', 'tn'):
+            total[k] += stats[k]
+        total['latencies'].extend(stats['latencies'])
+    return {'overall': summarize(total), 'by_kind': {k: summarize(v) for k, v in per_kind.items()}}
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark AnomalyEngine speed and detection quality.")
+    parser.add_argument('--size', type=int, default=50, help="Series per kind")
+    parser.add_argument('--points', type=int, default=2016, help="Points per series (2016 = 7 days at 5m)")
+    parser.add_argument('--horizon', type=int, default=6, help="Cycles replayed after the anomaly onset")
+    parser.add_argument('--kind', action='append', choices=list(KINDS), help="Restrict to these kinds (repeatable)")
+    parser.add_argument('--contamination', type=float, help="Override CONTAMINATION")
+    parser.add_argument('--repeat', type=int, default=3, help="Timing repetitions (best is reported)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-accuracy', action='store_true', help="Only run the timing part")
+    parser.add_argument('--output', help="Write the JSON report to this file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.size, args.points, args.horizon, args.kind, args.seed)
+    engine = AnomalyEngine(contamination=args.contamination)
+
+    report = {
+        'config': {
+            'size_per_kind': args.size,
+            'points': args.points,
+            'horizon': args.horizon,
+            'contamination': engine.contamination,
+            'series': len(corpus),
+            'seed': args.seed,
+        },
+        'timing': time_stages(engine, corpus, args.repeat),
+    }
+    if not args.skip_accuracy:
+        report['accuracy'] = evaluate(engine, corpus, args.horizon, args.contamination)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
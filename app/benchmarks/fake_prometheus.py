@@ -0,0 +1,273 @@
+"""
+Local Prometheus stand-in for benchmarks.
+
+Serves the subset of the HTTP API the detector uses (`query`, `query_range`,
+`label/__name__/values`, `series`) from a deterministic synthetic dataset, so
+cycle benchmarks can run without a real Prometheus. Every request is counted
+per endpoint together with the bytes sent; `/-/stats` and `/-/reset` expose
+and clear those counters without being counted themselves.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from clients.prometheus import parse_step
+
+
+# Same limit as Prometheus: query_range refuses more points per series than this.
+MAX_POINTS_PER_SERIES = 11000
+
+_SELECTOR_RE = re.compile(r'^\s*([a-zA-Z_:][a-zA-Z0-9_:]*)?\s*(?:\{(.*)\})?\s*$')
+_MATCHER_RE = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!=|=)\s*"((?:[^"\\]|\\.)*)"\s*,?')
+
+
+def parse_selector(query: str):
+    """Parse `name{a="b",c=~"d"}` into (name, [(label, op, value), ...])."""
+    m = _SELECTOR_RE.match(query or '')
+    if not m:
+        raise ValueError(f"unsupported query: {query}")
+    name, body = m.group(1), m.group(2) or ''
+    matchers = [(k, op, v) for k, op, v in _MATCHER_RE.findall(body)]
+    if name:
+        matchers.append(('__name__', '=', name))
+    return matchers
+
+
+def _matches(labels: dict, matchers) -> bool:
+    for key, op, value in matchers:
+        actual = labels.get(key, '')
+        if op == '=' and actual != value:
+            return False
+        if op == '!=' and actual == value:
+            return False
+        if op == '=~' and not re.fullmatch(value, actual):
+            return False
+    return True
+
+
+class SyntheticDataset:
+    """
+    Deterministic label sets and values for `series` series spread over
+    `metrics` metric names. Metric 0 is always `up`; every third metric is a
+    `_total` counter, the rest are daily-seasonal gauges.
+    """
+    def __init__(self, series=1000, metrics=10, labels=2, hosts=None, seed=0):
+        self.metrics = max(1, int(metrics))
+        self.series_count = max(self.metrics, int(series))
+        self.extra_labels = max(0, int(labels))
+        self.seed = seed
+
+        self.metric_names = []
+        for i in range(self.metrics):
+            if i == 0:
+                self.metric_names.append('up')
+            elif i % 3 == 0:
+                self.metric_names.append(f'bench_requests_{i}_total')
+            else:
+                self.metric_names.append(f'bench_gauge_{i}')
+
+        per_metric, remainder = divmod(self.series_count, self.metrics)
+        self.hosts = max(1, int(hosts) if hosts else max(1, per_metric // 4))
+
+        # name -> list of label dicts, and parallel arrays of per-series parameters
+        self.series = {}
+        self._params = {}
+        idx = 0
+        for i, name in enumerate(self.metric_names):
+            count = per_metric + (1 if i < remainder else 0)
+            label_sets = []
+            for k in range(count):
+                labels = {
+                    '__name__': name,
+                    'instance': f'host-{k % self.hosts}:9100',
+                    'job': 'node',
+                    'device': f'dev{k // self.hosts}',
+                }
+                for j in range(self.extra_labels):
+                    labels[f'label_{j}'] = f'value_{j}'
+                label_sets.append(labels)
+            ids = np.arange(idx, idx + count, dtype=np.float64)
+            idx += count
+            self.series[name] = label_sets
+            self._params[name] = {
+                'ids': ids,
+                'phase': (ids * 0.618034) % (2 * np.pi),
+                'level': 20.0 + (ids * 7.0) % 80.0,
+            }
+
+    def select(self, query: str):
+        """Return (metric name, indices) pairs of the series matching a selector."""
+        matchers = parse_selector(query)
+        names = self.metric_names
+        name_matchers = [m for m in matchers if m[0] == '__name__']
+        if name_matchers:
+            names = [n for n in names if _matches({'__name__': n}, name_matchers)]
+        out = []
+        for name in names:
+            sets = self.series[name]
+            idx = [k for k, labels in enumerate(sets) if _matches(labels, matchers)]
+            if idx:
+                out.append((name, idx))
+        return out
+
+    def metadata(self) -> dict:
+        """/api/v1/metadata payload: `up` and the gauges are gauges, `_total` metrics are counters."""
+        return {name: [{'type': 'counter' if name.endswith('_total') else 'gauge', 'help': '', 'unit': ''}] for name in self.metric_names}
+
+    def values(self, name: str, idx, ts: np.ndarray) -> np.ndarray:
+        """Values of the selected series of `name` at timestamps `ts` -> shape (len(idx), len(ts))."""
+        p = self._params[name]
+        ids = p['ids'][idx][:, None]
+        t = ts[None, :].astype(np.float64)
+        if name == 'up':
+            return np.ones((len(idx), len(ts)))
+        # Cheap deterministic noise in [0, 1)
+        noise = np.modf(np.abs(np.sin(t * 12.9898 + ids * 78.233 + self.seed)) * 43758.5453)[0]
+        if name.endswith('_total'):
+            rate = 1.0 + (ids % 13)
+            return np.floor(rate * (t - 1.6e9) + noise * rate)
+        daily = np.sin(2 * np.pi * t / 86400.0 + p['phase'][idx][:, None])
+        return p['level'][idx][:, None] + 10.0 * daily + noise
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self):
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+        if self.command == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            params.update(parse_qs(self.rfile.read(length).decode()))
+        return parsed.path, params
+
+    def do_POST(self):
+        self.do_GET()
+
+    def do_GET(self):
+        path, params = self._params()
+        server = self.server
+        try:
+            if path == '/api/v1/query':
+                body = server.instant(params)
+            elif path == '/api/v1/query_range':
+                body = server.range(params)
+            elif path == '/api/v1/label/__name__/values':
+                body = json.dumps({'status': 'success', 'data': list(server.dataset.metric_names)})
+            elif path == '/api/v1/series':
+                body = server.series(params)
+            elif path == '/api/v1/metadata':
+                body = json.dumps({'status': 'success', 'data': server.dataset.metadata()})
+            elif path == '/-/stats':
+                self._reply(200, json.dumps(server.stats()), path, counted=False)
+                return
+            elif path == '/-/reset':
+                server.reset_counters()
+                self._reply(200, '{}', path, counted=False)
+                return
+            else:
+                self._reply(404, json.dumps({'status': 'error', 'error': 'not found'}), path)
+                return
+            self._reply(200, body, path)
+        except ValueError as e:
+            self._reply(400, json.dumps({'status': 'error', 'errorType': 'bad_data', 'error': str(e)}), path)
+
+    def _reply(self, code, body: str, path: str, counted=True):
+        payload = body.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if counted:
+            self.server.count(path, len(payload))
+
+
+class FakePrometheus(ThreadingHTTPServer):
+    """Threaded HTTP server answering Prometheus API calls from a SyntheticDataset."""
+    daemon_threads = True
+
+    def __init__(self, dataset: SyntheticDataset, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.dataset = dataset
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-prometheus', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, path: str, size: int):
+        key = path.rsplit('/', 1)[-1] if not path.startswith('/api/v1/label/') else 'label_values'
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes_sent += size
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = {}
+            self.bytes_sent = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'requests': dict(self.requests), 'total_requests': sum(self.requests.values()), 'bytes_sent': self.bytes_sent}
+
+    def instant(self, params) -> str:
+        query = params.get('query', [''])[0]
+        ts = float(params['time'][0]) if 'time' in params else time.time()
+        result = []
+        for name, idx in self.dataset.select(query):
+            vals = self.dataset.values(name, idx, np.array([ts]))[:, 0]
+            sets = self.dataset.series[name]
+            for k, v in zip(idx, vals):
+                result.append('{"metric":%s,"value":[%.3f,"%r"]}' % (json.dumps(sets[k]), ts, float(v)))
+        return '{"status":"success","data":{"resultType":"vector","result":[%s]}}' % ','.join(result)
+
+    def range(self, params) -> str:
+        query = params.get('query', [''])[0]
+        start = float(params['start'][0])
+        end = float(params['end'][0])
+        step = parse_step(params.get('step', ['60'])[0])
+        if step <= 0 or end < start:
+            raise ValueError("invalid range")
+        n = int((end - start) // step) + 1
+        if n > MAX_POINTS_PER_SERIES:
+            raise ValueError("exceeded maximum resolution of 11,000 points per timeseries. Try decreasing the query resolution (?step=XX)")
+        ts = start + np.arange(n) * step
+        ts_text = ['%.3f' % t if t % 1 else '%d' % t for t in ts]
+        result = []
+        for name, idx in self.dataset.select(query):
+            vals = self.dataset.values(name, idx, ts)
+            sets = self.dataset.series[name]
+            for row, k in enumerate(idx):
+                points = ','.join('[%s,"%r"]' % (t, float(v)) for t, v in zip(ts_text, vals[row]))
+                result.append('{"metric":%s,"values":[%s]}' % (json.dumps(sets[k]), points))
+        return '{"status":"success","data":{"resultType":"matrix","result":[%s]}}' % ','.join(result)
+
+    def series(self, params) -> str:
+        data = []
+        for match in params.get('match[]', []):
+            for name, idx in self.dataset.select(match):
+                sets = self.dataset.series[name]
+                data.extend(sets[k] for k in idx)
+        return json.dumps({'status': 'success', 'data': data})
@@ -1,56 +1,86 @@
 import os
+import json
 import logging
 
+import requests
+
+from core.config import settings
+from core.fingerprint import metric_name_from_fingerprint
+
+
+# Map metric names to human-readable Vietnamese titles
+METRIC_TITLES = {
+    'up': 'Trạng thái Server (Uptime)',
+    'node_cpu_seconds_total': 'Sử dụng CPU',
+    'node_memory_MemAvailable_bytes': 'Bộ nhớ trống (Available)',
+    'node_memory_MemTotal_bytes': 'Tổng dung lượng RAM',
+    'node_filesystem_avail_bytes': 'Dung lượng ổ đĩa trống',
+    'node_filesystem_size_bytes': 'Tổng dung lượng ổ đĩa',
+    'node_network_receive_bytes_total': 'Băng thông Tải về (Download)',
+    'node_network_transmit_bytes_total': 'Băng thông Tải lên (Upload)',
+}
+
+NARRATIVE_PROMPT = (
+    "Bạn là kỹ sư vận hành hệ thống. Một detector phát hiện bất thường trên metric Prometheus `{family}` "
+    "(lý do: {reason}, mức độ: {severity}). Trả lời DUY NHẤT một object JSON với các khóa "
+    "\"title\" (tên ngắn của chỉ số, tiếng Việt), \"impact\" (tác động có thể xảy ra, 1 câu) và "
+    "\"action\" (hành động kiểm tra/khắc phục, 1 câu)."
+)
+
+
+def severity_bucket(confidence) -> str:
+    confidence = float(confidence or 0.0)
+    if confidence >= 0.8:
+        return 'high'
+    if confidence >= 0.5:
+        return 'medium'
+    return 'low'
+
+
+def parse_explanation(expl_raw: str) -> dict:
+    """Fallback for results without structured fields (e.g. alert state saved by older versions):
+    'last=325.040, mean=325.006, std=0.010, ...' -> {'last': 325.04, ...}."""
+    fields = {}
+    try:
+        for p in (expl_raw or '').split(', '):
+            # Handle "CRITICAL: Host is DOWN (up=0). last=0" case
+            for sp in (p.split('. ') if '. ' in p else [p]):
+                if '=' in sp:
+                    k, v = sp.split('=', 1)
+                    try:
+                        fields[k.strip().lower()] = float(v.strip())
+                    except ValueError:
+                        pass
+    except Exception:
+        pass
+    return fields
+
 
 class LLMClient:
-    """A small wrapper that returns an explainable text for an anomaly.
-    If `OPENAI_API_KEY` is set, this stub can be extended to call OpenAI.
-    For now it provides a deterministic explanation based on inputs so the
-    project runs without external credentials.
+    """Explainable text for an anomaly.
+
+    The text is a per-alert part (current value, baseline, confidence) around a
+    narrative (title / impact / action) that only depends on the metric family,
+    the reason and the severity. When LLM_API_URL is set the narrative comes
+    from an OpenAI-compatible chat completions endpoint, with a deadline of
+    LLM_TIMEOUT_SECONDS; otherwise, or when the call fails, the built-in
+    Vietnamese template is used, so the project runs without external
+    credentials.
     """
 
-    def __init__(self, api_key_env='OPENAI_API_KEY'):
+    def __init__(self, api_key_env='OPENAI_API_KEY', api_url: str = None, model: str = None, timeout: float = None):
         self.api_key = os.environ.get(api_key_env)
+        self.api_url = settings.LLM_API_URL if api_url is None else api_url
+        self.model = model or settings.LLM_MODEL
+        self.timeout = timeout or settings.LLM_TIMEOUT_SECONDS
+        self._http = requests.Session()
 
-    def explain_anomaly(self, metric_name: str, result: dict) -> str:
-        reason = result.get('reason', 'unknown')
-        conf = result.get('confidence', 0.0)
-        expl_raw = result.get('explanation', '')
-
-        # Simple parser for the raw explanation string: last=325.040, mean=325.006, std=0.010...
-        metrics = {}
-        try:
-            parts = expl_raw.split(', ')
-            for p in parts:
-                if '=' in p:
-                    # Handle "CRITICAL: Host is DOWN (up=0). last=0" case
-                    sub_parts = p.split('. ') if '. ' in p else [p]
-                    for sp in sub_parts:
-                        if '=' in sp:
-                            k, v = sp.split('=')
-                            metrics[k.strip().lower()] = v.strip()
-        except Exception:
-            pass
-
-        last = metrics.get('last', 'N/A')
-        mean = metrics.get('mean', 'N/A')
-        std = metrics.get('std', 'N/A')
-
-        # Map metric names to human-readable Vietnamese titles
-        metric_map = {
-            'up': 'Trạng thái Server (Uptime)',
-            'node_cpu_seconds_total': 'Sử dụng CPU',
-            'node_memory_MemAvailable_bytes': 'Bộ nhớ trống (Available)',
-            'node_memory_MemTotal_bytes': 'Tổng dung lượng RAM',
-            'node_filesystem_avail_bytes': 'Dung lượng ổ đĩa trống',
-            'node_filesystem_size_bytes': 'Tổng dung lượng ổ đĩa',
-            'node_network_receive_bytes_total': 'Băng thông Tải về (Download)',
-            'node_network_transmit_bytes_total': 'Băng thông Tải lên (Upload)',
-        }
-        
+    # ---- narrative -------------------------------------------------------
+
+    def template_narrative(self, family: str, reason: str) -> dict:
         friendly_name = "Chỉ số hệ thống"
-        for key, val in metric_map.items():
-            if key in metric_name:
+        for key, val in METRIC_TITLES.items():
+            if key == family or (key != 'up' and key in family):
                 friendly_name = val
                 break
 
@@ -58,36 +88,89 @@ class LLMClient:
         impact = "Có thể gây chậm hệ thống hoặc gián đoạn dịch vụ."
         action = "Kiểm tra log hệ thống và tình trạng các service đang chạy."
 
-        if 'up' in metric_name:
+        if family == 'up':
             friendly_name = "Kết nối Server"
             impact = "Server không phản hồi, toàn bộ dịch vụ trên server này bị sập."
             action = "Kiểm tra nguồn điện, kết nối mạng hoặc restart server vật lý."
-        elif 'cpu' in metric_name:
+        elif 'cpu' in family:
             impact = "Ứng dụng bị chậm, phản hồi lâu, có thể gây treo hệ thống."
             action = "Kiểm tra các tiến trình đang chiếm dụng CPU (lệnh top/htop)."
-        elif 'memory' in metric_name:
+        elif 'memory' in family:
             impact = "Hệ thống có nguy cơ bị lỗi Out-Of-Memory (OOM) và tự kill app."
             action = "Giải phóng bộ nhớ hoặc kiểm tra rò rỉ bộ nhớ (memory leak)."
-        elif 'filesystem' in metric_name:
+        elif 'filesystem' in family:
             friendly_name = "Dung lượng Ổ đĩa"
             impact = "Không thể ghi thêm dữ liệu, Database hoặc Log có thể bị lỗi."
             action = "Xóa các file log cũ hoặc mở rộng thêm dung lượng ổ đĩa."
+        return {'title': friendly_name, 'impact': impact, 'action': action, 'source': 'template'}
+
+    def remote_narrative(self, family: str, reason: str, severity: str) -> dict:
+        """Ask the model for the narrative; raises on timeout, HTTP error or an unusable answer."""
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        payload = {
+            'model': self.model,
+            'messages': [{'role': 'user', 'content': NARRATIVE_PROMPT.format(family=family, reason=reason, severity=severity)}],
+            'temperature': 0,
+        }
+        response = self._http.post(self.api_url, json=payload, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        content = response.json()['choices'][0]['message']['content'].strip()
+        if content.startswith('```'):
+            content = content.strip('`').split('\n', 1)[-1]
+        data = json.loads(content)
+        if not all(isinstance(data.get(k), str) and data[k] for k in ('title', 'impact', 'action')):
+            raise ValueError(f"incomplete narrative: {content[:200]}")
+        return {'title': data['title'], 'impact': data['impact'], 'action': data['action'], 'source': 'llm'}
+
+    def narrative(self, family: str, reason: str, severity: str) -> dict:
+        if self.api_url:
+            try:
+                return self.remote_narrative(family, reason, severity)
+            except Exception as e:
+                logging.warning(f"[LLM] Falling back to the template for {family}/{reason}: {e}")
+        return self.template_narrative(family, reason)
+
+    # ---- rendering -------------------------------------------------------
+
+    @staticmethod
+    def fields(result: dict) -> dict:
+        """Structured detector fields (last/mean/std/z/slope), parsed from `explanation` only for old results."""
+        if 'last' in result:
+            return {k: result.get(k) for k in ('last', 'mean', 'std', 'z', 'slope')}
+        return parse_explanation(result.get('explanation', ''))
 
+    @staticmethod
+    def render(result: dict, narrative: dict) -> str:
+        reason = result.get('reason', 'unknown')
+        conf = result.get('confidence', 0.0) or 0.0
+        fields = LLMClient.fields(result)
+
+        def fmt(key):
+            value = fields.get(key)
+            return f"{value:.3f}" if isinstance(value, (int, float)) else 'N/A'
+
+        last, mean, std = fmt('last'), fmt('mean'), fmt('std')
         if reason == 'host_down':
             title = "❌ SERVER KHÔNG PHẢN HỒI"
             status_text = f"Giá trị hiện tại: {last} (Phải là 1 để hoạt động)"
         else:
-            title = f"⚠️ BẤT THƯỜNG: {friendly_name.upper()}"
+            title = f"⚠️ BẤT THƯỜNG: {narrative['title'].upper()}"
             status_text = f"Giá trị hiện tại: {last}"
 
         baseline_text = f"Ngưỡng bình thường: ~{mean} (±{std})"
-        
-        text = (
+
+        return (
             f"<b>{title}</b>\n\n"
             f"📍 <b>Hiện trạng:</b> {status_text}\n"
             f"📉 <b>Ngưỡng lý tưởng:</b> {baseline_text}\n"
-            f"🔥 <b>Tác động:</b> {impact}\n"
-            f"🛡️ <b>Hành động:</b> {action}\n\n"
+            f"🔥 <b>Tác động:</b> {narrative['impact']}\n"
+            f"🛡️ <b>Hành động:</b> {narrative['action']}\n\n"
             f"<i>-- Phân tích bởi AI (Độ tin cậy: {conf*100:.0f}%) --</i>"
         )
-        return text
+
+    def explain_anomaly(self, metric_name: str, result: dict) -> str:
+        """Synchronous, template-only explanation (no network); see services/explanations.py for the async path."""
+        family = metric_name_from_fingerprint(metric_name) or metric_name
+        return self.render(result, self.template_narrative(family, result.get('reason', 'unknown')))
@@ -4,8 +4,25 @@ import logging
 import time
 from datetime import datetime, timezone
 
+from requests.adapters import HTTPAdapter
+
+from core.tracing import tracer, SPAN_KIND_CLIENT
+
+# Label added to every series of a named source (see clients/sources.py)
+SOURCE_LABEL = '__source__'
+
+
+def parse_step(step) -> int:
+    """Prometheus duration ('30s', '5m', '1h', '1d' or plain seconds) -> seconds."""
+    step = str(step).strip()
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if step and step[-1] in units:
+        return int(float(step[:-1]) * units[step[-1]])
+    return int(float(step))
+
+
 class PrometheusClient:
-    def __init__(self, base_url, verify_ssl=True):
+    def __init__(self, base_url, verify_ssl=True, source: str = None, pool_size: int = 10):
         # Tự động thêm http:// nếu người dùng quên nhập scheme
         if not base_url.startswith(('http://', 'https://')):
             base_url = f"http://{base_url}"
@@ -16,15 +33,26 @@ class PrometheusClient:
         self.query_instant_url = f"{self.base_url}/api/v1/query"
         # Sửa lại: query_range_url phải là query_range
         self.query_range_url = f"{self.base_url}/api/v1/query_range"
+        self.metadata_ttl = 3600
+        self.source = source
+        # One keep-alive connection pool per source, sized for its worker budget
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
+        self._metric_types = {}
+        self._metric_types_at = 0.0
         logging.info(f"Prometheus Client initialized at {self.base_url} (SSL Verify: {self.verify_ssl})")
 
-    def fetch_instant_metric(self, query):
-        """Lấy giá trị hiện tại (Instant Query)"""
+    @tracer.traced('prom.instant', kind=SPAN_KIND_CLIENT)
+    def fetch_instant_metric(self, query, raise_errors=False):
+        """Lấy giá trị hiện tại (Instant Query). `raise_errors` phân biệt lỗi truy vấn với kết quả rỗng."""
         params = {'query': query}
         try:
-            response = requests.get(self.query_instant_url, params=params, timeout=10, verify=self.verify_ssl)
+            response = self._http.get(self.query_instant_url, params=params, timeout=10, verify=self.verify_ssl)
             response.raise_for_status()
             data = response.json()
+            tracer.current().set(query=query, bytes=len(response.content), series=len(data.get('data', {}).get('result', [])))
             if data['status'] == 'success':
                 result = data['data']['result']
                 all_data = []
@@ -32,15 +60,23 @@ class PrometheusClient:
                     metric_info = res['metric']
                     val = res['value'] # [timestamp, value]
                     row = {k: v for k, v in metric_info.items()}
+                    if self.source:
+                        row[SOURCE_LABEL] = self.source
                     row['ds'] = datetime.fromtimestamp(val[0], tz=timezone.utc).replace(tzinfo=None)
                     row['y'] = float(val[1])
                     all_data.append(row)
                 return pd.DataFrame(all_data)
+            if raise_errors:
+                raise RuntimeError(f"Prometheus query failed: {data.get('error')}")
         except Exception as e:
+            if raise_errors:
+                raise
             logging.error(f"Error in instant query: {e}")
         return pd.DataFrame()
 
-    def fetch_metric_series(self, query, start_time, end_time, step='5m'):
+    @tracer.traced('prom.range', kind=SPAN_KIND_CLIENT)
+    def fetch_metric_series(self, query, start_time, end_time, step='5m', raise_errors=False, series_filter=None):
+        """Range query as one long DataFrame (ds, y, labels...). `series_filter(labels) -> bool` skips series before they are decoded."""
         params = {
             'query': query,
             'start': start_time,
@@ -48,7 +84,7 @@ class PrometheusClient:
             'step': step
         }
         try:
-            response = requests.get(
+            response = self._http.get(
                 self.query_range_url, 
                 params=params, 
                 timeout=30, 
@@ -56,8 +92,11 @@ class PrometheusClient:
             )
             response.raise_for_status()
             data = response.json()
+            span = tracer.current().set(query=query, bytes=len(response.content), step=str(step))
             
             if data['status'] != 'success':
+                if raise_errors:
+                    raise RuntimeError(f"Prometheus query failed: {data.get('error')}")
                 logging.error(f"Prometheus query failed: {data.get('error')}")
                 return pd.DataFrame()
 
@@ -69,6 +108,10 @@ class PrometheusClient:
             all_data = []
             for res in result:
                 metric_info = res['metric']
+                if self.source:
+                    metric_info = dict(metric_info, **{SOURCE_LABEL: self.source})
+                if series_filter is not None and not series_filter(metric_info):
+                    continue
                 values = res['values']
                 df = pd.DataFrame(values, columns=['ds', 'y'])
                 df['ds'] = pd.to_datetime(df['ds'], unit='s')
@@ -77,14 +120,20 @@ class PrometheusClient:
                     df[k] = v
                 all_data.append(df)
 
+            span.set(series=len(result), decoded=len(all_data))
             if all_data:
-                return pd.concat(all_data, ignore_index=True)
+                df_all = pd.concat(all_data, ignore_index=True)
+                span.set(points=len(df_all))
+                return df_all
             return pd.DataFrame()
 
         except Exception as e:
+            if raise_errors:
+                raise
             logging.error(f"Error fetching from Prometheus: {e}")
             return pd.DataFrame()
 
+    @tracer.traced('prom.discover', kind=SPAN_KIND_CLIENT)
     def discover_metrics(self, pattern: str = None) -> list:
         """
         Khám phá tất cả các metric name hiện có trên Prometheus.
@@ -92,7 +141,7 @@ class PrometheusClient:
         """
         url = f"{self.base_url}/api/v1/label/__name__/values"
         try:
-            response = requests.get(url, timeout=10, verify=self.verify_ssl)
+            response = self._http.get(url, timeout=10, verify=self.verify_ssl)
             response.raise_for_status()
             data = response.json()
             
@@ -104,8 +153,29 @@ class PrometheusClient:
                     # Lọc metric khớp pattern va loai bo cac metric noi bo cua prometheus
                     metrics = [m for m in metrics if regex.match(m)]
                 
+                tracer.current().set(metrics=len(metrics))
                 return sorted(metrics)
         except Exception as e:
             logging.error(f"Error discovering metrics: {e}")
         
         return []
+
+    def fetch_metric_types(self) -> dict:
+        """
+        Metric name -> type ('counter', 'gauge', 'histogram', ...) from
+        /api/v1/metadata, cached for `metadata_ttl` seconds. Returns the last
+        known (possibly empty) mapping when the endpoint is unavailable.
+        """
+        if self._metric_types_at and time.time() - self._metric_types_at < self.metadata_ttl:
+            return self._metric_types
+        url = f"{self.base_url}/api/v1/metadata"
+        try:
+            response = self._http.get(url, timeout=10, verify=self.verify_ssl)
+            response.raise_for_status()
+            data = response.json()
+            if data['status'] == 'success':
+                self._metric_types = {name: entries[0].get('type') for name, entries in data['data'].items() if entries}
+        except Exception as e:
+            logging.warning(f"Error fetching metric metadata: {e}")
+        self._metric_types_at = time.time()
+        return self._metric_types
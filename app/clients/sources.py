@@ -0,0 +1,66 @@
+"""
+Metric sources: several Prometheus-compatible endpoints (Prometheus,
+VictoriaMetrics, Thanos Query...) analysed by one detector.
+
+PROM_SOURCES is a JSON list, e.g.
+
+    [{"name": "hn", "url": "http://prom-hn:9090"},
+     {"name": "eu", "url": "https://vm-eu:8428", "workers": 4, "pattern": "^node_.*", "step": "1m"}]
+
+Each source has its own pooled client, worker budget (default MAX_WORKERS),
+discovery pattern (default METRIC_DISCOVERY_PATTERN) and step (default 5m).
+Series of a named source carry a `__source__=<name>` label, so the same series
+scraped by two sources are two fingerprints. Without PROM_SOURCES the single
+PROM_URL source is unnamed and fingerprints are unchanged.
+"""
+import json
+
+from core.config import settings
+from clients.prometheus import PrometheusClient, SOURCE_LABEL
+
+KEY_SEPARATOR = '::'
+
+
+def query_key(source: str, query: str) -> str:
+    """Unit of work of a cycle (sharding, cardinality): the query, prefixed by its source when named."""
+    return f"{source}{KEY_SEPARATOR}{query}" if source else query
+
+
+def split_query_key(key: str) -> tuple:
+    """Inverse of query_key -> (source or None, query)."""
+    if KEY_SEPARATOR in key and settings.PROM_SOURCES:
+        source, query = key.split(KEY_SEPARATOR, 1)
+        return source, query
+    return None, key
+
+
+class PromSource:
+    def __init__(self, name: str, url: str, workers: int = None, pattern: str = None, step: str = None,
+                 verify_ssl: bool = None, client: PrometheusClient = None):
+        self.name = name or None
+        self.url = url
+        self.workers = int(workers or settings.MAX_WORKERS)
+        self.pattern = pattern or settings.METRIC_DISCOVERY_PATTERN
+        self.step = step or '5m'
+        verify_ssl = not settings.PROM_SKIP_SSL if verify_ssl is None else verify_ssl
+        self.client = client or PrometheusClient(url, verify_ssl=verify_ssl, source=self.name, pool_size=self.workers)
+
+    def __repr__(self):
+        return f"PromSource({self.name or 'default'}, {self.url})"
+
+    @classmethod
+    def default(cls, client: PrometheusClient = None) -> 'PromSource':
+        return cls(None, client.base_url if client else settings.PROM_URL, client=client)
+
+
+def load_sources(raw: str = None) -> list:
+    """Sources from PROM_SOURCES, or the single PROM_URL source."""
+    raw = settings.PROM_SOURCES if raw is None else raw
+    if not raw:
+        return [PromSource.default()]
+    entries = json.loads(raw)
+    names = [e.get('name') for e in entries]
+    if not all(names) or len(set(names)) != len(names):
+        raise ValueError("PROM_SOURCES: every source needs a unique 'name'")
+    return [PromSource(e['name'], e['url'], e.get('workers'), e.get('pattern'), e.get('step'), e.get('verify_ssl'))
+            for e in entries]
@@ -1,13 +1,30 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
 
-engine = create_engine(
-    settings.DATABASE_URL, 
-    echo=False,
-    pool_size=20,          # Tăng pool size để chịu tải 10 luồng parallel
-    max_overflow=20,       # Cho phép tràn thêm 20 connection nữa khi cao điểm
-    pool_timeout=30        # Chờ tối đa 30s
-)
+def is_memory_sqlite(url) -> bool:
+    """In-memory SQLite: every connection (so every worker thread) would see its own empty database."""
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and (url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory')
+
+
+def engine_options(url) -> dict:
+    """create_engine() keyword arguments for DATABASE_URL."""
+    if make_url(url).get_backend_name() == 'sqlite':
+        # File-backed SQLite (tests, benchmarks): SQLAlchemy's default pool, the Postgres sizing does not apply
+        return {'echo': False}
+    return {
+        'echo': False,
+        'pool_size': 20,       # Tăng pool size để chịu tải 10 luồng parallel
+        'max_overflow': 20,    # Cho phép tràn thêm 20 connection nữa khi cao điểm
+        'pool_timeout': 30,    # Chờ tối đa 30s
+    }
+
+
+if is_memory_sqlite(settings.DATABASE_URL):
+    raise RuntimeError(f"DATABASE_URL={settings.DATABASE_URL}: in-memory SQLite is not supported, "
+                       f"use a file (e.g. sqlite:////tmp/detector.db) or PostgreSQL")
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
@@ -0,0 +1,19 @@
+def metric_id_from_labels(labels: dict) -> str:
+    items = sorted(labels.items())
+    return '|'.join(f"{k}={v}" for k, v in items)
+
+
+def labels_from_fingerprint(fingerprint: str) -> dict:
+    """Inverse of metric_id_from_labels: 'a=1|b=2' -> {'a': '1', 'b': '2'}."""
+    labels = {}
+    for part in fingerprint.split('|'):
+        if '=' in part:
+            k, v = part.split('=', 1)
+            labels[k] = v
+    return labels
+
+
+def metric_name_from_fingerprint(fingerprint: str) -> str:
+    if fingerprint.startswith('__name__='):
+        return fingerprint[len('__name__='):].split('|', 1)[0]
+    return labels_from_fingerprint(fingerprint).get('__name__', '')
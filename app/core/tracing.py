@@ -0,0 +1,292 @@
+"""
+Lightweight cycle tracing with OpenTelemetry-compatible output (no SDK needed).
+
+One trace per detection cycle: `tracer.trace('cycle')` decides once, with
+probability TRACE_SAMPLE_RATIO (head sampling), whether the cycle is recorded.
+Inside a sampled trace `tracer.span(name, **attrs)` records a child span of the
+current one; in an unsampled trace (or with tracing off) it returns a shared
+no-op span, so the cost is one contextvar lookup. Spans are per query / per
+stage, never per series, so a 10k-series cycle produces a few hundred spans.
+
+The current span lives in a contextvar: work handed to another thread keeps
+its parent with `tracer.wrap(fn)` (executor.submit(tracer.wrap(fn), ...)),
+and a queued job carries it as a W3C `traceparent()` string.
+
+Finished spans are exported by a background thread, grouped as OTLP/JSON
+`ExportTraceServiceRequest` documents:
+- TRACE_FILE: one document per line, rotated at TRACE_FILE_MAX_MB with
+  TRACE_FILE_BACKUPS old files (the layout of the collector's file exporter);
+- TRACE_OTLP_ENDPOINT: POSTed to an OTLP/HTTP collector, e.g.
+  http://localhost:4318/v1/traces.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+
+import requests
+
+from core.config import settings
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = contextvars.ContextVar('aiops_span', default=None)
+
+
+def _attr_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_attributes(attrs: dict) -> list:
+    return [{'key': k, 'value': _attr_value(v)} for k, v in attrs.items() if v is not None]
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns', 'attributes', 'error', '_tracer', '_token')
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: str = None, kind: int = SPAN_KIND_INTERNAL, attributes: dict = None):
+        self._tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._token = None
+
+    @property
+    def sampled(self) -> bool:
+        return True
+
+    def set(self, **attrs):
+        self.attributes.update(attrs)
+        return self
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.end()
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+        return False
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self._tracer._finish(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': otlp_attributes(self.attributes),
+            'status': {'code': STATUS_ERROR, 'message': self.error} if self.error else {'code': STATUS_OK},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stands for every span of an unsampled trace."""
+    sampled = False
+    trace_id = span_id = None
+
+    def set(self, **attrs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _NoopTrace(_NoopSpan):
+    """Root of an unsampled trace: children see it as current and stay no-ops."""
+    def __enter__(self):
+        self._token = _current.set(NOOP_SPAN)
+        return self
+
+    def __exit__(self, *exc):
+        _current.reset(self._token)
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled: bool = None, sample_ratio: float = None, path: str = None, endpoint: str = None,
+                 max_bytes: int = None, backups: int = None, flush_seconds: float = None, service_name: str = 'aiops-detector'):
+        self.enabled = settings.TRACING_ENABLED if enabled is None else enabled
+        self.sample_ratio = settings.TRACE_SAMPLE_RATIO if sample_ratio is None else sample_ratio
+        self.path = settings.TRACE_FILE if path is None else path
+        self.endpoint = settings.TRACE_OTLP_ENDPOINT if endpoint is None else endpoint
+        self.max_bytes = max_bytes or settings.TRACE_FILE_MAX_MB * 1024 * 1024
+        self.backups = settings.TRACE_FILE_BACKUPS if backups is None else backups
+        self.flush_seconds = flush_seconds or 2.0
+        self.resource = otlp_attributes({'service.name': service_name, 'host.name': socket.gethostname(), 'process.pid': os.getpid()})
+        self._queue = queue.Queue(maxsize=100000)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    # ---- recording ---------------------------------------------------------
+
+    def trace(self, name: str, **attrs):
+        """Root span of a new trace, sampled with probability `sample_ratio`."""
+        if not self.enabled or random.random() >= self.sample_ratio:
+            return _NoopTrace()
+        self._ensure_exporter()
+        return Span(self, name, f"{random.getrandbits(128):032x}", attributes=attrs)
+
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attrs):
+        """Child of the current span (no-op outside a sampled trace)."""
+        parent = _current.get()
+        if parent is None or not parent.sampled:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, kind, attrs)
+
+    def traced(self, name: str, root: bool = False, kind: int = SPAN_KIND_INTERNAL):
+        """Decorator: run the function in a span (the root of a new trace with root=True); attributes go through current().set()."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with (self.trace(name) if root else self.span(name, kind)):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def current():
+        return _current.get() or NOOP_SPAN
+
+    @staticmethod
+    def wrap(fn):
+        """Run `fn` in another thread under the caller's current span."""
+        ctx = contextvars.copy_context()
+        return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+    @staticmethod
+    def traceparent():
+        """W3C traceparent of the current span (None when not sampled), to carry a trace across a queue."""
+        span = _current.get()
+        return f"00-{span.trace_id}-{span.span_id}-01" if span is not None and span.sampled else None
+
+    def span_from(self, traceparent: str, name: str, kind: int = SPAN_KIND_INTERNAL, **attrs):
+        """Child of a span recorded earlier (see traceparent())."""
+        if not self.enabled or not traceparent:
+            return NOOP_SPAN
+        _, trace_id, parent_id, _ = traceparent.split('-')
+        self._ensure_exporter()
+        return Span(self, name, trace_id, parent_id, kind, attrs)
+
+    # ---- export ----------------------------------------------------------------
+
+    def _finish(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_exporter(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < 5000:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception as e:
+                logging.warning(f"[Trace] Export of {len(batch)} spans failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def document(self, spans) -> dict:
+        return {'resourceSpans': [{
+            'resource': {'attributes': self.resource},
+            'scopeSpans': [{'scope': {'name': 'aiops.detector'}, 'spans': [s.to_otlp() for s in spans]}],
+        }]}
+
+    def export(self, spans):
+        doc = self.document(spans)
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            line = json.dumps(doc, separators=(',', ':')) + '\n'
+            self._rotate(len(line))
+            with open(self.path, 'a') as f:
+                f.write(line)
+        if self.endpoint:
+            requests.post(self.endpoint, json=doc, timeout=5).raise_for_status()
+
+    def _rotate(self, incoming: int):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size + incoming <= self.max_bytes:
+            return
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+tracer = Tracer()
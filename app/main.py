@@ -1,27 +1,55 @@
 import os
+import signal
 import time
 import json
 import logging
 import requests
+import concurrent.futures
+import functools
 from datetime import datetime, timedelta, timezone
 
 from core.config import settings
-from clients.prometheus import PrometheusClient
+from core.tracing import tracer
+from core.fingerprint import metric_id_from_labels, metric_name_from_fingerprint, labels_from_fingerprint
+from clients.prometheus import parse_step
 from clients.llm import LLMClient
+from clients.sources import PromSource, load_sources, query_key, split_query_key, SOURCE_LABEL
 from receivers import AlertManager
+from receivers.dispatcher import dispatcher
 from services.anomaly_service import AnomalyEngine
 from core.database import SessionLocal, engine
 from services.history_cache import history_cache
+from services.calendar_features import calendar_features
+from services.cardinality import cardinality_guard
+from services.sharding import shard_coordinator, MAINTENANCE_KEY
+from services.events import event_recorder, migrate as migrate_events
+from services.explanations import ExplanationService
+from services.results import DetectionResult, ResultTable
+from services.api import status_api
+from services.alert_groups import alert_grouper
+from services.aggregates import aggregator
+from services.correlation import correlator, related_summary
+from services.forecast import capacity_forecaster, capacity_summary
+from services.counters import is_counter
+from services.rollups import compact_and_prune, compact_raw
+from services.storage import storage
 from models.base import Base
-from models.metric import MetricModel, MetricValue
-from sqlalchemy import func
+from models.metric import AlertState, MetricModel
+from sqlalchemy import func, or_
+import numpy as np
 import pandas as pd
 
 
+# Sharded replicas keep their alert state in the alert_state table (one row per series), not in a file named
+# after a replica id that changes on restart: a restarted replica and the new owner of a shard pick it up there
 STATE_FILE = 'alerts_state.json'
+STATUS_FILE = f'status.{shard_coordinator.replica_id}.json' if settings.SHARDING_ENABLED else 'status.json'
+_shared_rows = {}  # fingerprint -> JSON of the alert_state rows this replica loaded last (SHARDING_ENABLED)
 
 
 def load_state():
+    if settings.SHARDING_ENABLED:
+        return load_shared_state()
     if os.path.exists(STATE_FILE):
         try:
             with open(STATE_FILE, 'r') as f:
@@ -32,13 +60,54 @@ def load_state():
 
 
 def save_state(state):
+    if settings.SHARDING_ENABLED:
+        return save_shared_state(state)
     with open(STATE_FILE, 'w') as f:
         json.dump(state, f)
 
 
-def metric_id_from_labels(labels: dict) -> str:
-    items = sorted(labels.items())
-    return '|'.join(f"{k}={v}" for k, v in items)
+def load_shared_state() -> dict:
+    """Alert state of the series of the owned shards (and of the aggregates built here) from alert_state."""
+    global _shared_rows
+    owned, aggregates = list(shard_coordinator.owned), list(aggregator.series())
+    session = SessionLocal()
+    try:
+        rows = session.query(AlertState.metric_fingerprint, AlertState.state).filter(
+            or_(AlertState.query_key.in_(owned), AlertState.metric_fingerprint.in_(aggregates))).all() if owned or aggregates else []
+    finally: session.close()
+    state = {"windows": {}, "firing": {}, "last_alert_at": {}, "capacity": {}}
+    for fp, text in rows:
+        for part, value in json.loads(text).items():
+            state.setdefault(part, {})[fp] = value
+    _shared_rows = dict(rows)
+    return state
+
+
+def save_shared_state(state: dict):
+    """Write the changed series of `state` to alert_state; rows loaded here and no longer in `state` are deleted."""
+    global _shared_rows
+    entries = {}
+    for part, values in state.items():
+        for fp, value in values.items():
+            entries.setdefault(fp, {})[part] = value
+    # A clean window is the same as no window: only series with something to remember get a row
+    rows = {fp: json.dumps(e, sort_keys=True) for fp, e in entries.items()
+            if any(e.get('windows', ())) or any(v for part, v in e.items() if part != 'windows')}
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    session = SessionLocal()
+    try:
+        gone = [fp for fp in _shared_rows if fp not in rows]
+        for lo in range(0, len(gone), 1000):
+            session.query(AlertState).filter(AlertState.metric_fingerprint.in_(gone[lo:lo + 1000])).delete(synchronize_session=False)
+        for fp, text in rows.items():
+            if _shared_rows.get(fp) != text:
+                session.merge(AlertState(metric_fingerprint=fp, query_key=query_key_of(fp), state=text, updated_at=now))
+        session.commit()
+        _shared_rows = rows
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Error saving alert state: {e}")
+    finally: session.close()
 
 
 def labels_to_selector(metric_name: str, labels: dict) -> str:
@@ -50,35 +119,64 @@ def labels_to_selector(metric_name: str, labels: dict) -> str:
     return f"{metric_name}{{{','.join(parts)}}}"
 
 
-def update_status_json(state):
+@tracer.traced('status')
+def update_status_json(state, results: ResultTable = None):
+    results = results if results is not None else ResultTable()
     session = SessionLocal()
     try:
         metrics_status = []
+        row_of = results.index()
         active_metrics = session.query(MetricModel).all()
+        if settings.SHARDING_ENABLED:
+            active_metrics = [m for m in active_metrics if query_key_of(m.metric_fingerprint) in shard_coordinator.owned]
+        points_count = storage.count_points(session)
+        full_state = state if isinstance(state.get('windows'), dict) else {"windows": state, "firing": {}}
         
-        for m_obj in active_metrics:
-            mid = m_obj.metric_fingerprint
-            full_state = state if isinstance(state.get('windows'), dict) else {"windows": state, "firing": {}}
+        # Aggregates live in the history cache only (negative ids)
+        aggregates = aggregator.series()
+        forecast_of = {f['fingerprint']: f for f in capacity_forecaster.latest}
+        series = [(m.metric_fingerprint, m.job, m.instance, points_count.get(m.id, 0), {}) for m in active_metrics]
+        for mid, agg_id in aggregates.items():
+            labels, cached = labels_from_fingerprint(mid), history_cache.peek(agg_id)
+            series.append((mid, labels.get('job'), labels.get('instance'), 0 if cached is None else len(cached), {'aggregate': True}))
+
+        for mid, job, instance, count, extra in series:
             window = full_state.get('windows', {}).get(mid, [])
-            is_firing = full_state.get('firing', {}).get(mid, False)
+            is_firing = mid in full_state.get('firing', {})
             
-            count = session.query(func.count(MetricValue.id)).filter_by(metric_id=m_obj.id).scalar()
             metrics_status.append({
                 'fingerprint': mid,
-                'job': m_obj.job,
-                'instance': m_obj.instance,
+                'job': job,
+                'instance': instance,
                 'points_count': count,
                 'stage': 'MONITORING' if count >= 20 else 'LEARNING',
                 'is_unstable': sum(window) > 0,
-                'is_firing': is_firing
+                'is_firing': is_firing,
+                **extra
             })
+            i = row_of.get(mid)
+            if i is not None:
+                metrics_status[-1].update({'reason': results.reason[i], 'z': None if np.isnan(results.z[i]) else round(float(results.z[i]), 3),
+                                           'confidence': round(float(results.confidence[i]), 3)})
+            forecast = forecast_of.get(mid)
+            if forecast is not None:
+                metrics_status[-1].update({'exhaustion_hours': forecast['exhaustion_hours'],
+                                           'exhaustion_band': [forecast['lower_hours'], forecast['upper_hours']]})
             
         status_payload = {
             'last_run': datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
             'total_series': len(metrics_status),
+            'cardinality': cardinality_guard.report(),
+            'last_cycle': results.summary(),
+            'alert_groups': dict(alert_grouper.stats),
+            'forecasts': [f for f in capacity_forecaster.latest if f['exhaustion_hours'] is not None],
             'metrics': metrics_status
         }
-        with open('status.json', 'w') as f:
+        if settings.SHARDING_ENABLED:
+            status_payload['replica'] = {'id': shard_coordinator.replica_id, 'members': shard_coordinator.ring.members, 'queries': len(shard_coordinator.owned)}
+        # The HTTP API answers from this snapshot; status.json is kept for existing consumers
+        status_api.publish(status_payload, full_state.get('firing', {}), {**{m.metric_fingerprint: m.id for m in active_metrics}, **aggregates})
+        with open(STATUS_FILE, 'w') as f:
             json.dump(status_payload, f, indent=2)
     except Exception as e:
         logging.error(f"Error updating status.json: {e}")
@@ -86,34 +184,69 @@ def update_status_json(state):
         session.close()
 
 
-def run_once(prom, alert_manager, engine_service, llm, query=None, lookback_hours=None, step='5m'):
+@tracer.traced('run_once')
+def run_once(prom, alert_manager, engine_service, llm, query=None, lookback_hours=None, step='5m', now_ts=None, metric_types=None, checked=None):
+    """
+    Sync and analyse the series of one query. Once the query completed, the ids of all
+    its registered series (reported or not) are appended to `checked`: only those can
+    expire from the history cache, a failing query does not make its series look gone.
+    """
     query = query or settings.PROM_QUERY
+    tracer.current().set(query=query, source=prom.source)
     lookback_hours = lookback_hours or settings.LOOKBACK_HOURS
-    now_ts = int(time.time())
+    now_ts = now_ts or int(time.time())
+    step_seconds = parse_step(step)
+    checked = checked if checked is not None else []
 
     # 1. Fetch current active series labels
-    df_active = prom.fetch_instant_metric(query)
-    if df_active.empty:
-        return {}
+    try:
+        df_active = prom.fetch_instant_metric(query, raise_errors=True)
+    except Exception as e:
+        logging.error(f"Error in instant query ({query}): {e}")
+        return ResultTable()
     
     session = SessionLocal()
-    state_updates = {"windows": {}, "firing": {}}
+    results = []
+    new_batches = []
     
     try:
         # Load Metric Models for mapping mid -> m_id
-        metric_models = session.query(MetricModel).filter(MetricModel.metric_fingerprint.like(f"__name__={query}%")).all()
+        metric_models = session.query(MetricModel).filter(series_of_query(query, prom.source)).all()
         mid_map = {m.metric_fingerprint: m for m in metric_models}
+        if df_active.empty:
+            checked.extend(m.id for m in metric_models)
+            return ResultTable()
+
+        # Cardinality guard: cap the series analysed for this query before the range result is decoded
+        group_keys = [c for c in df_active.columns if c not in ('ds', 'y')]
+        active_fps = [metric_id_from_labels({k: str(v) for k, v in zip(group_keys, row)})
+                      for row in df_active[group_keys].itertuples(index=False, name=None)]
+        registered = [fp for fp in active_fps if fp in mid_map]
+        with tracer.span('cardinality', series=len(registered)) as span:
+            allowed = cardinality_guard.select(query_key(prom.source, query), registered, history=lambda fp: history_cache.peek(mid_map[fp].id))
+            span.set(kept=len(allowed))
+        series_filter = None
+        if len(allowed) < len(registered):
+            if not allowed:
+                checked.extend(m.id for m in metric_models)
+                return ResultTable()
+            df_active = df_active[[fp in allowed for fp in active_fps]]
+            series_filter = lambda labels: metric_id_from_labels({k: str(labels.get(k, float('nan'))) for k in group_keys}) in allowed
         
         # 2. Determine fetch_start (only for the window since last sync)
         earliest_ts = None
         if metric_models:
             ids = [m.id for m in metric_models]
-            earliest_ts = session.query(func.max(MetricValue.timestamp)).filter(MetricValue.metric_id.in_(ids)).scalar()
+            earliest_ts = storage.last_timestamp(session, ids)
         
-        fetch_start = int(earliest_ts.timestamp()) + 1 if earliest_ts else int((datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=lookback_hours)).timestamp())
+        # Keep every series on the same step grid (timestamps in DB are naive UTC)
+        if earliest_ts:
+            fetch_start = (int(earliest_ts.replace(tzinfo=timezone.utc).timestamp()) // step_seconds + 1) * step_seconds
+        else:
+            fetch_start = (now_ts - lookback_hours * 3600) // step_seconds * step_seconds
         
         # 3. Delta Sync from Prometheus
-        df_all_deltas = prom.fetch_metric_series(query, fetch_start, now_ts, step)
+        df_all_deltas = prom.fetch_metric_series(query, fetch_start, now_ts, step, series_filter=series_filter) if fetch_start <= now_ts else pd.DataFrame()
         
         if not df_all_deltas.empty:
             label_cols = [c for c in df_all_deltas.columns if c not in ('ds', 'y')]
@@ -122,58 +255,70 @@ def run_once(prom, alert_manager, engine_service, llm, query=None, lookback_hour
 
         # Prepare Delta Map for O(1) lookup
         delta_map = {}
-        if not df_all_deltas.empty:
-            # Pre-convert all labels to string for reliable mapping
-            df_lookup = df_all_deltas.copy()
-            for col in label_cols:
-                df_lookup[col] = df_lookup[col].astype(str)
-            
-            for name, group in df_lookup.groupby(label_cols, dropna=False):
-                name_tuple = (name,) if not isinstance(name, tuple) else name
-                delta_map[name_tuple] = group
+        with tracer.span('delta_map', points=len(df_all_deltas)) as span:
+            if not df_all_deltas.empty:
+                # Pre-convert all labels to string for reliable mapping
+                df_lookup = df_all_deltas.copy()
+                for col in label_cols:
+                    df_lookup[col] = df_lookup[col].astype(str)
+
+                for name, group in df_lookup.groupby(label_cols, dropna=False):
+                    name_tuple = (name,) if not isinstance(name, tuple) else name
+                    delta_map[name_tuple] = group
+            span.set(series=len(delta_map))
 
         # 4. Process each active series
-        group_keys = [c for c in df_active.columns if c not in ('ds', 'y')]
         series_groups = list(df_active.groupby(group_keys, dropna=False))
 
-        all_new_values = []
-        for group_val, group_df in series_groups:
-            # group_val is already a tuple (or single val) and matches label_cols
-            group_tuple = (group_val,) if not isinstance(group_val, tuple) else group_val
-            group_labels = {k: str(v) for k, v in zip(group_keys, group_tuple)}
-            mid_key = metric_id_from_labels(group_labels)
-            m_obj = mid_map.get(mid_key)
-            if not m_obj: continue
-
-            # O(1) Lookup instead of O(N) Masking
-            df_s_delta = delta_map.get(group_tuple, pd.DataFrame())
-            if not df_s_delta.empty:
-                history_cache.update(m_obj.id, df_s_delta)
-                for _, r in df_s_delta.iterrows():
-                    all_new_values.append(MetricValue(metric_id=m_obj.id, timestamp=r['ds'], value=r['y']))
-
-            # Analysis
-            df_hist = history_cache.get_history(m_obj.id)
-            if not df_hist.empty and len(df_hist) >= 5:
-                res_anom = engine_service.train_and_detect(df_hist, fingerprint=mid_key)
-                state_updates["windows"][mid_key] = res_anom['is_anomaly']
-                state_updates["firing"][mid_key] = res_anom
+        analysed = []
+        with tracer.span('cache_update') as span:
+            for group_val, group_df in series_groups:
+                # group_val is already a tuple (or single val) and matches label_cols
+                group_tuple = (group_val,) if not isinstance(group_val, tuple) else group_val
+                group_labels = {k: str(v) for k, v in zip(group_keys, group_tuple)}
+                mid_key = metric_id_from_labels(group_labels)
+                m_obj = mid_map.get(mid_key)
+                if not m_obj: continue
+                analysed.append((mid_key, m_obj))
+
+                # O(1) Lookup instead of O(N) Masking
+                df_s_delta = delta_map.get(group_tuple, pd.DataFrame())
+                if not df_s_delta.empty:
+                    # Raw values go to the DB; counters are cached and analysed as per-second rates
+                    counter = settings.COUNTER_RATE_ENABLED and is_counter(group_labels.get('__name__', query), metric_types)
+                    history_cache.update(m_obj.id, df_s_delta, is_counter=counter)
+                    new_batches.append((m_obj.id, df_s_delta))
+            span.set(series=len(analysed), updated=len(new_batches), points=sum(len(df) for _, df in new_batches))
+
+        # Analysis
+        with tracer.span('detect', series=len(analysed)) as span:
+            for mid_key, m_obj in analysed:
+                df_hist = history_cache.get_history(m_obj.id)
+                if not df_hist.empty and len(df_hist) >= 5:
+                    res_anom = engine_service.train_and_detect(df_hist, fingerprint=mid_key, baseline=history_cache.get_baseline(m_obj.id))
+                    results.append((mid_key, res_anom))
+            span.set(analysed=len(results), anomalies=sum(1 for _, r in results if r.is_anomaly))
 
         # Batch Save new points to Postgres for durability
-        if all_new_values:
-            session.add_all(all_new_values)
-            session.flush()
-            logging.info(f"Saved {len(all_new_values)} points for {query}")
+        if new_batches:
+            with tracer.span('db_flush', series=len(new_batches)) as span:
+                saved = storage.write(session, new_batches)
+                session.flush()
+                span.set(points=saved)
+            logging.info(f"Saved {saved} points for {query}")
 
         session.commit()
+        checked.extend(m.id for m in metric_models)
         logging.info(f"✅ Finished metric: {query}")
     except Exception as e:
         session.rollback()
+        # Only this query's head chunks may be ahead of the DB: the other workers are still writing theirs
+        storage.reset([m_id for m_id, _ in new_batches])
         logging.error(f"Error in run_once ({query}): {e}")
     finally:
         session.close()
 
-    return state_updates
+    return ResultTable.from_results(results)
 
 
 def wait_for_db(timeout=60):
@@ -189,112 +334,499 @@ def wait_for_db(timeout=60):
     return False
 
 
-def wait_for_prometheus(timeout=60):
+def wait_for_prometheus(timeout=60, url=None):
     start_time = time.time()
     while time.time() - start_time < timeout:
         try:
-            requests.get(f"{settings.PROM_URL}/api/v1/query?query=up", timeout=5, verify=not settings.PROM_SKIP_SSL)
+            requests.get(f"{url or settings.PROM_URL}/api/v1/query?query=up", timeout=5, verify=not settings.PROM_SKIP_SSL)
             return True
         except Exception:
             time.sleep(5)
     return False
 
 
-import concurrent.futures
+def instance_from_fingerprint(mid: str) -> str:
+    return mid.split('|instance=')[1].split('|')[0] if '|instance=' in mid else mid
+
+
+@tracer.traced('prune')
+def prune_history():
+    session = SessionLocal()
+    try:
+        if settings.ROLLUP_ENABLED:
+            # Raw points beyond RAW_RETENTION_HOURS are compacted into rollup tiers, not just dropped
+            compact_and_prune(session)
+        else:
+            prune_limit = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=settings.LOOKBACK_HOURS)
+            if settings.ARCHIVE_ENABLED:
+                # Export to the Parquet archive hour by hour before the points are deleted
+                compact_raw(session, prune_limit, tiers=[])
+            else:
+                storage.delete_range(session, None, prune_limit)
+                session.commit()
+    except Exception as e:
+        # delete_range already dropped the head chunks it touched: nothing else to invalidate
+        session.rollback()
+        logging.error(f"Error pruning history: {e}")
+    finally: session.close()
+
+
+def load_counter_ids(sources) -> set:
+    """Metric ids whose series are cumulative counters (cached as rates), from the metadata of every source."""
+    if not settings.COUNTER_RATE_ENABLED:
+        return set()
+    metric_types = {}
+    for source in sources:
+        metric_types.update(source.client.fetch_metric_types())
+    session = SessionLocal()
+    try:
+        rows = session.query(MetricModel.id, MetricModel.metric_fingerprint).all()
+        return {m_id for m_id, fp in rows if is_counter(metric_name_from_fingerprint(fp), metric_types)}
+    finally: session.close()
+
+
+def forget_series(metric_ids, state: dict) -> list:
+    """
+    Drop the alert state (windows / firing / ...) of `metric_ids` (series gone from
+    Prometheus). Firing series (and open capacity
+    alerts) are closed first: a `resolved` event is recorded and ('expired', fingerprint,
+    result) notifications are returned for delivery, so an ongoing anomaly is not
+    silently forgotten.
+    """
+    session = SessionLocal()
+    try:
+        fingerprints = [fp for (fp,) in session.query(MetricModel.metric_fingerprint).filter(MetricModel.id.in_(list(metric_ids))).all()]
+    finally: session.close()
+    fingerprints += aggregator.forget(metric_ids)
+    capacity_forecaster.forget(metric_ids)
+    notifications = []
+    dropped = 0
+    firing = state.get('firing', {})
+    for mid in fingerprints:
+        if mid in firing:
+            res = DetectionResult.from_dict(firing[mid])
+            res.reason = 'expired'
+            event_recorder.record('resolved', mid, instance_from_fingerprint(mid), res, severity='info')
+            notifications.append(('expired', mid, res))
+        if mid in state.get('capacity', {}):
+            event_recorder.record('resolved', mid, instance_from_fingerprint(mid), {'reason': 'capacity'}, severity='info')
+            notifications.append(('expired', mid, dict(state['capacity'][mid], kind='capacity', reason='expired')))
+        if [d.pop(mid, None) for d in state.values() if isinstance(d, dict) and mid in d]:
+            dropped += 1
+    if dropped:
+        logging.info(f"🧹 Dropped alert state of {dropped} expired series, {len(notifications)} firing")
+    return notifications
+
+
+def like_literal(text: str) -> str:
+    """`text` escaped for a LIKE pattern (metric names are full of `_`, a LIKE wildcard)."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def series_of_query(query: str, source: str = None):
+    """SQL condition selecting the registered series of `query` (of one named source)."""
+    prefix = f"__name__={query}|{SOURCE_LABEL}={source}" if source else f"__name__={query}"
+    return or_(MetricModel.metric_fingerprint == prefix, MetricModel.metric_fingerprint.like(f"{like_literal(prefix)}|%", escape='\\'))
+
+
+def query_key_of(fingerprint: str) -> str:
+    return query_key(labels_from_fingerprint(fingerprint).get(SOURCE_LABEL), metric_name_from_fingerprint(fingerprint))
+
+
+def series_ids_for_queries(session, keys) -> list:
+    """Metric ids of the series of the given query keys (see clients.sources.query_key)."""
+    ids = []
+    for key in keys:
+        source, query = split_query_key(key)
+        ids.extend(m_id for (m_id,) in session.query(MetricModel.id).filter(series_of_query(query, source)).all())
+    return ids
+
+
+@tracer.traced('aggregates')
+def run_aggregates(engine_service) -> ResultTable:
+    """Fold the points cached this cycle into the aggregation rules and detect on the aggregates."""
+    if not aggregator.rules:
+        return ResultTable()
+    session = SessionLocal()
+    try:
+        members = session.query(MetricModel.id, MetricModel.metric_fingerprint).filter(or_(*[series_of_query(m) for m in aggregator.metrics])).all()
+    finally: session.close()
+
+    results = []
+    series = aggregator.update(members)
+    for mid, agg_id in series:
+        df_hist = history_cache.get_history(agg_id)
+        if len(df_hist) >= 5:
+            results.append((mid, engine_service.train_and_detect(df_hist, fingerprint=mid, baseline=history_cache.get_baseline(agg_id))))
+    tracer.current().set(members=len(members), series=len(series), anomalies=sum(1 for _, r in results if r.is_anomaly))
+    return ResultTable.from_results(results)
+
+
+@tracer.traced('forecast')
+def run_forecasts() -> list:
+    """Capacity forecasts of the cached series matching FORECAST_RULES (aggregates included); None if forecasting failed."""
+    if not capacity_forecaster.rules:
+        return []
+    session = SessionLocal()
+    try:
+        series = dict(session.query(MetricModel.metric_fingerprint, MetricModel.id).all())
+    finally: session.close()
+    series.update(aggregator.series())
+    try:
+        forecasts = capacity_forecaster.update(series)
+    except Exception as e:
+        logging.error(f"Error forecasting capacity: {e}")
+        return None
+    tracer.current().set(series=len(forecasts), exhausting=sum(1 for f in forecasts if f['exhaustion_hours'] is not None))
+    return forecasts
+
+
+def alert_capacity(forecasts, capacity: dict, covered=()) -> list:
+    """
+    Capacity alerts: firing while the threshold is expected within FORECAST_ALERT_HOURS
+    (repeated every ALERT_REPEAT_INTERVAL_MINUTES), resolved once it moves beyond twice that,
+    or once the series is no longer `covered` by a rule (rule removed, series deleted).
+    Returns (status, fingerprint, result) notifications for the alert grouper;
+    `forecasts` is None when forecasting failed this cycle (state is kept as is).
+    """
+    if forecasts is None:
+        return []
+    now = datetime.now()
+    notifications = []
+    by_fp = {f['fingerprint']: f for f in forecasts}
+    for mid in [m for m in capacity if m not in by_fp and m not in covered]:
+        event_recorder.record('resolved', mid, instance_from_fingerprint(mid), {'reason': 'capacity'}, severity='info')
+        notifications.append(('resolved', mid, dict(capacity.pop(mid), kind='capacity')))
+    for mid, forecast in by_fp.items():
+        hours = forecast['exhaustion_hours']
+        prev = capacity.get(mid)
+        if hours is None or hours > settings.FORECAST_ALERT_HOURS:
+            if prev is not None and (hours is None or hours > 2 * settings.FORECAST_ALERT_HOURS):
+                event_recorder.record('resolved', mid, instance_from_fingerprint(mid), {'reason': 'capacity'}, severity='info')
+                notifications.append(('resolved', mid, dict(forecast, kind='capacity')))
+                capacity.pop(mid)
+            continue
+        if prev is not None and now - datetime.fromisoformat(prev['last_alert_at']) < timedelta(minutes=settings.ALERT_REPEAT_INTERVAL_MINUTES):
+            capacity[mid] = dict(forecast, last_alert_at=prev['last_alert_at'])
+            continue
+        status = 'repeating' if prev is not None else 'firing'
+        capacity[mid] = dict(forecast, last_alert_at=now.isoformat())
+        event_recorder.record(status, mid, instance_from_fingerprint(mid), {'reason': 'capacity', 'confidence': 1.0},
+                              severity='warning', description=capacity_summary(forecast))
+        notifications.append((status, mid, dict(forecast, kind='capacity')))
+    return notifications
+
+
+@tracer.traced('shards')
+def take_shards(queries, metric_types=None) -> list:
+    """
+    Heartbeat the replica lease and keep only the queries this replica owns on
+    the hash ring. Series of newly owned queries are warmed from the database;
+    those handed over to another replica are dropped from the cache. Their
+    alert state stays in alert_state, where the new owner picks it up.
+    """
+    session = SessionLocal()
+    try:
+        shard_coordinator.heartbeat(session)
+        owned, gained, lost = shard_coordinator.assign(queries)
+        if lost:
+            lost_ids = series_ids_for_queries(session, lost)
+            history_cache.release(lost_ids)
+            capacity_forecaster.forget(lost_ids)
+        if gained:
+            rows = session.query(MetricModel.id, MetricModel.metric_fingerprint).filter(MetricModel.id.in_(series_ids_for_queries(session, gained))).all()
+            counter_ids = {m_id for m_id, fp in rows if settings.COUNTER_RATE_ENABLED and is_counter(metric_name_from_fingerprint(fp), metric_types)}
+            history_cache.warm([m_id for m_id, _ in rows], counter_ids)
+        return sorted(owned)
+    except Exception as e:
+        session.rollback()
+        logging.error(f"[Shard] Lease heartbeat failed, keeping the previous shards: {e}")
+        return sorted(shard_coordinator.owned)
+    finally: session.close()
+
+
+def explain(llm, mid: str, res: dict, deliver):
+    """Hand the alert text to `deliver` once explained: in the background with an ExplanationService, inline otherwise."""
+    if isinstance(llm, ExplanationService):
+        llm.explain_async(mid, res, deliver)
+    else:
+        deliver(llm.explain_anomaly(mid, res))
+
+
+ALERT_SUBJECTS = {'firing': "Anomaly Detected", 'repeating': "Anomaly Persisting", 'resolved': "Anomaly Resolved", 'expired': "Anomaly Closed"}
+CAPACITY_SUBJECTS = {'firing': "Capacity Exhaustion Forecast", 'repeating': "Capacity Exhaustion Forecast",
+                     'resolved': "Capacity Forecast Resolved", 'expired': "Capacity Forecast Closed"}
+CLOSED_REASONS = {'expired': "is no longer reported by Prometheus"}
+
+
+def send_with_suffix(alert_manager, subject: str, suffix: str, metadata: dict, text: str):
+    alert_manager.async_broadcast(subject, text + suffix, metadata)
+
+
+def deliver_group(group, llm, alert_manager, related=None):
+    """Send one AlertGroup: the root series is explained (once), the rest of the group is summarised."""
+    mid, res = group.root
+    capacity = group.kind == 'capacity'
+    subject = (CAPACITY_SUBJECTS if capacity else ALERT_SUBJECTS)[group.status]
+    if len(group) > 1:
+        subject = f"{subject} ({len(group)} series)"
+    closed = group.status in ('resolved', 'expired')
+    metadata = {'instance': group.instance, 'severity': 'info' if closed else 'warning' if capacity else 'critical',
+                'status': 'resolved' if closed else group.status, 'group_size': len(group)}
+    if related:
+        metadata['related'] = related
+    if capacity and not closed:
+        metadata['exhaustion_hours'] = res['exhaustion_hours']
+        alert_manager.async_broadcast(subject, capacity_summary(res) + group.summary(), metadata)
+    elif capacity and group.status == 'resolved':
+        alert_manager.async_broadcast(subject, f"Metric {mid} is no longer expected to reach {res['threshold']:g} soon.{group.summary()}", metadata)
+    elif group.status == 'resolved':
+        alert_manager.async_broadcast(subject, f"Metric {mid} returned to normal.{group.summary()}", metadata)
+    elif group.status == 'expired':
+        # Receivers see a resolve; the reason tells it apart from a return to normal
+        metadata['reason'] = res.get('reason')
+        alert_manager.async_broadcast(subject, f"Metric {mid} {CLOSED_REASONS.get(res.get('reason'), 'was closed')}: alert closed without recovery.{group.summary()}", metadata)
+    else:
+        suffix = group.summary() + related_summary(related)
+        explain(llm, mid, res, functools.partial(send_with_suffix, alert_manager, subject, suffix, metadata))
+
+
+@tracer.traced('correlation')
+def correlate_roots(groups) -> dict:
+    """Related series of the root of every alert going out (not for host down: the cause is known)."""
+    roots = [g.root[0] for g in groups if g.status in ('firing', 'repeating') and g.kind == 'anomaly' and not g.host_down]
+    if not roots or not correlator.enabled:
+        return {}
+    try:
+        session = SessionLocal()
+        try:
+            series = dict(session.query(MetricModel.metric_fingerprint, MetricModel.id).all())
+        finally: session.close()
+        series.update(aggregator.series())
+        index = correlator.neighbours(series)
+        related = {fp: correlator.related(fp, series, index) for fp in roots}
+    except Exception as e:
+        logging.error(f"Error correlating alerts: {e}")
+        return {}
+    tracer.current().set(roots=len(roots), related=sum(len(r) for r in related.values()))
+    return {fp: r for fp, r in related.items() if r}
+
+
+def discover_source(source: PromSource) -> tuple:
+    """(queries, metric types, whether discovery answered) of one source for this cycle."""
+    with tracer.span('source.discover', source=source.name or 'default') as span:
+        queries = []
+        listed = False
+        if settings.METRIC_DISCOVERY_ENABLED:
+            queries = source.client.discover_metrics(source.pattern)
+            listed = bool(queries)
+            if not queries: queries = [settings.PROM_QUERY]
+        else:
+            queries = [settings.PROM_QUERY]
+        metric_types = source.client.fetch_metric_types() if settings.COUNTER_RATE_ENABLED else None
+        span.set(queries=len(queries), listed=listed)
+        return queries, metric_types, listed
+
+
+def series_by_query() -> dict:
+    """Query key -> metric ids of every registered series."""
+    session = SessionLocal()
+    try:
+        rows = session.query(MetricModel.id, MetricModel.metric_fingerprint).all()
+    finally: session.close()
+    by_query = {}
+    for m_id, fp in rows:
+        by_query.setdefault(query_key_of(fp), []).append(m_id)
+    return by_query
+
+
+def unlisted_series(listed_sources, queries, by_query: dict) -> list:
+    """Metric ids of registered series whose metric is no longer discovered on a source that answered discovery this cycle."""
+    listed_sources = set(listed_sources)
+    return [m_id for key, ids in by_query.items()
+            if key not in queries and split_query_key(key)[0] in listed_sources for m_id in ids]
+
+
+@tracer.traced('cycle', root=True)
+def run_cycle(prom_client, alert_manager, engine_service, llm, now_ts=None, sources=None):
+    """
+    One full detection cycle: discovery -> per-query sync/analysis -> aggregates -> forecasts -> alerting -> status -> pruning.
+    Every source is discovered and processed concurrently on its own worker budget, so the
+    cycle takes as long as the slowest source; `prom_client` alone is the single default source.
+    """
+    sources = sources or [PromSource.default(prom_client)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        discovered = [executor.submit(tracer.wrap(discover_source), s) for s in sources]
+        discovered = [f.result() for f in discovered]
+    queries = {query_key(s.name, q): (s, q) for s, (qs, _, _) in zip(sources, discovered) for q in qs}
+    metric_types = {}
+    for _, types, _ in discovered:
+        metric_types.update(types or {})
+    # Series of metrics no longer discovered are gone; those of a source that did not answer are not
+    checked = []  # metric ids whose query completed this cycle: the only ones the cache TTL may expire
+    listed = [s.name for s, (_, _, ok) in zip(sources, discovered) if ok]
+    expiring = listed and settings.HISTORY_CACHE_TTL_MINUTES > 0
+    by_query = series_by_query() if expiring or cardinality_guard.total else {}
+    if expiring:
+        checked.extend(unlisted_series(listed, queries, by_query))
+    metric_types = metric_types if settings.COUNTER_RATE_ENABLED else None
+
+    if settings.SHARDING_ENABLED:
+        owned = set(take_shards(list(queries), metric_types))
+        queries = {k: v for k, v in queries.items() if k in owned}
+    # The global series budget is split up front, not taken by whichever worker runs first
+    cardinality_guard.begin_cycle({k: len(by_query.get(k, ())) for k in queries})
+
+    tables = []
+    executors = {s.name: concurrent.futures.ThreadPoolExecutor(max_workers=s.workers, thread_name_prefix=f"src-{s.name or 'default'}") for s in sources}
+    try:
+        futures = [executors[s.name].submit(tracer.wrap(run_once), s.client, alert_manager, engine_service, llm, q, step=s.step, now_ts=now_ts,
+                                            metric_types=metric_types, checked=checked)
+                   for s, q in queries.values()]
+        for f in concurrent.futures.as_completed(futures):
+            res = f.result()
+            if res: tables.append(res)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+    cardinality_guard.log_cycle()
+    tables.append(run_aggregates(engine_service))
+    forecasts = run_forecasts()
+    # One columnar table of the whole cycle, read by alerting, events, explanations and status
+    results = ResultTable.concat(tables)
+    
+    # STATE UPDATE & ALERTING
+    global_state = load_state()
+    windows = global_state.get('windows', {})
+    firing_registry = global_state.get('firing', {})
+    last_alert_at = global_state.get('last_alert_at', {})
+    capacity = global_state.get('capacity', {})
+    state = {"windows": windows, "firing": firing_registry, "last_alert_at": last_alert_at, "capacity": capacity}
+
+    # MEMORY: keep the history cache within budget; series gone for good also lose their alert state.
+    # Only series whose query completed can expire (aggregates follow their members).
+    expired = history_cache.evict(checked={*checked, *aggregator.series().values()})
+    # (status, fingerprint, result) delivered per group after the loop; firing series that expired are closed
+    notifications = forget_series(expired, state) if expired else []
+
+    host_down = results.reason == 'host_down'
+    for i, mid in enumerate(results.fingerprint):
+        is_anom = bool(results.is_anomaly[i])
+        w = windows.get(mid, [])
+        was_clean = sum(w) == 0
+        w.append(1 if is_anom else 0)
+        w = w[-settings.ALERT_WINDOW_SIZE:]
+        windows[mid] = w
+
+        if is_anom: logging.info(f"⚠️ [DETECTED] {mid} | Window: {sum(w)}/{settings.ALERT_MIN_HITS}")
+        instance = instance_from_fingerprint(mid)
+        if is_anom and was_clean and mid not in firing_registry:
+            event_recorder.record('detected', mid, instance, results.row(i))
+
+        # Use firing_registry as prev_firing for consistency
+        prev_firing = firing_registry
+
+        firing = (sum(w) >= settings.ALERT_MIN_HITS or host_down[i]) # Determine if it should be firing
+
+        if firing:
+            # New anomaly
+            if mid not in prev_firing:
+                res = results.row(i)
+                firing_registry[mid] = dict(res.to_dict(), last_alert_at=datetime.now().isoformat())
+                event_recorder.record('firing', mid, instance, res, severity='critical')
+                notifications.append(('firing', mid, res))
+            else:
+                # Repeating anomaly check
+                last_alert_ts = datetime.fromisoformat(prev_firing[mid].get("last_alert_at", "1970-01-01"))
+                if (datetime.now() - last_alert_ts) >= timedelta(minutes=settings.ALERT_REPEAT_INTERVAL_MINUTES):
+                    res = results.row(i)
+                    firing_registry[mid] = dict(res.to_dict(), last_alert_at=datetime.now().isoformat())
+                    event_recorder.record('repeating', mid, instance, res, severity='critical')
+                    notifications.append(('repeating', mid, res))
+        else:
+            # Resolved
+            if mid in prev_firing:
+                res = results.row(i)
+                event_recorder.record('resolved', mid, instance, res, severity='info')
+                notifications.append(('resolved', mid, res))
+                firing_registry.pop(mid, None) # Remove from firing registry
+                windows[mid] = [0] * settings.ALERT_WINDOW_SIZE # Reset window for resolved metric
+
+    # CAPACITY: forecast alerts are grouped (and suppressed for a down host) like anomalies
+    notifications += alert_capacity(forecasts, capacity, capacity_forecaster.covered)
+
+    # GROUPING: one alert per instance storm, dependents of a down host are suppressed
+    with tracer.span('alerting', series=len(results), notifications=len(notifications)) as span:
+        groups = alert_grouper.group(notifications, results.fingerprint[host_down])
+        if len(groups) < len(notifications):
+            logging.info(f"📦 [Group] {len(notifications)} notifications -> {len(groups)} alerts")
+        # ROOT CAUSE: series of the same instance that moved with (or just before) each alert
+        related = correlate_roots(groups)
+        for mid, items in related.items():
+            if mid in firing_registry:
+                firing_registry[mid]['related'] = items
+        for group in groups:
+            deliver_group(group, llm, alert_manager, related.get(group.root[0]))
+        span.set(alerts=len(groups))
+
+    save_state(state)
+    update_status_json(load_state(), results)
+
+    # GLOBAL PRUNING (one replica only when sharded)
+    if not settings.SHARDING_ENABLED or shard_coordinator.owns(MAINTENANCE_KEY):
+        prune_history()
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     if not wait_for_db(): exit(1)
-    wait_for_prometheus(timeout=30)
+    sources = load_sources()
+    for source in sources:
+        wait_for_prometheus(timeout=30, url=source.client.base_url)
     Base.metadata.create_all(bind=engine)
+    migrate_events(engine)
+    event_recorder.start(SessionLocal)
 
-    prom_client = PrometheusClient(settings.PROM_URL, verify_ssl=not settings.PROM_SKIP_SSL)
+    logging.info(f"Sources: {sources}")
     alert_manager = AlertManager()
     engine_service = AnomalyEngine()
-    llm = LLMClient()
+    llm = ExplanationService(LLMClient())
+
+    calendar_features.configure(window_hours=settings.ANALYSIS_WINDOW_HOURS)
+    if settings.API_ENABLED:
+        status_api.serve(session_factory=SessionLocal)
 
     # PRE-LOAD TurboMode History Cache
-    history_cache.initialize(engine, settings.ANALYSIS_WINDOW_HOURS)
+    if settings.SHARDING_ENABLED:
+        # Each replica warms only the shards it takes over (see take_shards)
+        history_cache.attach(engine, settings.ANALYSIS_WINDOW_HOURS)
+        signal.signal(signal.SIGTERM, lambda *_: exit(0))
+        shard_coordinator.start_heartbeat(SessionLocal)
+    else:
+        snapshot_until = {}
+        if settings.HISTORY_SNAPSHOT_PATH and os.path.exists(settings.HISTORY_SNAPSHOT_PATH):
+            snapshot_until = history_cache.load_snapshot(settings.HISTORY_SNAPSHOT_PATH, settings.ANALYSIS_WINDOW_HOURS)
+        history_cache.initialize(engine, settings.ANALYSIS_WINDOW_HOURS, counter_ids=load_counter_ids(sources), since=snapshot_until)
 
-    while True:
-        try:
-            logging.info("Starting anomaly detection cycle...")
-            cycle_start = time.time()
-            
-            queries = []
-            if settings.METRIC_DISCOVERY_ENABLED:
-                queries = prom_client.discover_metrics(settings.METRIC_DISCOVERY_PATTERN)
-                if not queries: queries = [settings.PROM_QUERY]
-            else:
-                queries = [settings.PROM_QUERY]
-                
-            all_updates = []
-            with concurrent.futures.ThreadPoolExecutor(max_workers=settings.MAX_WORKERS) as executor:
-                futures = {executor.submit(run_once, prom_client, alert_manager, engine_service, llm, q): q for q in queries}
-                for f in concurrent.futures.as_completed(futures):
-                    res = f.result()
-                    if res: all_updates.append(res)
-            
-            # STATE UPDATE & ALERTING
-            global_state = load_state()
-            windows = global_state.get('windows', {})
-            firing_registry = global_state.get('firing', {})
-            last_alert_at = global_state.get('last_alert_at', {})
-            
-            for update in all_updates:
-                for mid, is_anom in update["windows"].items():
-                    w = windows.get(mid, [])
-                    w.append(1 if is_anom else 0)
-                    w = w[-5:]
-                    windows[mid] = w
-                    
-                    res = update["firing"][mid]
-                    is_firing = firing_registry.get(mid, False)
-                    
-                    def get_inst(m): return m.split('|instance=')[1].split('|')[0] if '|instance=' in m else m
-
-                    if is_anom: logging.info(f"⚠️ [DETECTED] {mid} | Window: {sum(w)}/3")
-
-                    # Use firing_registry as prev_firing and global_state as state for consistency
-                    prev_firing = firing_registry
-                    state = global_state # This 'state' refers to the global_state loaded at the beginning of the loop
-
-                    firing = (sum(w) >= 3 or res.get('reason') == 'host_down') # Determine if it should be firing
-
-                    if firing:
-                        # New anomaly
-                        if mid not in prev_firing:
-                            firing_registry[mid] = res 
-                            firing_registry[mid]["last_alert_at"] = datetime.now().isoformat()
-                            alert_manager.async_broadcast("Anomaly Detected", llm.explain_anomaly(mid, res), {'instance': get_inst(mid), 'severity': 'critical', 'status': 'firing'})
-                        else:
-                            # Repeating anomaly check
-                            last_alert_ts = datetime.fromisoformat(prev_firing[mid].get("last_alert_at", "1970-01-01"))
-                            if (datetime.now() - last_alert_ts) >= timedelta(minutes=settings.ALERT_REPEAT_INTERVAL_MINUTES):
-                                firing_registry[mid] = res 
-                                firing_registry[mid]["last_alert_at"] = datetime.now().isoformat()
-                                alert_manager.async_broadcast("Anomaly Persisting", llm.explain_anomaly(mid, res), {'instance': get_inst(mid), 'severity': 'critical', 'status': 'repeating'})
-                    else:
-                        # Resolved
-                        if mid in prev_firing:
-                            alert_manager.async_broadcast("Anomaly Resolved", f"Metric {mid} returned to normal.", {'instance': get_inst(mid), 'severity': 'info', 'status': 'resolved'})
-                            firing_registry.pop(mid, None) # Remove from firing registry
-                            windows[mid] = [0] * 5 # Reset window for resolved metric
-
-            save_state({"windows": windows, "firing": firing_registry, "last_alert_at": last_alert_at})
-            update_status_json(load_state())
-
-            # GLOBAL PRUNING
+    try:
+        while True:
+            try:
+                logging.info("Starting anomaly detection cycle...")
+                cycle_start = time.time()
+                run_cycle(sources[0].client, alert_manager, engine_service, llm, sources=sources)
+                logging.info(f"Cycle complete in {time.time() - cycle_start:.1f}s. Sleeping {settings.CHECK_INTERVAL_MINUTES}m...")
+            except Exception as e:
+                logging.error(f"Cycle error: {e}")
+                time.sleep(60)
+
+            time.sleep(settings.CHECK_INTERVAL_MINUTES * 60)
+    finally:
+        event_recorder.flush()
+        dispatcher.flush(timeout=5)  # whatever is left stays in DISPATCH_QUEUE_DIR for the next start
+        tracer.flush(timeout=5)
+        if settings.SHARDING_ENABLED:
+            # Hand the shards over right away instead of after LEASE_TTL_SECONDS
             session = SessionLocal()
             try:
-                prune_limit = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=settings.LOOKBACK_HOURS)
-                session.query(MetricValue).filter(MetricValue.timestamp < prune_limit).delete()
-                session.commit()
+                shard_coordinator.leave(session)
             finally: session.close()
-            
-            logging.info(f"Cycle complete in {time.time() - cycle_start:.1f}s. Sleeping {settings.CHECK_INTERVAL_MINUTES}m...")
-        except Exception as e:
-            logging.error(f"Cycle error: {e}")
-            time.sleep(60)
-            
-        time.sleep(settings.CHECK_INTERVAL_MINUTES * 60)
@@ -1,4 +1,4 @@
 """Models package."""
 
-from .metric import MetricModel, MetricValue
+from .metric import MetricModel, MetricValue, MetricChunk, MetricRollup, DetectorLease
 from .anomaly_event import AnomalyEvent
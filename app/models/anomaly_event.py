@@ -1,12 +1,23 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Index
 from .base import Base
 import datetime
 
 
 class AnomalyEvent(Base):
+    """Alert state transitions (detected / firing / repeating / resolved), written by services/events.py."""
     __tablename__ = 'anomaly_events'
     id = Column(Integer, primary_key=True)
-    metric_fingerprint = Column(String, index=True)
+    metric_fingerprint = Column(String)  # indexed by idx_event_fingerprint_ts (leading column)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     severity = Column(String, default='warning')
     description = Column(Text)
+    event_type = Column(String, nullable=True)
+    instance = Column(String, nullable=True)
+    reason = Column(String, nullable=True)      # spike / trend / host_down ...
+    confidence = Column(Float, nullable=True)
+
+    __table_args__ = (
+        Index('idx_event_fingerprint_ts', 'metric_fingerprint', 'timestamp'),
+        Index('idx_event_instance_ts', 'instance', 'timestamp'),
+        Index('idx_event_ts', 'timestamp'),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, LargeBinary, Text
 from .base import Base
 import datetime
 
@@ -25,3 +25,55 @@ class MetricValue(Base):
     __table_args__ = (
         Index('idx_metric_timestamp', 'metric_id', 'timestamp'),
     )
+
+
+class MetricChunk(Base):
+    """Compressed history (STORAGE_BACKEND=chunks): one row per series and time window, see services/gorilla.py."""
+    __tablename__ = 'metric_chunks'
+    id = Column(Integer, primary_key=True)
+    metric_id = Column(Integer, ForeignKey('metrics.id', ondelete='CASCADE'))
+    start_time = Column(DateTime)  # first sample in the chunk
+    end_time = Column(DateTime)    # last sample in the chunk
+    count = Column(Integer)
+    data = Column(LargeBinary)     # bytea on PostgreSQL
+
+    __table_args__ = (
+        Index('idx_chunk_metric_start', 'metric_id', 'start_time'),
+        Index('idx_chunk_end', 'end_time'),
+    )
+
+
+class MetricRollup(Base):
+    """Compacted history older than the raw retention: one row per series, resolution and time bucket."""
+    __tablename__ = 'metric_rollups'
+    id = Column(Integer, primary_key=True)
+    metric_id = Column(Integer, ForeignKey('metrics.id', ondelete='CASCADE'))
+    resolution = Column(Integer)  # bucket size in seconds (3600 = 1h, 86400 = 1d)
+    bucket_start = Column(DateTime)
+    min = Column(Float)
+    max = Column(Float)
+    avg = Column(Float)
+    std = Column(Float)  # population std of the raw points in the bucket
+    count = Column(Integer)
+
+    __table_args__ = (
+        Index('idx_rollup_metric_bucket', 'metric_id', 'resolution', 'bucket_start', unique=True),
+        Index('idx_rollup_resolution_bucket', 'resolution', 'bucket_start'),
+    )
+
+
+class DetectorLease(Base):
+    """Live detector replicas (SHARDING_ENABLED): each one heartbeats its row; expired rows are taken over."""
+    __tablename__ = 'detector_leases'
+    replica_id = Column(String, primary_key=True)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime, index=True)
+
+
+class AlertState(Base):
+    """Alert state of one series (SHARDING_ENABLED): shared, so a restarted replica or the new owner of a shard continues its alerts."""
+    __tablename__ = 'alert_state'
+    metric_fingerprint = Column(String, primary_key=True)
+    query_key = Column(String, index=True)  # shard the series belongs to (see clients.sources.query_key)
+    state = Column(Text)                    # JSON: the series' entries of windows / firing / last_alert_at / capacity
+    updated_at = Column(DateTime)
@@ -0,0 +1,245 @@
+"""
+Shared outbound HTTP dispatcher for the receivers (Telegram, Slack, webhooks).
+
+`submit()` only writes the request to the queue (and to DISPATCH_QUEUE_DIR,
+so pending alerts survive a restart) and returns; delivery runs on a few
+worker threads per destination over one pooled keep-alive session, so a slow
+or dead endpoint never ties up AlertManager's executor or another receiver.
+
+The URL and headers of a destination (Telegram bot token, Slack webhook
+secret, WEBHOOK_HEADERS) are given to `register()` and kept in memory only:
+queued files hold the destination name and the body, and are resumed against
+the destination registered under that name by the next run.
+
+Per destination:
+- `concurrency` requests in flight at most;
+- `rate` requests per second (token bucket, 0 = unlimited);
+- connection errors, timeouts, 429 and 5xx are retried with jittered
+  exponential backoff (Retry-After is honoured) up to DISPATCH_MAX_ATTEMPTS;
+  other 4xx answers are dropped right away.
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.config import settings
+from core.tracing import tracer, SPAN_KIND_CLIENT
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available (no-op when rate is 0)."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Destination:
+    def __init__(self, name: str, url: str, headers: dict, concurrency: int, rate: float):
+        self.name = name
+        self.url = url
+        self.headers = headers
+        self.concurrency = concurrency
+        self.queue = queue.Queue()
+        self.limiter = TokenBucket(rate)
+
+
+class HttpDispatcher:
+    def __init__(self, queue_dir: str = None, max_attempts: int = None, backoff: float = None,
+                 backoff_max: float = None, timeout: float = None):
+        self.queue_dir = settings.DISPATCH_QUEUE_DIR if queue_dir is None else queue_dir
+        self.max_attempts = max_attempts or settings.DISPATCH_MAX_ATTEMPTS
+        self.backoff = settings.DISPATCH_BACKOFF_SECONDS if backoff is None else backoff
+        self.backoff_max = backoff_max or settings.DISPATCH_BACKOFF_MAX_SECONDS
+        self.timeout = timeout or settings.DISPATCH_TIMEOUT_SECONDS
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._destinations = {}
+        self._lock = threading.Lock()
+        self._delayed = []                 # heap of (due, seq, job) waiting for their retry
+        self._seq = itertools.count()
+        self._wakeup = threading.Condition(self._lock)
+        self._timer = None
+        self._pending = 0
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    # ---- setup -------------------------------------------------------------
+
+    def register(self, name: str, url: str, headers: dict = None, concurrency: int = None, rate: float = None) -> Destination:
+        """Declare a destination and start its workers (idempotent; the URL and headers are updated)."""
+        with self._lock:
+            dest = self._destinations.get(name)
+            if dest is not None:
+                dest.url, dest.headers = url, dict(headers or {})
+                return dest
+            dest = self._destinations[name] = Destination(
+                name, url, dict(headers or {}), concurrency or settings.DISPATCH_CONCURRENCY,
+                settings.DISPATCH_RATE_LIMIT if rate is None else rate)
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run_timer, name='dispatch-retry', daemon=True)
+                self._timer.start()
+        for i in range(dest.concurrency):
+            threading.Thread(target=self._run_worker, args=(dest,), name=f'dispatch-{name}-{i}', daemon=True).start()
+        return dest
+
+    def resume(self) -> int:
+        """Re-queue the requests left on disk by a previous run (destinations must be registered); returns how many."""
+        if not self.queue_dir or not os.path.isdir(self.queue_dir):
+            return 0
+        resumed = 0
+        for fname in sorted(os.listdir(self.queue_dir)):
+            if not fname.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.queue_dir, fname)) as f:
+                    job = json.load(f)
+            except Exception as e:
+                logging.error(f"[Dispatch] Unreadable queued request {fname}: {e}")
+                continue
+            if job.get('destination') not in self._destinations:
+                logging.warning(f"[Dispatch] Dropping queued request {fname}: receiver '{job.get('destination')}' is not configured")
+                os.remove(os.path.join(self.queue_dir, fname))
+                continue
+            self._enqueue(job)
+            resumed += 1
+        if resumed:
+            logging.info(f"📮 [Dispatch] Resumed {resumed} undelivered request(s) from {self.queue_dir}")
+        return resumed
+
+    # ---- queueing ------------------------------------------------------------
+
+    def submit(self, destination: str, json_body=None, data: str = None, method: str = 'POST') -> str:
+        """Queue one request to a registered destination; never blocks on the network. Returns the request id."""
+        if destination not in self._destinations:
+            raise KeyError(f"unknown destination: {destination}")
+        job = {'id': f"{time.time_ns()}-{uuid.uuid4().hex[:8]}", 'destination': destination, 'method': method,
+               'json': json_body, 'data': data, 'attempt': 0, 'traceparent': tracer.traceparent()}
+        self._persist(job)
+        self._enqueue(job)
+        return job['id']
+
+    def _enqueue(self, job):
+        dest = self._destinations[job['destination']]
+        with self._lock:
+            self._pending += 1
+        dest.queue.put(job)
+
+    def _persist(self, job):
+        if not self.queue_dir:
+            return
+        os.makedirs(self.queue_dir, mode=0o700, exist_ok=True)
+        path = os.path.join(self.queue_dir, f"{job['id']}.json")
+        # No credentials in the file, but the alert text is still nobody else's business
+        with os.fdopen(os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(job, f)
+        os.replace(path + '.tmp', path)
+
+    def _done(self, job):
+        if self.queue_dir:
+            try:
+                os.remove(os.path.join(self.queue_dir, f"{job['id']}.json"))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._pending -= 1
+
+    # ---- delivery --------------------------------------------------------------
+
+    def _run_worker(self, dest: Destination):
+        while True:
+            job = dest.queue.get()
+            dest.limiter.acquire()
+            try:
+                self._attempt(job)
+            except Exception as e:
+                logging.error(f"[Dispatch] {dest.name}: unexpected error: {e}")
+                self._done(job)
+
+    def _attempt(self, job):
+        retry_after = None
+        try:
+            with tracer.span_from(job.get('traceparent'), 'http.send', SPAN_KIND_CLIENT,
+                                  destination=job['destination'], attempt=job['attempt'] + 1) as span:
+                dest = self._destinations[job['destination']]
+                response = self._session.request(job['method'], dest.url, json=job['json'], data=job['data'],
+                                                 headers=dest.headers, timeout=self.timeout)
+                span.set(status_code=response.status_code)
+            if response.status_code < 400:
+                self.stats['sent'] += 1
+                self._done(job)
+                return
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if response.headers.get('Retry-After', '').isdigit():
+                retry_after = float(response.headers['Retry-After'])
+        except requests.RequestException as e:
+            error, retryable = str(e), True
+
+        job['attempt'] += 1
+        if not retryable or job['attempt'] >= self.max_attempts:
+            self.stats['failed'] += 1
+            logging.error(f"[Dispatch] {job['destination']}: giving up after {job['attempt']} attempt(s): {error}")
+            self._done(job)
+            return
+        delay = retry_after if retry_after is not None else \
+            min(self.backoff_max, self.backoff * 2 ** (job['attempt'] - 1)) * random.uniform(0.5, 1.5)
+        self.stats['retried'] += 1
+        logging.warning(f"[Dispatch] {job['destination']}: attempt {job['attempt']} failed ({error}), retrying in {delay:.1f}s")
+        self._persist(job)
+        with self._lock:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), job))
+            self._wakeup.notify()
+
+    def _run_timer(self):
+        """Move jobs whose backoff is over back onto their destination queue."""
+        while True:
+            with self._lock:
+                while not self._delayed or self._delayed[0][0] > time.monotonic():
+                    self._wakeup.wait(self._delayed[0][0] - time.monotonic() if self._delayed else None)
+                _, _, job = heapq.heappop(self._delayed)
+                dest = self._destinations[job['destination']]
+            dest.queue.put(job)
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until every queued request is delivered or given up (shutdown, tests)."""
+        deadline = time.monotonic() + timeout
+        while self.pending():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+dispatcher = HttpDispatcher()
@@ -3,8 +3,12 @@ from typing import List
 from .base import BaseReceiver
 from .telegram import TelegramReceiver
 from .email import EmailReceiver
+from .slack import SlackReceiver
+from .webhook import WebhookReceiver
+from .dispatcher import dispatcher
 from core.config import settings
 import concurrent.futures
+from core.tracing import tracer
 
 class AlertManager:
     def __init__(self):
@@ -37,18 +41,33 @@ class AlertManager:
         else:
             logging.warning("Email receiver disabled in settings.")
 
+        # HTTP receivers share the dispatcher (pooled session, rate limits, disk-backed retries)
+        if settings.SLACK_ENABLED:
+            self.receivers.append(SlackReceiver(settings.SLACK_WEBHOOK_URL))
+            logging.info("Slack receiver enabled.")
+        if settings.WEBHOOK_ENABLED:
+            # Destinations are named after the URL, so queued alerts resume to the same endpoint
+            # (those of a URL removed from WEBHOOK_URLS are dropped by resume())
+            for url in dict.fromkeys(settings.WEBHOOK_URLS):
+                self.receivers.append(WebhookReceiver(url, headers=settings.WEBHOOK_HEADERS))
+            logging.info(f"Webhook receiver enabled ({len(settings.WEBHOOK_URLS)} endpoint(s)).")
+        # Alerts queued on disk by a previous run are delivered now
+        dispatcher.resume()
+
+    @tracer.traced('alert.broadcast')
     def broadcast(self, subject: str, description: str, metadata: dict) -> bool:
         if not self.receivers:
             logging.warning("No alert receivers enabled!")
             return False
 
-        any_success = False
         any_success = False
         for receiver in self.receivers:
             receiver_name = receiver.__class__.__name__
             logging.info(f"Broadcasting to {receiver_name}...")
             try:
-                success = receiver.send(subject, description, metadata)
+                with tracer.span('receiver.send', receiver=receiver_name, status=metadata.get('status')) as span:
+                    success = receiver.send(subject, description, metadata)
+                    span.set(success=bool(success))
                 if success:
                     any_success = True
                     logging.info(f"Broadcast to {receiver_name} succeeded.")
@@ -61,4 +80,4 @@ class AlertManager:
 
     def async_broadcast(self, subject: str, description: str, metadata: dict):
         """Non-blocking broadcast using a thread pool."""
-        self._executor.submit(self.broadcast, subject, description, metadata)
+        self._executor.submit(tracer.wrap(self.broadcast), subject, description, metadata)
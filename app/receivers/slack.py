@@ -0,0 +1,31 @@
+import logging
+import re
+from .base import BaseReceiver
+from .dispatcher import dispatcher
+
+
+def html_to_mrkdwn(text: str) -> str:
+    """The alert text is Telegram HTML: <b>/<i> -> Slack *bold* / _italic_, other tags dropped."""
+    text = re.sub(r'</?b>', '*', text or '')
+    text = re.sub(r'</?i>', '_', text)
+    return re.sub('<[^<]+?>', '', text)
+
+
+class SlackReceiver(BaseReceiver):
+    # Slack incoming webhooks accept about one message per second
+    def __init__(self, webhook_url: str, rate: float = 1.0, dispatcher=dispatcher):
+        self.webhook_url = webhook_url
+        self.dispatcher = dispatcher
+        self.dispatcher.register('slack', webhook_url, rate=rate)
+
+    def send(self, subject: str, description: str, metadata: dict) -> bool:
+        if not self.webhook_url:
+            logging.warning("Slack webhook URL missing. Skipping.")
+            return False
+
+        status = metadata.get('status', 'firing')
+        icon = {'firing': '🔥', 'repeating': '🔄'}.get(status, '✅')
+        header = (f"{icon} *{subject}* | {status.upper()} | "
+                  f"server `{metadata.get('instance', 'Unknown')}` | {metadata.get('severity', 'critical').upper()}")
+        self.dispatcher.submit('slack', json_body={'text': f"{header}\n\n{html_to_mrkdwn(description)}"})
+        return True
@@ -1,12 +1,15 @@
-import requests
 import logging
 from .base import BaseReceiver
+from .dispatcher import dispatcher
 
 class TelegramReceiver(BaseReceiver):
-    def __init__(self, bot_token: str, chat_id: str):
+    # Telegram allows about one message per second to the same chat
+    def __init__(self, bot_token: str, chat_id: str, rate: float = 1.0, dispatcher=dispatcher):
         self.bot_token = bot_token
         self.chat_id = chat_id
         self.api_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+        self.dispatcher = dispatcher
+        self.dispatcher.register('telegram', self.api_url, rate=rate)
 
     def send(self, subject: str, description: str, metadata: dict) -> bool:
         if not self.bot_token or not self.chat_id:
@@ -37,11 +40,7 @@ class TelegramReceiver(BaseReceiver):
             "parse_mode": "HTML"
         }
 
-        try:
-            response = requests.post(self.api_url, json=payload, timeout=10)
-            response.raise_for_status()
-            logging.info(f"Telegram alert sent successfully for {metadata.get('instance')}")
-            return True
-        except Exception as e:
-            logging.error(f"Failed to send Telegram alert: {e}")
-            return False
+        # Delivered (with retries) by the shared dispatcher; True means queued
+        self.dispatcher.submit('telegram', json_body=payload)
+        logging.info(f"Telegram alert queued for {metadata.get('instance')}")
+        return True
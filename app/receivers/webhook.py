@@ -0,0 +1,44 @@
+import hashlib
+import logging
+import re
+from datetime import datetime, timezone
+from .base import BaseReceiver
+from .dispatcher import dispatcher
+
+
+def strip_html(text: str) -> str:
+    return re.sub('<[^<]+?>', '', text or '')
+
+
+def destination_name(url: str) -> str:
+    """Dispatcher destination of a webhook URL: stable across restarts and reordering of WEBHOOK_URLS."""
+    return f"webhook-{hashlib.sha256(url.encode()).hexdigest()[:12]}"
+
+
+class WebhookReceiver(BaseReceiver):
+    """POSTs every alert as JSON to a generic endpoint (Alertmanager-style integrations, Teams/Discord relays...)."""
+    def __init__(self, url: str, headers: dict = None, name: str = None, dispatcher=dispatcher):
+        self.url = url
+        self.headers = headers or {}
+        self.name = name or destination_name(url)
+        self.dispatcher = dispatcher
+        self.dispatcher.register(self.name, url, headers=self.headers)
+
+    def payload(self, subject: str, description: str, metadata: dict) -> dict:
+        return {
+            'subject': subject,
+            'status': metadata.get('status', 'firing'),
+            'instance': metadata.get('instance'),
+            'severity': metadata.get('severity'),
+            'description': strip_html(description),
+            'description_html': description,
+            'metadata': metadata,
+            'sent_at': datetime.now(timezone.utc).isoformat(),
+        }
+
+    def send(self, subject: str, description: str, metadata: dict) -> bool:
+        if not self.url:
+            logging.warning("Webhook URL missing. Skipping.")
+            return False
+        self.dispatcher.submit(self.name, json_body=self.payload(subject, description, metadata))
+        return True
@@ -0,0 +1,183 @@
+"""
+Aggregate series (job / cluster totals) computed inside the detector from the
+history cache: no extra PromQL query, Prometheus fetch or database write.
+
+AGGREGATION_RULES is a JSON list, e.g.
+
+    [{"name": "job:node_network_receive_bytes:sum", "metric": "node_network_receive_bytes_total",
+      "op": "sum", "by": ["job"], "match": {"device": "eth0"}}]
+
+`op` (sum / avg / max / min) reduces the member series (name `metric`, labels
+equal to `match`) grouped by the `by` labels. Members are read as cached:
+on the step grid, and counters already converted to per-second rates, so the
+sum of a counter is the total rate.
+
+Each cycle only the member points newer than the aggregate's last point are
+reduced, with one lexsort + reduceat per rule over every group, up to the
+group watermark: the oldest last point among the members that reported within
+AGGREGATION_MAX_LAG_MINUTES of the newest one. A member one cycle late does
+not show up as a dip, a member that disappeared does not stall the group.
+
+Aggregates are cached under negative metric ids as `__name__=<name>|<by labels>`
+and detected and alerted on like any other series. They are not written to
+the database: after a restart they are rebuilt from the members' windows.
+"""
+import itertools
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from core.config import settings
+from core.fingerprint import labels_from_fingerprint, metric_id_from_labels
+from clients.prometheus import SOURCE_LABEL
+from services.calendar_features import to_epoch_seconds
+from services.history_cache import history_cache
+
+OPS = {'sum': np.add, 'avg': np.add, 'max': np.maximum, 'min': np.minimum}
+
+
+class AggregationRule:
+    __slots__ = ('name', 'metric', 'op', 'by', 'match')
+
+    def __init__(self, name: str, metric: str, op: str = 'sum', by=(), match: dict = None):
+        if op not in OPS:
+            raise ValueError(f"aggregation rule {name!r}: unknown op {op!r} (one of {', '.join(OPS)})")
+        self.name = name
+        self.metric = metric
+        self.op = op
+        self.by = tuple(by)
+        self.match = dict(match or {})
+
+    def __repr__(self):
+        return f"AggregationRule({self.name} = {self.op} by ({', '.join(self.by)}) ({self.metric}))"
+
+    def group_of(self, labels: dict):
+        """Group (values of `by`) of a member series, None if the series is not a member."""
+        if labels.get('__name__') != self.metric or any(labels.get(k) != v for k, v in self.match.items()):
+            return None
+        return tuple(labels.get(k, '') for k in self.by)
+
+    def fingerprint(self, group: tuple) -> str:
+        return metric_id_from_labels({'__name__': self.name, **{k: v for k, v in zip(self.by, group) if v}})
+
+
+def load_rules(raw: str = None) -> list:
+    raw = settings.AGGREGATION_RULES if raw is None else raw
+    if not raw:
+        return []
+    rules = []
+    for entry in json.loads(raw):
+        by = list(entry.get('by', []))
+        # Replicas own queries per source: a cross-source group would be summed in parts
+        if settings.SHARDING_ENABLED and settings.PROM_SOURCES and SOURCE_LABEL not in by:
+            by.append(SOURCE_LABEL)
+        rules.append(AggregationRule(entry['name'], entry['metric'], entry.get('op', 'sum'), by, entry.get('match')))
+    if len({r.name for r in rules}) != len(rules):
+        raise ValueError("AGGREGATION_RULES: rule names must be unique")
+    return rules
+
+
+def reduce_points(op: str, groups: np.ndarray, ts: np.ndarray, y: np.ndarray) -> tuple:
+    """Reduce the points sharing (group, ts); returns (groups, ts, values) sorted by group then ts. NaNs are ignored."""
+    keep = ~np.isnan(y)
+    groups, ts, y = groups[keep], ts[keep], y[keep]
+    if not len(y):
+        return groups, ts, y
+    order = np.lexsort((ts, groups))
+    groups, ts, y = groups[order], ts[order], y[order]
+    starts = np.flatnonzero(np.r_[True, (groups[1:] != groups[:-1]) | (ts[1:] != ts[:-1])])
+    values = OPS[op].reduceat(y, starts)
+    if op == 'avg':
+        values = values / np.diff(np.r_[starts, len(y)])
+    return groups[starts], ts[starts], values
+
+
+class Aggregator:
+    def __init__(self, rules=None, cache=None, max_lag_minutes: float = None):
+        self.rules = load_rules() if rules is None else rules
+        self.cache = cache or history_cache
+        self.max_lag = pd.Timedelta(minutes=settings.AGGREGATION_MAX_LAG_MINUTES if max_lag_minutes is None else max_lag_minutes)
+        self._ids = {}  # aggregate fingerprint -> negative metric id in the history cache
+        self._next_id = itertools.count(-1, -1)  # never reused: a forgotten aggregate's id may still be in state
+
+    @property
+    def metrics(self) -> set:
+        return {r.metric for r in self.rules}
+
+    def series(self) -> dict:
+        """Aggregate fingerprint -> cache id of every aggregate seen so far."""
+        return dict(self._ids)
+
+    def forget(self, metric_ids) -> list:
+        """Fingerprints of the aggregates among `metric_ids` (expired from the cache); they stop being tracked."""
+        gone = set(metric_ids)
+        dropped = [fp for fp, agg_id in self._ids.items() if agg_id in gone]
+        for fp in dropped:
+            del self._ids[fp]
+        return dropped
+
+    def update(self, members) -> list:
+        """
+        `members` are (metric id, fingerprint) of registered series. Folds their
+        new cached points into the aggregates; returns (fingerprint, cache id)
+        of every aggregate that has members in the cache.
+        """
+        members = [(m_id, labels_from_fingerprint(fp)) for m_id, fp in members]
+        active = []
+        for rule in self.rules:
+            groups = {}
+            for m_id, labels in members:
+                group = rule.group_of(labels)
+                if group is not None:
+                    groups.setdefault(group, []).append(m_id)
+            try:
+                active.extend(self._update_rule(rule, groups))
+            except Exception as e:
+                logging.error(f"[Aggregate] {rule.name}: {e}")
+        return active
+
+    def _update_rule(self, rule: AggregationRule, groups: dict) -> list:
+        active, codes, ts, ys = [], [], [], []
+        for group, ids in groups.items():
+            frames = [f for f in (self.cache.peek(m) for m in ids) if f is not None and len(f)]
+            if not frames:
+                continue
+            fp = rule.fingerprint(group)
+            agg_id = self._ids.get(fp)
+            if agg_id is None:
+                agg_id = self._ids[fp] = next(self._next_id)
+            code = len(active)
+            active.append((fp, agg_id))
+
+            lasts = pd.DatetimeIndex([f['ds'].iloc[-1] for f in frames])
+            watermark = lasts[lasts >= lasts.max() - self.max_lag].min()
+            current = self.cache.peek(agg_id)
+            if current is None or not len(current):
+                # First cycle, or dropped by the cache budget: rebuild from the members' windows
+                self.cache.release([agg_id])
+                since = None
+            else:
+                since = current['ds'].iloc[-1]
+                if watermark <= since:
+                    continue
+            for f in frames:
+                lo = f['ds'].searchsorted(since, side='right') if since is not None else 0
+                tail = f.iloc[lo:f['ds'].searchsorted(watermark, side='right')]
+                if len(tail):
+                    ts.append(to_epoch_seconds(tail['ds']))
+                    ys.append(pd.to_numeric(tail['y'], errors='coerce').to_numpy(dtype=np.float64))
+                    codes.append(np.full(len(tail), code))
+
+        if ts:
+            groups_out, ts_out, values = reduce_points(rule.op, np.concatenate(codes), np.concatenate(ts), np.concatenate(ys))
+            bounds = np.searchsorted(groups_out, np.arange(len(active) + 1))
+            for code, (fp, agg_id) in enumerate(active):
+                lo, hi = bounds[code], bounds[code + 1]
+                if hi > lo:
+                    self.cache.update(agg_id, pd.DataFrame({'ds': pd.to_datetime(ts_out[lo:hi], unit='s'), 'y': values[lo:hi]}))
+        return active
+
+
+aggregator = Aggregator()
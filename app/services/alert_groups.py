@@ -0,0 +1,134 @@
+"""
+Alert grouping: the notifications of one cycle (new / repeating / resolved
+series) are grouped by (job, instance) before they reach the receivers and
+the explanation stage.
+
+- Host down: when the `up` series of an instance reports `host_down`, every
+  other series of that instance is a consequence (cpu/memory/network trend to
+  zero or vanish). They are suppressed and one alert is sent for the `up`
+  series with the count of affected series per metric family.
+- Storms: ALERT_GROUP_MIN_SIZE or more notifications of the same kind on one
+  instance become one alert, rooted at the most severe series.
+
+Capacity forecasts (results with kind='capacity') are grouped apart from
+anomalies, rooted at the soonest exhaustion, and suppressed for a down host
+like any other dependent series.
+
+Series state (firing registry, events) is unchanged: only delivery is
+grouped. With SHARDING_ENABLED, suppression applies to the instances whose
+`up` series is analysed by the same replica.
+"""
+import collections
+
+from core.config import settings
+from core.fingerprint import labels_from_fingerprint, metric_name_from_fingerprint
+
+ROOT_METRIC = 'up'
+
+
+def group_key(fingerprint: str) -> tuple:
+    labels = labels_from_fingerprint(fingerprint)
+    return labels.get('job', ''), labels.get('instance', fingerprint)
+
+
+def kind_of(res) -> str:
+    return res.get('kind') or 'anomaly'
+
+
+def severity_rank(item) -> tuple:
+    fp, res = item
+    if kind_of(res) == 'capacity':
+        hours = res.get('exhaustion_hours')
+        return (-(hours if hours is not None else float('inf')), fp)
+    z = res.get('z')
+    return (res.get('reason') == 'host_down', res.get('confidence') or 0.0, z if z is not None and z == z else 0.0, fp)
+
+
+class AlertGroup:
+    __slots__ = ('status', 'job', 'instance', 'root', 'members', 'host_down', 'kind')
+
+    def __init__(self, status: str, job: str, instance: str, root: tuple, members: list, host_down: bool = False,
+                 kind: str = 'anomaly'):
+        self.status = status
+        self.kind = kind      # 'anomaly' or 'capacity' (forecast alerts)
+        self.job = job
+        self.instance = instance
+        self.root = root          # (fingerprint, result) the alert is explained from
+        self.members = members    # the other (fingerprint, result) of the group
+        self.host_down = host_down
+
+    def __len__(self):
+        return 1 + len(self.members)
+
+    def counts(self) -> dict:
+        """Affected series per metric family (root excluded)."""
+        return dict(collections.Counter(metric_name_from_fingerprint(fp) or fp for fp, _ in self.members).most_common())
+
+    def summary(self) -> str:
+        """Suffix appended to the root alert; empty for a single series."""
+        if not self.members:
+            return ''
+        families = ', '.join(f"{name}: {n}" for name, n in self.counts().items())
+        if self.kind == 'capacity' and self.status == 'resolved':
+            return f"\n{len(self.members)} series khác trên {self.instance} cũng không còn dự kiến chạm ngưỡng ({families})"
+        if self.kind == 'capacity' and self.status in ('firing', 'repeating'):
+            return f"\n\n📦 <b>Đã gộp:</b> {len(self.members)} series khác trên {self.instance} cũng sắp chạm ngưỡng ({families})"
+        if self.status == 'resolved':
+            return f"\n{len(self.members)} series khác trên {self.instance} cũng đã trở lại bình thường ({families})"
+        if self.status == 'expired':
+            return f"\n{len(self.members)} series khác trên {self.instance} cũng đã được đóng ({families})"
+        if self.host_down:
+            return f"\n\n🔕 <b>Đã gộp:</b> {len(self.members)} series khác trên {self.instance} bị ẩn vì server không phản hồi ({families})"
+        return f"\n\n📦 <b>Đã gộp:</b> {len(self.members)} series khác trên {self.instance} cùng bất thường ({families})"
+
+
+class AlertGrouper:
+    def __init__(self, min_size: int = None, enabled: bool = None):
+        self.min_size = min_size or settings.ALERT_GROUP_MIN_SIZE
+        self.enabled = settings.ALERT_GROUPING_ENABLED if enabled is None else enabled
+        self.stats = {'notifications': 0, 'alerts': 0, 'suppressed': 0}
+
+    def group(self, notifications, down_fingerprints=()) -> list:
+        """
+        `notifications` are (status, fingerprint, result) of one cycle, status in
+        firing / repeating / resolved / expired (firing series whose state was
+        dropped: no longer reported by Prometheus), result a DetectionResult or
+        a capacity forecast (kind='capacity'); `down_fingerprints` are
+        the `up` series reporting host_down this cycle. Returns the AlertGroups
+        to deliver.
+        """
+        notifications = list(notifications)
+        self.stats['notifications'] += len(notifications)
+        if not self.enabled:
+            groups = [AlertGroup(status, *group_key(fp), (fp, res), [], kind=kind_of(res)) for status, fp, res in notifications]
+            self.stats['alerts'] += len(groups)
+            return groups
+
+        down = {group_key(fp) for fp in down_fingerprints}
+        buckets = collections.defaultdict(list)  # (status, kind, job, instance) -> [(fp, result)]
+        for status, fp, res in notifications:
+            buckets[(status, kind_of(res), *group_key(fp))].append((fp, res))
+
+        groups = []
+        for (status, kind, job, instance), items in buckets.items():
+            if (job, instance) in down and status in ('firing', 'repeating'):
+                roots = [it for it in items if metric_name_from_fingerprint(it[0]) == ROOT_METRIC]
+                if not roots:
+                    # The host-down alert itself went out in an earlier cycle
+                    self.stats['suppressed'] += len(items)
+                    continue
+                root = max(roots, key=severity_rank)
+                members = [it for it in items if it is not root]
+                self.stats['suppressed'] += len(members)
+                groups.append(AlertGroup(status, job, instance, root, members, host_down=True, kind=kind))
+            elif len(items) >= self.min_size:
+                items = sorted(items, key=severity_rank, reverse=True)
+                self.stats['suppressed'] += len(items) - 1
+                groups.append(AlertGroup(status, job, instance, items[0], items[1:], kind=kind))
+            else:
+                groups.extend(AlertGroup(status, job, instance, it, [], kind=kind) for it in items)
+        self.stats['alerts'] += len(groups)
+        return groups
+
+
+alert_grouper = AlertGrouper()
@@ -6,14 +6,28 @@ from models.anomaly_event import AnomalyEvent
 from models.base import Base
 from core.database import SessionLocal
 from sqlalchemy.exc import SQLAlchemyError
+from services.calendar_features import calendar_features, to_epoch_seconds
+from services.results import DetectionResult
 
 
 from core.config import settings
 
+
+def z_threshold_for(contamination: float) -> float:
+    """CONTAMINATION -> z-score threshold used by the spike rule."""
+    if contamination <= 0.01:
+        return 2.0
+    if contamination <= 0.02:
+        return 2.5
+    return 3.0
+
+
 class AnomalyEngine:
     __module__ = 'hour_sin'
-    def __init__(self, contamination=None):
+    def __init__(self, contamination=None, calendar=None):
         self.contamination = contamination if contamination is not None else settings.CONTAMINATION
+        # Shared, step-aligned calendar table: features are computed once per timestamp, not per series
+        self.calendar = calendar if calendar is not None else calendar_features
 
     def __repr__(self):
         return f"<AnomalyEngine features: hour_sin, hour_cos, weekday_sin, weekday_cos>"
@@ -37,29 +51,16 @@ class AnomalyEngine:
     def add_time_features(self, df: pd.DataFrame) -> pd.DataFrame:
         if 'hour_sin' in df.columns:
             return df
-        
-        df = df.copy()
-        df['hour'] = df['ds'].dt.hour
-        df['weekday'] = df['ds'].dt.weekday
-        df['hour_sin'] = np.sin(2 * np.pi * df['hour'] / 24)
-        df['hour_cos'] = np.cos(2 * np.pi * df['hour'] / 24)
-        df['weekday_sin'] = np.sin(2 * np.pi * df['weekday'] / 7)
-        df['weekday_cos'] = np.cos(2 * np.pi * df['weekday'] / 7)
-        return df
+        return self.calendar.attach(df)
 
-    def detect(self, df: pd.DataFrame, contamination=None, fingerprint: str = None) -> dict:
+    def detect(self, df: pd.DataFrame, contamination=None, fingerprint: str = None, baseline=None) -> DetectionResult:
         if contamination is None:
             contamination = self.contamination
-        if contamination <= 0.01:
-            z_threshold = 2.0
-        elif contamination <= 0.02:
-            z_threshold = 2.5
-        else:
-            z_threshold = 3.0
+        z_threshold = z_threshold_for(contamination)
 
         n = len(df)
         if n < 5:
-            return {'is_anomaly': False, 'confidence': 0.0, 'reason': 'too_short'}
+            return DetectionResult(reason='too_short')
         last = float(df['y'].iloc[-1])
         hist = df['y'].iloc[:-1].dropna()
         if len(hist) < 3:
@@ -68,6 +69,17 @@ class AnomalyEngine:
         else:
             mean = hist.mean()
             std = hist.std(ddof=0)
+
+        # Seasonal mode: center/scale of the hour-of-week (or hour-of-day) bucket of the last point.
+        # Robust mode: median and 1.4826*MAD from the series' quantile sketch.
+        baseline_kind = 'global'
+        if baseline is not None:
+            ts_last = int(to_epoch_seconds(df['ds'].iloc[-1:])[0])
+            b_center, b_scale, b_count = baseline.stats(ts_last)
+            min_samples = settings.ROBUST_MIN_SAMPLES if baseline.kind == 'robust' else settings.SEASONAL_MIN_SAMPLES
+            if b_count >= min_samples:
+                mean, std = b_center, b_scale
+                baseline_kind = baseline.kind
         z = 0.0
         # Nếu std = 0 (dữ liệu cực kỳ ổn định), ta dùng một ngưỡng nhỏ để phát hiện thay đổi
         if std > 0:
@@ -88,7 +100,6 @@ class AnomalyEngine:
         is_trend = abs(slope) > (0.1 * max(1.0, np.nanmean(np.abs(y_window))))
         is_anom = bool(is_spike or is_trend)
         reason = 'spike' if is_spike else ('trend' if is_trend else 'normal')
-        explanation = f"last={last:.3f}, mean={mean:.3f}, std={std:.3f}, z={z:.2f}, slope={slope:.4f}"
 
         # [NEW] Binary Metric Guard: Nếu là metric 'up' mà giá trị là 0, thì chắc chắn là lỗi
         # Kiểm tra fingerprint để biết đây là metric trạng thái
@@ -100,22 +111,18 @@ class AnomalyEngine:
                 is_anom = True
                 reason = 'host_down'
                 confidence = 1.0
-                explanation = f"CRITICAL: Host is DOWN (up=0). {explanation}"
 
         if is_spike and reason != 'host_down':
             confidence = max(confidence, min(1.0, 0.3 + z / 4.0))
         if is_trend and reason != 'host_down':
             confidence = max(confidence, min(1.0, abs(slope) / (1 + abs(mean))))
 
-        return {
-            'is_anomaly': is_anom,
-            'confidence': float(confidence),
-            'reason': reason,
-            'explanation': explanation
-        }
+        # The text of the result (DetectionResult.explanation) is only formatted for emitted alerts
+        return DetectionResult(is_anomaly=is_anom, confidence=confidence, reason=reason, baseline=baseline_kind,
+                               last=last, mean=mean, std=std, z=z, slope=slope)
 
-    def train_and_detect(self, df: pd.DataFrame, contamination=None, fingerprint: str = None):
+    def train_and_detect(self, df: pd.DataFrame, contamination=None, fingerprint: str = None, baseline=None):
         df = self.preprocess(df)
         df = self.add_time_features(df)
-        result = self.detect(df, contamination=contamination, fingerprint=fingerprint)
+        result = self.detect(df, contamination=contamination, fingerprint=fingerprint, baseline=baseline)
         return result
@@ -0,0 +1,288 @@
+"""
+Embedded read-only HTTP API (standard library only) over the detector's
+in-memory state, for dashboards and scripts that used to poll status.json.
+
+Every cycle `update_status_json` publishes a snapshot (series list, firing
+alerts, cycle summary); requests are answered from that snapshot and from
+HistoryCache, never from the database. Rendered responses are cached per
+snapshot with a strong ETag, so polling with If-None-Match costs a dict
+lookup and an empty 304; bodies are gzipped when the client accepts it.
+
+The one exception is /api/v1/events, the alert history: it reads
+`anomaly_events` (services/events.py, one index range scan per page) on every
+request and is only served when the API was given a session factory.
+
+    GET /api/v1/status                       cycle summary (cardinality, last_cycle, replica)
+    GET /api/v1/series?job=&instance=&stage=&firing=&metric=&limit=&cursor=
+    GET /api/v1/series/history?fingerprint=&since=&until=&limit=
+    GET /api/v1/alerts?instance=
+    GET /api/v1/events?fingerprint=&instance=&type=&since=&until=&limit=&cursor=
+    GET /healthz
+
+Lists are ordered by fingerprint (events: newest first) and paginated by
+keyset: pass `next_cursor` of a page as `cursor` to get the next one.
+"""
+import bisect
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from core.config import settings
+from core.fingerprint import labels_from_fingerprint, metric_name_from_fingerprint
+from services.events import EVENT_TYPES, recent_events
+from services.history_cache import history_cache
+
+GZIP_MIN_BYTES = 1024
+RESPONSE_CACHE_SIZE = 512
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# Range of the cache's datetime64[ns] `ds`: times outside it are clamped, not wrapped around
+TIME_MIN, TIME_MAX = datetime(1678, 1, 1), datetime(2262, 1, 1)
+
+
+def _parse_time(value: str) -> datetime:
+    """Epoch seconds or ISO-8601 -> naive UTC (the cache's `ds`)."""
+    try:
+        epoch = float(value)
+    except ValueError:
+        epoch = None
+    try:
+        if epoch is not None:
+            ts = datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+        else:
+            ts = datetime.fromisoformat(value)
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+    except (ValueError, OverflowError, OSError):
+        raise ApiError(400, f"invalid time: {value}")
+    return min(max(ts, TIME_MIN), TIME_MAX)
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ApiError(400, f"invalid boolean: {value}")
+
+
+class StatusAPI:
+    def __init__(self, history_cache=None, page_size: int = None, max_page_size: int = None, session_factory=None):
+        self.history_cache = history_cache
+        self.session_factory = session_factory  # database sessions for /api/v1/events (None: not served)
+        self.page_size = page_size or settings.API_PAGE_SIZE
+        self.max_page_size = max_page_size or settings.API_MAX_PAGE_SIZE
+        self._snapshot = {'version': 0, 'status': {}, 'metrics': [], 'ids': {}, 'alerts': []}
+        self._lock = threading.Lock()
+        self._responses = collections.OrderedDict()  # (version, path, query) -> (etag, body, gzipped body)
+        self._server = None
+
+    # ---- state -----------------------------------------------------------
+
+    def publish(self, status: dict, firing: dict = None, metric_ids: dict = None):
+        """Replace the snapshot (once per cycle); `status` is the status.json payload."""
+        metrics = sorted(status.get('metrics', []), key=lambda m: m['fingerprint'])
+        alerts = [dict(res, fingerprint=fp) for fp, res in sorted((firing or {}).items()) if isinstance(res, dict)]
+        snapshot = {
+            'version': self._snapshot['version'] + 1,
+            'status': {k: v for k, v in status.items() if k != 'metrics'},
+            'metrics': metrics,
+            'ids': dict(metric_ids or {}),
+            'alerts': alerts,
+        }
+        with self._lock:
+            self._snapshot = snapshot
+            self._responses.clear()
+
+    # ---- endpoints ---------------------------------------------------------
+
+    def _limit(self, params) -> int:
+        try:
+            limit = int(params.get('limit', self.page_size))
+        except ValueError:
+            raise ApiError(400, f"invalid limit: {params['limit']}")
+        return max(1, min(limit, self.max_page_size))
+
+    def series(self, snap, params) -> dict:
+        filters = []
+        for key in ('job', 'instance', 'stage'):
+            if key in params:
+                filters.append(lambda m, k=key, v=params[key]: str(m.get(k)) == v)
+        if 'firing' in params:
+            firing = _parse_bool(params['firing'])
+            filters.append(lambda m: bool(m.get('is_firing')) == firing)
+        if 'metric' in params:
+            filters.append(lambda m: metric_name_from_fingerprint(m['fingerprint']) == params['metric'])
+
+        limit = self._limit(params)
+        matches = [m for m in snap['metrics'] if all(f(m) for f in filters)] if filters else snap['metrics']
+        start = bisect.bisect_right(matches, params['cursor'], key=lambda m: m['fingerprint']) if 'cursor' in params else 0
+        items = matches[start:start + limit + 1]
+        has_more = len(items) > limit
+        items = items[:limit]
+        return {'items': items, 'total': len(matches),
+                'next_cursor': items[-1]['fingerprint'] if has_more else None}
+
+    def history(self, snap, params) -> dict:
+        fp = params.get('fingerprint')
+        if not fp:
+            raise ApiError(400, "missing fingerprint")
+        if fp not in snap['ids']:
+            raise ApiError(404, f"unknown series: {fp}")
+        df = self.history_cache.peek(snap['ids'][fp]) if self.history_cache is not None else None
+        if df is None:
+            # Evicted from memory (see HISTORY_CACHE_MAX_MB): the API never reloads from the database
+            return {'fingerprint': fp, 'cached': False, 'points': []}
+        ds = df['ds'].to_numpy(dtype='datetime64[ns]')
+        lo = int(np.searchsorted(ds, np.datetime64(_parse_time(params['since']), 'ns'))) if 'since' in params else 0
+        hi = int(np.searchsorted(ds, np.datetime64(_parse_time(params['until']), 'ns'))) if 'until' in params else len(ds)
+        lo = max(lo, hi - self._limit(params)) if 'limit' in params else lo
+        epochs = ds[lo:hi].astype('datetime64[s]').astype(np.int64)
+        values = df['y'].to_numpy(dtype=np.float64)[lo:hi]
+        points = [[int(t), None if np.isnan(v) else float(v)] for t, v in zip(epochs, values)]
+        return {'fingerprint': fp, 'cached': True, 'points': points}
+
+    def alerts(self, snap, params) -> dict:
+        items = snap['alerts']
+        if 'instance' in params:
+            items = [a for a in items if labels_from_fingerprint(a['fingerprint']).get('instance') == params['instance']]
+        return {'items': items, 'total': len(items)}
+
+    def events(self, snap, params) -> dict:
+        if self.session_factory is None:
+            raise ApiError(503, "event history is not available")
+        types = [t for t in params.get('type', '').split(',') if t]
+        unknown = set(types) - set(EVENT_TYPES)
+        if unknown:
+            raise ApiError(400, f"invalid type: {','.join(sorted(unknown))}")
+        before = None
+        if 'cursor' in params:
+            # "<timestamp>|<id>" of the last event of the previous page
+            try:
+                ts, event_id = params['cursor'].rsplit('|', 1)
+                before = (datetime.fromisoformat(ts), int(event_id))
+            except ValueError:
+                raise ApiError(400, f"invalid cursor: {params['cursor']}")
+        limit = self._limit(params)
+        session = self.session_factory()
+        try:
+            items = recent_events(session, fingerprint=params.get('fingerprint'), instance=params.get('instance'),
+                                  event_types=types or None,
+                                  since=_parse_time(params['since']) if 'since' in params else None,
+                                  until=_parse_time(params['until']) if 'until' in params else None,
+                                  limit=limit + 1, before=before)
+        finally:
+            session.close()
+        has_more = len(items) > limit
+        items = items[:limit]
+        return {'items': items, 'next_cursor': f"{items[-1]['timestamp']}|{items[-1]['id']}" if has_more else None}
+
+    ROUTES = {
+        '/api/v1/status': lambda self, snap, params: dict(snap['status'], version=snap['version']),
+        '/api/v1/series': series,
+        '/api/v1/series/history': history,
+        '/api/v1/alerts': alerts,
+        '/api/v1/events': events,
+        '/healthz': lambda self, snap, params: {'ok': True, 'version': snap['version']},
+    }
+
+    LIVE = {'/api/v1/events'}  # read from the database on every request: not cached per snapshot
+
+    # ---- HTTP --------------------------------------------------------------
+
+    def handle(self, target: str, headers) -> tuple:
+        """(status, headers, body) for a GET of `target` (path + query string); socket-free for tests."""
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        route = self.ROUTES.get(path)
+        if route is None:
+            return self._error(404, f"no route {url.path}")
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        snap = self._snapshot
+        key = (snap['version'], url.path, tuple(sorted(params.items())))
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None:
+                self._responses.move_to_end(key)
+        if cached is None:
+            try:
+                payload = route(self, snap, params)
+            except ApiError as e:
+                return self._error(e.status, str(e))
+            except Exception as e:
+                # Always answer: a dropped connection tells the client nothing
+                logging.error(f"[API] {target}: {e}")
+                return self._error(500, "internal error")
+            body = json.dumps(payload, default=str, separators=(',', ':')).encode()
+            etag = f'"{snap["version"]}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+            cached = [etag, body, None]
+            if path not in self.LIVE:
+                with self._lock:
+                    self._responses[key] = cached
+                    while len(self._responses) > RESPONSE_CACHE_SIZE:
+                        self._responses.popitem(last=False)
+
+        etag, body = cached[0], cached[1]
+        out = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding', 'Content-Type': 'application/json'}
+        if etag in [t.strip() for t in (headers.get('If-None-Match') or '').split(',')]:
+            return 304, out, b''
+        if 'gzip' in (headers.get('Accept-Encoding') or '') and len(body) >= GZIP_MIN_BYTES:
+            if cached[2] is None:
+                cached[2] = gzip.compress(body, compresslevel=5)
+            body = cached[2]
+            out['Content-Encoding'] = 'gzip'
+        return 200, out, body
+
+    @staticmethod
+    def _error(status: int, message: str) -> tuple:
+        return status, {'Content-Type': 'application/json'}, json.dumps({'error': message}).encode()
+
+    def serve(self, host: str = None, port: int = None, session_factory=None) -> ThreadingHTTPServer:
+        """Start the server in a daemon thread; returns it (server_address has the bound port)."""
+        api = self
+        if session_factory is not None:
+            self.session_factory = session_factory
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, headers, body = api.handle(self.path, self.headers)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        host = settings.API_HOST if host is None else host
+        port = settings.API_PORT if port is None else port
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='status-api', daemon=True).start()
+        logging.info(f"🌐 [API] Serving status on http://{host}:{self._server.server_address[1]}/api/v1")
+        return self._server
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+status_api = StatusAPI(history_cache)
@@ -0,0 +1,164 @@
+"""
+Cold archive of pruned history as Parquet files on local disk:
+
+    ARCHIVE_DIR/<metric family>/date=YYYY-MM-DD/data.parquet
+
+Points leaving the database are appended as `part-<epoch>.parquet` files
+(one per compacted slice, so re-archiving the same slice after a crash just
+overwrites it). Once a day is complete its parts are consolidated into a
+single `data.parquet`, sorted by fingerprint and timestamp so row-group
+statistics make fingerprint/time filters cheap. Readers prune partitions by
+family and date before opening any file.
+
+pyarrow is optional and only imported when the archive is used.
+"""
+import glob
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from core.config import settings
+from core.fingerprint import metric_name_from_fingerprint
+from models.metric import MetricModel
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_:.-]')
+DATA_FILE = 'data.parquet'
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("The Parquet archive needs pyarrow (pip install pyarrow)") from e
+    return pa, pq
+
+
+def family_name(fingerprint: str) -> str:
+    return _UNSAFE.sub('_', metric_name_from_fingerprint(fingerprint)) or '_unnamed'
+
+
+class ParquetArchive:
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._fingerprints = {}  # metric_id -> fingerprint
+
+    # ---- writing -------------------------------------------------------
+
+    def _fingerprint_map(self, session, metric_ids) -> dict:
+        with self._lock:
+            missing = [int(m) for m in metric_ids if m not in self._fingerprints]
+        if missing:
+            rows = session.query(MetricModel.id, MetricModel.metric_fingerprint).filter(MetricModel.id.in_(missing)).all()
+            with self._lock:
+                self._fingerprints.update(dict(rows))
+        with self._lock:
+            return {m: self._fingerprints.get(m, f'metric_id={m}') for m in metric_ids}
+
+    def _write_table(self, df: pd.DataFrame, path: str):
+        pa, pq = _pyarrow()
+        df = df.sort_values(['fingerprint', 'ds'], kind='stable')
+        table = pa.table({
+            'fingerprint': pa.array(df['fingerprint'].to_numpy(dtype=object), type=pa.string()).dictionary_encode(),
+            'timestamp': pa.array(df['ds'].to_numpy().astype('datetime64[s]')),
+            'value': pa.array(df['y'].to_numpy(dtype=np.float64)),
+        })
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, path)
+
+    def write(self, session, raw: pd.DataFrame) -> int:
+        """Archive raw points (metric_id, ds, y) that are about to be deleted. Returns the number of points written."""
+        if raw.empty:
+            return 0
+        fingerprints = self._fingerprint_map(session, raw['metric_id'].unique().tolist())
+        df = raw.assign(fingerprint=raw['metric_id'].map(fingerprints))
+        families = {fp: family_name(fp) for fp in df['fingerprint'].unique()}
+        df['family'] = df['fingerprint'].map(families)
+        df['day'] = df['ds'].dt.strftime('%Y-%m-%d')
+
+        for (family, day), group in df.groupby(['family', 'day']):
+            first = int(group['ds'].min().timestamp())
+            self._write_table(group, os.path.join(self.root, family, f'date={day}', f'part-{first}.parquet'))
+
+        # Days before the newest archived one are complete: fold their parts into one file
+        newest_day = df['day'].max()
+        for family in set(families.values()):
+            for day in self.days(family):
+                if day < newest_day:
+                    self.consolidate(family, day)
+        return len(df)
+
+    def consolidate(self, family: str, day: str):
+        """Merge the part files of one day (and any existing data file) into a single data.parquet."""
+        _, pq = _pyarrow()
+        part_dir = os.path.join(self.root, family, f'date={day}')
+        parts = sorted(glob.glob(os.path.join(part_dir, 'part-*.parquet')))
+        if not parts:
+            return
+        files = parts + ([os.path.join(part_dir, DATA_FILE)] if os.path.exists(os.path.join(part_dir, DATA_FILE)) else [])
+        frames = [pq.read_table(f).to_pandas() for f in files]
+        df = pd.concat(frames, ignore_index=True).rename(columns={'timestamp': 'ds', 'value': 'y'})
+        df['fingerprint'] = df['fingerprint'].astype(str)
+        df = df.drop_duplicates(['fingerprint', 'ds'], keep='first')
+        self._write_table(df, os.path.join(part_dir, DATA_FILE))
+        for f in parts:
+            os.remove(f)
+        logging.info(f"📦 [Archive] Consolidated {family} {day}: {len(parts)} parts, {len(df)} points")
+
+    # ---- reading -------------------------------------------------------
+
+    def families(self) -> list:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def days(self, family: str) -> list:
+        family_dir = os.path.join(self.root, family)
+        if not os.path.isdir(family_dir):
+            return []
+        return sorted(d[len('date='):] for d in os.listdir(family_dir) if d.startswith('date='))
+
+    def files(self, family: str, start: datetime = None, end: datetime = None) -> list:
+        """Parquet files of `family` whose date partition overlaps [start, end)."""
+        lo = start.strftime('%Y-%m-%d') if start else None
+        hi = (end - timedelta(microseconds=1)).strftime('%Y-%m-%d') if end else None
+        out = []
+        for day in self.days(family):
+            if (lo and day < lo) or (hi and day > hi):
+                continue
+            out.extend(sorted(glob.glob(os.path.join(self.root, family, f'date={day}', '*.parquet'))))
+        return out
+
+    def read(self, family: str, start: datetime = None, end: datetime = None, fingerprints=None) -> pd.DataFrame:
+        """Archived points of one metric family as a DataFrame (fingerprint, ds, y), sorted by fingerprint and time."""
+        _, pq = _pyarrow()
+        filters = []
+        if start is not None:
+            filters.append(('timestamp', '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append(('timestamp', '<', pd.Timestamp(end)))
+        if fingerprints is not None:
+            filters.append(('fingerprint', 'in', list(fingerprints)))
+        frames = [pq.read_table(f, filters=filters or None).to_pandas() for f in self.files(family, start, end)]
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return pd.DataFrame({'fingerprint': pd.Series(dtype=str), 'ds': pd.Series(dtype='datetime64[s]'), 'y': pd.Series(dtype=float)})
+        df = pd.concat(frames, ignore_index=True).rename(columns={'timestamp': 'ds', 'value': 'y'})
+        df['fingerprint'] = df['fingerprint'].astype(str)
+        return df.sort_values(['fingerprint', 'ds'], kind='stable').drop_duplicates(['fingerprint', 'ds']).reset_index(drop=True)
+
+    def read_series(self, fingerprint: str, start: datetime = None, end: datetime = None):
+        """One series as numpy arrays: (int64 epoch seconds, float64 values)."""
+        df = self.read(family_name(fingerprint), start, end, fingerprints=[fingerprint])
+        return df['ds'].to_numpy().astype('datetime64[s]').astype(np.int64), df['y'].to_numpy(dtype=np.float64)
+
+
+archive = ParquetArchive(settings.ARCHIVE_DIR)
@@ -0,0 +1,259 @@
+"""
+Vectorised replay of the detector and the alert state machine over stored
+history, for tuning CONTAMINATION (z threshold), the analysis window and the
+k-of-n firing rule.
+
+Instead of calling `train_and_detect` once per series per timestamp, the whole
+history is laid out as a (series x time) matrix and every timestamp is scored
+at once: the mean/std of the trailing window and the 20-point trend slope come
+from cumulative sums, so one window setting costs a handful of array passes.
+The firing rule is then simulated one time step at a time across all series.
+
+Differences from the live path: only the global baseline is replayed (not the
+seasonal/robust ones), and gaps are interpolated over the full range rather
+than only up to the evaluated point.
+"""
+import numpy as np
+
+from services.anomaly_service import z_threshold_for
+
+TREND_WINDOW = 20   # points used for the slope, as in AnomalyEngine.detect
+MIN_POINTS = 5      # detect() needs at least this many points
+STD_FLOOR_Z = 10.0  # z forced by detect() when the history is perfectly flat but the last point differs
+
+
+def align_matrix(metric_ids, ts_seconds, values, step_seconds: int, start: int = None, end: int = None):
+    """
+    Long format (metric_id, epoch seconds, value) -> (ids, t0, Y) where Y is a
+    float64 (series x slots) matrix on the step grid starting at t0; missing
+    slots are NaN. Points are snapped to the nearest earlier slot.
+    """
+    metric_ids = np.asarray(metric_ids)
+    ts = np.asarray(ts_seconds, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if start is None:
+        start = int(ts.min()) if len(ts) else 0
+    if end is None:
+        end = int(ts.max()) if len(ts) else start
+    t0 = start // step_seconds * step_seconds
+    slots = (ts - t0) // step_seconds
+    n_slots = (end - t0) // step_seconds + 1
+    keep = (slots >= 0) & (slots < n_slots)
+    ids, rows = np.unique(metric_ids[keep], return_inverse=True)
+    Y = np.full((len(ids), n_slots), np.nan)
+    Y[rows, slots[keep]] = values[keep]
+    return ids, t0, Y
+
+
+def counter_rates(Y: np.ndarray, step_seconds: int) -> np.ndarray:
+    """Per-second rate of counter rows (PromQL-style resets); the first column has no rate (NaN)."""
+    prev = Y[:, :-1]
+    cur = Y[:, 1:]
+    inc = cur - prev
+    inc = np.where(inc < 0, cur, inc)
+    return np.concatenate((np.full((len(Y), 1), np.nan), inc / step_seconds), axis=1)
+
+
+def fill_gaps(Y: np.ndarray) -> np.ndarray:
+    """Linear interpolation of NaNs along time, edges filled with the nearest value (all-NaN rows stay NaN)."""
+    valid = ~np.isnan(Y)
+    if valid.all():
+        return Y
+    T = Y.shape[1]
+    idx = np.arange(T)
+    prev_i = np.maximum.accumulate(np.where(valid, idx, -1), axis=1)
+    next_i = np.minimum.accumulate(np.where(valid, idx, T)[:, ::-1], axis=1)[:, ::-1]
+    has_prev, has_next = prev_i >= 0, next_i < T
+    rows = np.arange(len(Y))[:, None]
+    y_prev = Y[rows, np.clip(prev_i, 0, T - 1)]
+    y_next = Y[rows, np.clip(next_i, 0, T - 1)]
+    span = np.maximum(np.where(has_prev & has_next, next_i - prev_i, 1), 1)
+    frac = np.where(has_prev & has_next, (idx - prev_i) / span, 0.0)
+    filled = np.where(has_prev, y_prev, y_next)
+    filled = np.where(has_prev & has_next, y_prev + frac * (y_next - y_prev), filled)
+    return np.where(valid, Y, filled)
+
+
+def _cum(a: np.ndarray) -> np.ndarray:
+    """Cumulative sum along time with a leading zero column: window sums are c[:, hi] - c[:, lo]."""
+    out = np.zeros((a.shape[0], a.shape[1] + 1))
+    np.cumsum(a, axis=1, out=out[:, 1:])
+    return out
+
+
+def score(Y: np.ndarray, window_points: int):
+    """
+    Detector scores at every timestamp of a gap-filled matrix.
+
+    Returns (z, trend, valid): the z-score of each point against the mean/std
+    of the preceding `window_points - 1` points (the analysis window minus the
+    evaluated point), the 20-point trend flag, and whether detect() would run
+    at all (at least MIN_POINTS points so far).
+    """
+    S, T = Y.shape
+    t = np.arange(T)
+    level = np.nanmean(Y, axis=1, keepdims=True)
+    level = np.where(np.isnan(level), 0.0, level)
+    Yc = np.nan_to_num(Y - level)  # centred per series: keeps the cumulative sums well conditioned
+
+    # Trailing window statistics, excluding the evaluated point
+    c1, c2 = _cum(Yc), _cum(Yc * Yc)
+    lo = np.maximum(0, t - (window_points - 1))
+    n = np.maximum(t - lo, 1)
+    mean = (c1[:, t] - c1[:, lo]) / n
+    var = np.maximum((c2[:, t] - c2[:, lo]) / n - mean * mean, 0.0)
+    std = np.sqrt(var)
+    dev = np.abs(Yc - mean)
+    # Cancellation noise must not turn a perfectly flat history into a "change"
+    tol = 1e-9 * (1.0 + np.abs(mean + level))
+    flat = std <= tol
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(flat, np.where(dev > tol, STD_FLOOR_Z, 0.0), dev / np.where(flat, 1.0, std))
+
+    # Least-squares slope over the last k = min(20, t + 1) points, from running sums
+    k = np.minimum(TREND_WINDOW, t + 1)
+    first = t + 1 - k
+    cy = c1
+    ciy = _cum(Yc * t)
+    cabs = _cum(np.abs(np.nan_to_num(Y)))
+    sum_y = cy[:, t + 1] - cy[:, first]
+    sum_xy = (ciy[:, t + 1] - ciy[:, first]) - first * sum_y
+    sum_x = k * (k - 1) / 2.0
+    sum_x2 = (k - 1) * k * (2 * k - 1) / 6.0
+    denom = k * sum_x2 - sum_x * sum_x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(denom > 0, (k * sum_xy - sum_x * sum_y) / np.where(denom > 0, denom, 1.0), 0.0)
+    mean_abs = (cabs[:, t + 1] - cabs[:, first]) / k
+    trend = np.abs(slope) > 0.1 * np.maximum(1.0, mean_abs)
+
+    valid = np.broadcast_to(t >= MIN_POINTS - 1, (S, T)) & ~np.isnan(Y)
+    return z, trend, valid
+
+
+def simulate(flags: np.ndarray, host_down: np.ndarray, valid: np.ndarray, hits: int = 3, of: int = 5,
+             flap_window: int = 12, onsets: np.ndarray = None) -> dict:
+    """
+    Replay the alert state machine of run_cycle for every series at once: a
+    series fires when `hits` of its last `of` detections are anomalous (or on
+    host_down), resolves otherwise, and its window is cleared on resolve.
+
+    `onsets` (slot index per series, -1 when unlabelled) enables detection
+    metrics: time to detect, recall, and alerts on unlabelled series.
+    """
+    S, T = flags.shape
+    ring = np.zeros((S, of), dtype=np.int8)
+    count = np.zeros(S, dtype=np.int32)
+    pos = np.zeros(S, dtype=np.int64)
+    firing = np.zeros(S, dtype=bool)
+    last_resolve = np.full(S, -10 ** 9)
+    first_alert = np.full(S, -1)
+    alerts = np.zeros(S, dtype=np.int64)
+    flaps = 0
+    firing_steps = 0
+    rows = np.arange(S)
+    detect_after = np.full(S, -1) if onsets is None else np.asarray(onsets)
+    detected_at = np.full(S, -1)
+
+    for t in range(T):
+        v = valid[:, t]
+        if not v.any():
+            continue
+        f = flags[:, t].astype(np.int8)
+        # Push the new flag into each active series' ring buffer
+        r, p = rows[v], pos[v]
+        count[v] += f[v] - ring[r, p]
+        ring[r, p] = f[v]
+        pos[v] = (p + 1) % of
+
+        fire = v & ((count >= hits) | host_down[:, t])
+        fire |= firing & ~v  # series without data keep their state
+        new = fire & ~firing
+        resolved = firing & ~fire & v
+
+        if new.any():
+            alerts[new] += 1
+            flaps += int((t - last_resolve[new] <= flap_window).sum())
+            first_alert[new & (first_alert < 0)] = t
+            hit = new & (detect_after >= 0) & (detected_at < 0) & (t >= detect_after)
+            detected_at[hit] = t
+        # Already firing when the labelled anomaly starts: counts as detected immediately
+        hit = fire & (detect_after == t) & (detected_at < 0)
+        detected_at[hit] = t
+        if resolved.any():
+            last_resolve[resolved] = t
+            ring[resolved] = 0
+            count[resolved] = 0
+        firing = fire
+        firing_steps += int(firing.sum())
+
+    total = int(alerts.sum())
+    out = {
+        'alerts': total,
+        'series_alerted': int((alerts > 0).sum()),
+        'flaps': flaps,
+        'flap_rate': round(flaps / total, 4) if total else 0.0,
+        'firing_steps': firing_steps,
+        'evaluated_steps': int(valid.sum()),
+    }
+    if onsets is not None:
+        labelled = detect_after >= 0
+        ok = labelled & (detected_at >= 0)
+        ttd = detected_at[ok] - detect_after[ok]
+        out.update({
+            'labelled': int(labelled.sum()),
+            'detected': int(ok.sum()),
+            'recall': round(ok.sum() / labelled.sum(), 4) if labelled.any() else None,
+            'mean_ttd_steps': round(float(ttd.mean()), 3) if len(ttd) else None,
+            'alerts_unlabelled': int(alerts[~labelled].sum()),
+        })
+    return out
+
+
+def sweep(Y: np.ndarray, up_rows: np.ndarray, step_seconds: int, contaminations, window_hours, rules,
+          flap_window: int = 12, onsets: np.ndarray = None, block_size: int = 2000) -> list:
+    """
+    Evaluate every (contamination, window, k-of-n rule) combination. Scores are
+    computed once per window and block of series; thresholds and rules reuse
+    them. Returns one result dict per combination.
+    """
+    S = len(Y)
+    settings_grid = [(c, w, r) for c in contaminations for w in window_hours for r in rules]
+    partial = {key: [] for key in settings_grid}
+    for b in range(0, max(S, 1), block_size):
+        Yb = fill_gaps(Y[b:b + block_size])
+        up_b = np.asarray(up_rows[b:b + block_size], dtype=bool)[:, None]
+        host_down = up_b & (Yb == 0)
+        on_b = None if onsets is None else onsets[b:b + block_size]
+        for w in window_hours:
+            z, trend, valid = score(Yb, max(MIN_POINTS, int(w * 3600 // step_seconds)))
+            for c in contaminations:
+                flags = (z >= z_threshold_for(c)) | trend | host_down
+                for hits, of in rules:
+                    partial[(c, w, (hits, of))].append(simulate(flags, host_down, valid, hits, of, flap_window, on_b))
+
+    days = Y.shape[1] * step_seconds / 86400 if Y.size else 0
+    results = []
+    for (c, w, (hits, of)), parts in partial.items():
+        merged = _merge_parts(parts)
+        merged['alerts_per_series_day'] = round(merged['alerts'] / S / days, 6) if S and days else 0.0
+        results.append({'contamination': c, 'z_threshold': z_threshold_for(c), 'window_hours': w, 'rule': f'{hits}/{of}', **merged})
+    return results
+
+
+def _merge_parts(parts: list) -> dict:
+    """Combine per-block simulate() results."""
+    out = {k: sum(p[k] for p in parts) for k in ('alerts', 'series_alerted', 'flaps', 'firing_steps', 'evaluated_steps')}
+    out['flap_rate'] = round(out['flaps'] / out['alerts'], 4) if out['alerts'] else 0.0
+    out['firing_fraction'] = round(out.pop('firing_steps') / max(1, out.pop('evaluated_steps')), 6)
+    if parts and 'labelled' in parts[0]:
+        labelled = sum(p['labelled'] for p in parts)
+        detected = sum(p['detected'] for p in parts)
+        ttd_sum = sum((p['mean_ttd_steps'] or 0) * p['detected'] for p in parts)
+        out.update({
+            'labelled': labelled,
+            'detected': detected,
+            'recall': round(detected / labelled, 4) if labelled else None,
+            'mean_ttd_steps': round(ttd_sum / detected, 3) if detected else None,
+            'alerts_unlabelled': sum(p['alerts_unlabelled'] for p in parts),
+        })
+    return out
@@ -0,0 +1,104 @@
+import numpy as np
+
+# Epoch day 0 (1970-01-01) was a Thursday; shift so that bucket 0 is Monday 00:00 UTC
+_MONDAY_OFFSET_HOURS = 3 * 24
+
+PERIOD_BUCKETS = {'week': 168, 'day': 24}
+
+
+def season_bucket(ts_seconds, period: str = 'week'):
+    """Epoch seconds -> hour-of-week (0..167) or hour-of-day (0..23) bucket index."""
+    hours = np.asarray(ts_seconds, dtype=np.int64) // 3600
+    if period == 'day':
+        return hours % 24
+    return (hours + _MONDAY_OFFSET_HOURS) % 168
+
+
+class SeasonalBaseline:
+    """
+    Per-series running mean/variance for every hour-of-week (or hour-of-day)
+    bucket. Memory is fixed (three arrays of 168 or 24 floats) and each new
+    point is folded in O(1) with Welford/Chan updates. Once a bucket holds
+    `max_weight` observations its weight is capped, so old weeks fade out
+    exponentially instead of needing to be recomputed or expired.
+    """
+    kind = 'seasonal'
+    __slots__ = ('period', 'count', 'mean', 'm2', 'max_weight')
+
+    def __init__(self, period: str = 'week', max_weight: float = 48.0):
+        size = PERIOD_BUCKETS[period]
+        self.period = period
+        self.max_weight = float(max_weight)
+        self.count = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    @property
+    def nbytes(self) -> int:
+        return self.count.nbytes + self.mean.nbytes + self.m2.nbytes
+
+    def update(self, ts_seconds, values):
+        """Fold a batch of points (epoch seconds, values) into their buckets."""
+        values = np.asarray(values, dtype=np.float64)
+        ok = ~np.isnan(values)
+        if not ok.any():
+            return
+        buckets = season_bucket(np.asarray(ts_seconds)[ok], self.period)
+        values = values[ok]
+
+        size = len(self.count)
+        n_b = np.bincount(buckets, minlength=size).astype(np.float64)
+        touched = n_b > 0
+        mean_b = np.zeros(size)
+        mean_b[touched] = np.bincount(buckets, weights=values, minlength=size)[touched] / n_b[touched]
+        m2_b = np.bincount(buckets, weights=(values - mean_b[buckets]) ** 2, minlength=size)
+        self.merge(n_b, mean_b, m2_b)
+
+    def update_aggregates(self, ts_seconds, counts, means, stds):
+        """Fold pre-aggregated points (e.g. hourly rollups: count/mean/std starting at ts) into their buckets."""
+        n = np.asarray(counts, dtype=np.float64)
+        means = np.asarray(means, dtype=np.float64)
+        ok = (n > 0) & ~np.isnan(means)
+        if not ok.any():
+            return
+        buckets = season_bucket(np.asarray(ts_seconds)[ok], self.period)
+        n, means = n[ok], means[ok]
+        var = np.nan_to_num(np.asarray(stds, dtype=np.float64)[ok]) ** 2
+
+        size = len(self.count)
+        n_b = np.bincount(buckets, weights=n, minlength=size)
+        touched = n_b > 0
+        mean_b = np.zeros(size)
+        mean_b[touched] = np.bincount(buckets, weights=n * means, minlength=size)[touched] / n_b[touched]
+        m2_b = np.bincount(buckets, weights=n * (var + (means - mean_b[buckets]) ** 2), minlength=size)
+        self.merge(n_b, mean_b, m2_b)
+
+    def merge(self, n_b, mean_b, m2_b):
+        """Chan's parallel merge of per-bucket (count, mean, M2) into the running state."""
+        n_b = np.asarray(n_b, dtype=np.float64)
+        touched = n_b > 0
+        if not touched.any():
+            return
+        n_a = self.count[touched]
+        nb = n_b[touched]
+        n = n_a + nb
+        delta = np.asarray(mean_b, dtype=np.float64)[touched] - self.mean[touched]
+        self.mean[touched] += delta * nb / n
+        self.m2[touched] += np.asarray(m2_b, dtype=np.float64)[touched] + delta ** 2 * n_a * nb / n
+
+        # Cap the weight: keeps mean/variance, turns further updates into an exponential decay
+        over = n > self.max_weight
+        if over.any():
+            scale = self.max_weight / n[over]
+            idx = np.flatnonzero(touched)[over]
+            self.m2[idx] *= scale
+            n[over] = self.max_weight
+        self.count[touched] = n
+
+    def stats(self, ts_seconds: int):
+        """(mean, std, count) of the bucket `ts_seconds` falls in."""
+        b = int(season_bucket(ts_seconds, self.period))
+        count = self.count[b]
+        if count <= 0:
+            return 0.0, 0.0, 0.0
+        return float(self.mean[b]), float(np.sqrt(max(self.m2[b], 0.0) / count)), float(count)
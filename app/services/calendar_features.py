@@ -0,0 +1,125 @@
+import threading
+import numpy as np
+import pandas as pd
+
+
+def to_epoch_seconds(ds) -> np.ndarray:
+    """Datetime column/array (any resolution, naive UTC) -> int64 epoch seconds."""
+    values = ds.to_numpy() if isinstance(ds, (pd.Series, pd.Index)) else np.asarray(ds)
+    return values.astype('datetime64[s]').astype(np.int64)
+
+
+class CalendarFeatureTable:
+    """
+    Calendar features (hour, weekday and their sin/cos encodings) keyed by
+    step-aligned timestamp and shared by every series.
+
+    Every series in a cycle sits on the same step grid, so the features are
+    computed once per slot instead of once per point per series. The table
+    covers the analysis window, grows incrementally as time advances (only new
+    slots are computed) and is attached to a series by slot lookup: a
+    contiguous series gets zero-copy slices of the shared arrays.
+    """
+    COLUMNS = ('hour', 'weekday', 'hour_sin', 'hour_cos', 'weekday_sin', 'weekday_cos')
+
+    def __init__(self, step_seconds=300, window_hours=168):
+        self.step_seconds = int(step_seconds)
+        # Keep one extra day of slots so series slightly longer than the window still hit the table
+        self.max_slots = int((window_hours + 24) * 3600 // self.step_seconds)
+        self._lock = threading.Lock()
+        self._first = None   # slot number of index 0
+        self._cols = {}      # column -> ndarray indexed by (slot - first)
+
+    def configure(self, step_seconds=None, window_hours=None):
+        with self._lock:
+            if step_seconds:
+                self.step_seconds = int(step_seconds)
+            if window_hours:
+                self.max_slots = int((window_hours + 24) * 3600 // self.step_seconds)
+            self._first, self._cols = None, {}
+
+    def _compute(self, first_slot: int, last_slot: int) -> dict:
+        # Slot floors keep hour/weekday exact: the step divides an hour.
+        ts = np.arange(first_slot, last_slot + 1, dtype=np.int64) * self.step_seconds
+        hour = (ts // 3600) % 24
+        weekday = (ts // 86400 + 3) % 7  # 1970-01-01 was a Thursday (Monday=0)
+        cols = {
+            'hour': hour.astype(np.int32),
+            'weekday': weekday.astype(np.int32),
+            'hour_sin': np.sin(2 * np.pi * hour / 24),
+            'hour_cos': np.cos(2 * np.pi * hour / 24),
+            'weekday_sin': np.sin(2 * np.pi * weekday / 7),
+            'weekday_cos': np.cos(2 * np.pi * weekday / 7),
+        }
+        # Shared by every series: make accidental in-place writes fail loudly
+        for v in cols.values():
+            v.flags.writeable = False
+        return cols
+
+    @staticmethod
+    def _frozen(arr: np.ndarray) -> np.ndarray:
+        arr.flags.writeable = False
+        return arr
+
+    def _ensure(self, lo: int, hi: int):
+        """Make sure slots [lo, hi] are in the table; returns (first, cols) or None if out of budget."""
+        with self._lock:
+            if self._first is None:
+                if hi - lo + 1 > self.max_slots:
+                    return None
+                self._first, self._cols = lo, self._compute(lo, hi)
+                return self._first, self._cols
+
+            first = self._first
+            last = first + len(self._cols['hour']) - 1
+            if lo >= first and hi <= last:
+                return first, self._cols
+
+            new_lo, new_hi = min(lo, first), max(hi, last)
+            if hi - lo + 1 > self.max_slots:
+                return None
+            cols = self._cols
+            if new_lo < first:
+                head = self._compute(new_lo, first - 1)
+                cols = {k: self._frozen(np.concatenate([head[k], cols[k]])) for k in self.COLUMNS}
+            if new_hi > last:
+                tail = self._compute(last + 1, new_hi)
+                cols = {k: self._frozen(np.concatenate([cols[k], tail[k]])) for k in self.COLUMNS}
+
+            # Drop slots that fell out of the window, but never the requested range
+            excess = (new_hi - new_lo + 1) - self.max_slots
+            if excess > 0:
+                cut = min(excess, lo - new_lo)
+                if cut > 0:
+                    cols = {k: v[cut:] for k, v in cols.items()}
+                    new_lo += cut
+            # Arrays are replaced, never mutated, so readers holding the old ones stay valid.
+            self._first, self._cols = new_lo, cols
+            return self._first, self._cols
+
+    def lookup(self, ds) -> dict:
+        """Feature arrays aligned with `ds`; slices of the shared table when `ds` is contiguous."""
+        slots = to_epoch_seconds(ds) // self.step_seconds
+        if len(slots) == 0:
+            return {k: np.empty(0) for k in self.COLUMNS}
+        lo, hi = int(slots.min()), int(slots.max())
+        table = self._ensure(lo, hi)
+        if table is None:
+            cols = self._compute(lo, hi)
+            first = lo
+        else:
+            first, cols = table
+
+        start = int(slots[0]) - first
+        if hi - lo + 1 == len(slots) and slots[0] == lo and np.all(np.diff(slots) == 1):
+            return {k: v[start:start + len(slots)] for k, v in cols.items()}
+        idx = slots - first
+        return {k: v.take(idx) for k, v in cols.items()}
+
+    def attach(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Return `df` (shallow copy, no data copied) with the calendar columns attached."""
+        feats = pd.DataFrame(self.lookup(df['ds']), index=df.index, copy=False)
+        return pd.concat([df, feats], axis=1)
+
+
+calendar_features = CalendarFeatureTable()
@@ -0,0 +1,145 @@
+"""
+Cardinality guard: caps how many series one query (MAX_SERIES_PER_QUERY) and
+one whole cycle (MAX_SERIES_TOTAL) may analyse, so a single exploding metric
+(e.g. node_filesystem_* on hosts with hundreds of overlay mounts) cannot stall
+the cycle or starve every other metric.
+
+MAX_SERIES_TOTAL is split between the queries before any of them runs
+(`begin_cycle(demand)`, from their registered series counts): smallest demand
+first, each query gets at most an equal share of what is left. The split does
+not depend on which worker thread finishes first, so the same series stay in
+(or out of) analysis cycle after cycle.
+
+Over the limit, CARDINALITY_POLICY decides which series are kept:
+- 'hash': a stable sample (smallest hash of the series key), so the same
+  series are analysed cycle after cycle;
+- 'topk_variance' / 'topk_change': the series with the highest variance /
+  largest recent level change in the history cache (series without history
+  rank last, in hash order);
+- 'drop': the whole query is skipped for this cycle.
+"""
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from core.config import settings
+
+POLICIES = ('hash', 'topk_variance', 'topk_change', 'drop')
+RECENT_POINTS = 12  # "recent" window of topk_change, in points
+
+
+def stable_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+def variance_score(df) -> float:
+    y = df['y'].to_numpy(dtype=np.float64) if df is not None and len(df) else np.empty(0)
+    y = y[~np.isnan(y)]
+    return float(np.var(y)) if len(y) > 1 else -1.0
+
+
+def change_score(df) -> float:
+    """|mean of the last RECENT_POINTS - mean before| in units of the earlier std."""
+    y = df['y'].to_numpy(dtype=np.float64) if df is not None and len(df) else np.empty(0)
+    y = y[~np.isnan(y)]
+    if len(y) <= RECENT_POINTS + 1:
+        return -1.0
+    before, recent = y[:-RECENT_POINTS], y[-RECENT_POINTS:]
+    std = before.std()
+    return float(abs(recent.mean() - before.mean()) / (std if std > 0 else 1.0))
+
+
+class CardinalityGuard:
+    def __init__(self, per_query: int = None, total: int = None, policy: str = None):
+        self.per_query = settings.MAX_SERIES_PER_QUERY if per_query is None else per_query
+        self.total = settings.MAX_SERIES_TOTAL if total is None else total
+        self.policy = (policy or settings.CARDINALITY_POLICY).lower()
+        if self.policy not in POLICIES:
+            logging.warning(f"Unknown CARDINALITY_POLICY '{self.policy}', using 'hash'")
+            self.policy = 'hash'
+        self._lock = threading.Lock()
+        self._used = 0
+        self._quota = {}     # query -> share of the global budget planned for this cycle
+        self._spare = self.total  # budget left for queries outside the plan (first come, first served)
+        self.truncated = {}  # query -> report of the last cycle
+
+    def plan(self, demand: dict) -> dict:
+        """Split the global budget between queries (query -> series wanted), smallest demand first, ties by query."""
+        wants = sorted((min(n, self.per_query) if self.per_query else n, q) for q, n in demand.items())
+        left, quota = self.total, {}
+        for i, (n, q) in enumerate(wants):
+            quota[q] = min(n, left // (len(wants) - i))
+            left -= quota[q]
+        return quota
+
+    def begin_cycle(self, demand: dict = None):
+        """Start a cycle; `demand` (query -> registered series) pre-splits MAX_SERIES_TOTAL."""
+        with self._lock:
+            self._used = 0
+            self.truncated = {}
+            self._quota = self.plan(demand) if demand and self.total else {}
+            self._spare = self.total - sum(self._quota.values()) if self.total else 0
+
+    def _reserve(self, query: str, wanted: int) -> int:
+        """Take up to `wanted` series from the share of `query` (or from the spare budget) of this cycle."""
+        with self._lock:
+            if not self.total:
+                allowed = wanted
+            elif query in self._quota:
+                allowed = min(wanted, self._quota[query])
+            else:
+                allowed = max(0, min(wanted, self._spare))
+                self._spare -= allowed
+            self._used += allowed
+            return allowed
+
+    def select(self, query: str, keys: list, history=None) -> set:
+        """
+        Series keys of `query` that may be analysed this cycle. `keys` are
+        hashable series identifiers (str() is hashed for sampling); `history`
+        maps a key to its cached DataFrame (or None) for the top-k policies.
+        """
+        n = len(keys)
+        limit = min(n, self.per_query) if self.per_query else n
+        if limit < n and self.policy == 'drop':
+            limit = 0
+        limit = self._reserve(query, limit)
+        if limit >= n:
+            return set(keys)
+
+        order = sorted(keys, key=lambda k: stable_hash(str(k)))
+        if limit and self.policy in ('topk_variance', 'topk_change') and history is not None:
+            score = variance_score if self.policy == 'topk_variance' else change_score
+            scores = {k: score(history(k)) for k in order}
+            order = sorted(order, key=lambda k: -scores[k])  # stable: ties keep hash order
+        kept = set(order[:limit])
+
+        report = {'series': n, 'kept': limit, 'policy': self.policy,
+                  'at': datetime.now(timezone.utc).replace(tzinfo=None).isoformat()}
+        with self._lock:
+            self.truncated[query] = report
+        logging.warning(f"✂️ [Cardinality] {query}: {n} series over the limit, analysing {limit} ({self.policy})")
+        return kept
+
+    def log_cycle(self) -> int:
+        """One WARNING naming the queries truncated this cycle; returns how many series were left out."""
+        with self._lock:
+            truncated = dict(self.truncated)
+        dropped = sum(r['series'] - r['kept'] for r in truncated.values())
+        if truncated:
+            worst = sorted(truncated.items(), key=lambda kv: kv[1]['kept'] - kv[1]['series'])
+            detail = ', '.join(f"{q} ({r['series'] - r['kept']}/{r['series']})" for q, r in worst)
+            logging.warning(f"✂️ [Cardinality] {dropped} series not analysed this cycle "
+                            f"(MAX_SERIES_PER_QUERY={self.per_query}, MAX_SERIES_TOTAL={self.total}): {detail}")
+        return dropped
+
+    def report(self) -> dict:
+        with self._lock:
+            return {'used': self._used, 'per_query_limit': self.per_query, 'total_limit': self.total,
+                    'policy': self.policy, 'truncated': dict(self.truncated)}
+
+
+cardinality_guard = CardinalityGuard()
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from services.calendar_features import to_epoch_seconds
+
+# Prometheus naming conventions for monotonically increasing series
+COUNTER_SUFFIXES = ('_total', '_count', '_sum', '_bucket')
+
+
+def is_counter(metric_name: str, metric_types: dict = None) -> bool:
+    """
+    Decide whether a metric is a cumulative counter, preferring Prometheus
+    metadata (`/api/v1/metadata`) and falling back to naming conventions.
+    Histogram/summary `_count`/`_sum`/`_bucket` children count as counters.
+    """
+    if not metric_name:
+        return False
+    if metric_types:
+        mtype = metric_types.get(metric_name)
+        if mtype is not None:
+            return mtype == 'counter'
+        for suffix in ('_count', '_sum', '_bucket'):
+            if metric_name.endswith(suffix) and metric_types.get(metric_name[:-len(suffix)]) in ('histogram', 'summary'):
+                return True
+    return metric_name.endswith(COUNTER_SUFFIXES)
+
+
+def counter_to_rate(ts_seconds: np.ndarray, values: np.ndarray, prev=None):
+    """
+    Per-second rate between consecutive samples of a counter, with the same
+    reset handling as PromQL `rate()`: a drop means the counter restarted, so
+    the increase is the new value itself.
+
+    `prev` is the (ts, value) of the sample preceding this batch; without it the
+    first sample has no rate (NaN). Returns (rates, new_prev).
+    """
+    ts = np.asarray(ts_seconds, dtype=np.float64)
+    v = np.asarray(values, dtype=np.float64)
+    ok = ~np.isnan(v)
+    if not ok.any():
+        return np.full(len(v), np.nan), prev
+
+    ts_ok, v_ok = ts[ok], v[ok]
+    if prev is not None:
+        ts_all = np.concatenate(([prev[0]], ts_ok))
+        v_all = np.concatenate(([prev[1]], v_ok))
+    else:
+        ts_all, v_all = ts_ok, v_ok
+
+    increase = np.diff(v_all)
+    reset = increase < 0
+    increase[reset] = v_all[1:][reset]
+    dt = np.diff(ts_all)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step_rates = np.where(dt > 0, increase / dt, np.nan)
+    if prev is None:
+        step_rates = np.concatenate(([np.nan], step_rates))
+
+    rates = np.full(len(v), np.nan)
+    rates[ok] = step_rates
+    return rates, (float(ts_ok[-1]), float(v_ok[-1]))
+
+
+def rate_frame(df: pd.DataFrame, prev=None):
+    """Counter frame (ds, y) -> (rate frame without the points that have no rate, new_prev)."""
+    if df.empty:
+        return df, prev
+    rates, new_prev = counter_to_rate(to_epoch_seconds(df['ds']), pd.to_numeric(df['y'], errors='coerce').to_numpy(), prev)
+    out = df.copy(deep=False)
+    out['y'] = rates
+    return out[~np.isnan(rates)], new_prev
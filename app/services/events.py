@@ -0,0 +1,167 @@
+"""
+Alert history: every state transition of a series (detected, firing,
+repeating, resolved) becomes a row in `anomaly_events`.
+
+`record()` only puts the event on a bounded in-memory queue, so alerting never
+waits on the database; a background thread drains the queue and writes
+multi-row INSERTs of up to EVENT_BATCH_SIZE rows, at least every
+EVENT_FLUSH_SECONDS. When the queue is full (database down for a long time)
+new events are dropped and counted rather than blocking the cycle.
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect, insert, or_, and_, text
+
+from core.config import settings
+from models.anomaly_event import AnomalyEvent
+
+EVENT_TYPES = ('detected', 'firing', 'repeating', 'resolved')
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Single-column index of older versions, redundant with idx_event_fingerprint_ts (same leading column)
+LEGACY_INDEXES = ('ix_anomaly_events_metric_fingerprint',)
+
+
+def migrate(engine):
+    """Add the columns/indexes introduced for the event log to an `anomaly_events` table created by older versions (and drop the legacy ones)."""
+    insp = inspect(engine)
+    if not insp.has_table(AnomalyEvent.__tablename__):
+        return
+    existing = {c['name'] for c in insp.get_columns(AnomalyEvent.__tablename__)}
+    with engine.begin() as conn:
+        for column in AnomalyEvent.__table__.columns:
+            if column.name not in existing:
+                conn.execute(text(f'ALTER TABLE {AnomalyEvent.__tablename__} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'))
+        for index in AnomalyEvent.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        for name in LEGACY_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+class EventRecorder:
+    def __init__(self, batch_size: int = None, flush_seconds: float = None, max_queue: int = None):
+        self.batch_size = batch_size or settings.EVENT_BATCH_SIZE
+        self.flush_seconds = flush_seconds or settings.EVENT_FLUSH_SECONDS
+        self._queue = queue.Queue(maxsize=max_queue or settings.EVENT_QUEUE_SIZE)
+        self._session_factory = None
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+
+    def start(self, session_factory):
+        if self._thread is not None:
+            return
+        self._session_factory = session_factory
+        self._thread = threading.Thread(target=self._run, name='event-writer', daemon=True)
+        self._thread.start()
+
+    def record(self, event_type: str, fingerprint: str, instance: str = None, result: dict = None,
+               severity: str = 'warning', description: str = None, timestamp: datetime = None):
+        """Queue one event; never blocks. No-op until start() has been called."""
+        if self._thread is None:
+            return
+        result = result or {}
+        confidence = result.get('confidence')
+        event = {
+            'metric_fingerprint': fingerprint,
+            'timestamp': timestamp or _utcnow(),
+            'event_type': event_type,
+            'instance': instance,
+            'severity': severity,
+            'reason': result.get('reason'),
+            'confidence': float(confidence) if confidence is not None else None,
+            'description': description if description is not None else result.get('explanation'),
+        }
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logging.warning(f"[Events] Queue full, {self.dropped} events dropped so far")
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        session = self._session_factory()
+        try:
+            session.execute(insert(AnomalyEvent), batch)
+            session.commit()
+            self.written += len(batch)
+        except Exception as e:
+            session.rollback()
+            self.dropped += len(batch)
+            logging.error(f"[Events] Failed to write {len(batch)} events: {e}")
+        finally:
+            session.close()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until every queued event has been written (shutdown, tests)."""
+        if self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+def recent_events(session, fingerprint: str = None, instance: str = None, event_types=None,
+                  since: datetime = None, until: datetime = None, limit: int = 100, before: tuple = None) -> list:
+    """
+    Newest events first, as dicts. Filters map onto the (fingerprint, timestamp),
+    (instance, timestamp) and (timestamp) indexes, so a page is an index range
+    scan even on a large table. `before=(timestamp, id)` of the last row of a
+    page returns the next page (keyset pagination, no OFFSET).
+    """
+    q = session.query(AnomalyEvent)
+    if fingerprint:
+        q = q.filter(AnomalyEvent.metric_fingerprint == fingerprint)
+    if instance:
+        q = q.filter(AnomalyEvent.instance == instance)
+    if event_types:
+        q = q.filter(AnomalyEvent.event_type.in_(list(event_types)))
+    if since is not None:
+        q = q.filter(AnomalyEvent.timestamp >= since)
+    if until is not None:
+        q = q.filter(AnomalyEvent.timestamp < until)
+    if before is not None:
+        ts, event_id = before
+        q = q.filter(or_(AnomalyEvent.timestamp < ts, and_(AnomalyEvent.timestamp == ts, AnomalyEvent.id < event_id)))
+    rows = q.order_by(AnomalyEvent.timestamp.desc(), AnomalyEvent.id.desc()).limit(limit).all()
+    return [{
+        'id': r.id,
+        'timestamp': r.timestamp.isoformat() if r.timestamp else None,
+        'fingerprint': r.metric_fingerprint,
+        'instance': r.instance,
+        'event_type': r.event_type,
+        'severity': r.severity,
+        'reason': r.reason,
+        'confidence': r.confidence,
+        'description': r.description,
+    } for r in rows]
+
+
+event_recorder = EventRecorder()
@@ -0,0 +1,100 @@
+"""
+Asynchronous explanation stage between detection and alert delivery.
+
+The narrative of an alert (title / impact / action) only depends on the
+metric family, the reason and the severity bucket, so it is generated once
+per key and cached (LRU, LLM_CACHE_TTL_SECONDS); concurrent requests for a key
+that is being generated wait for that one call instead of starting their own.
+Generation runs on LLM_WORKERS threads behind a queue of at most
+LLM_QUEUE_SIZE pending alerts: when the queue is full the alert is rendered
+with the template right away, so the detection cycle never waits on the model.
+"""
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+from clients.llm import severity_bucket
+from core.config import settings
+from core.tracing import tracer
+from core.fingerprint import metric_name_from_fingerprint
+from services.results import DetectionResult
+
+
+class ExplanationService:
+    def __init__(self, llm, workers: int = None, max_pending: int = None, cache_size: int = None, cache_ttl: float = None):
+        self.llm = llm
+        self.cache_size = cache_size or settings.LLM_CACHE_SIZE
+        self.cache_ttl = settings.LLM_CACHE_TTL_SECONDS if cache_ttl is None else cache_ttl
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers or settings.LLM_WORKERS, thread_name_prefix='explain')
+        self._slots = threading.BoundedSemaphore(max_pending or settings.LLM_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()  # key -> (expires_at, narrative)
+        self._inflight = {}                      # key -> Future of the narrative being generated
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'overflow': 0}
+
+    @staticmethod
+    def key(fingerprint: str, result: dict) -> tuple:
+        # Series without __name__ (custom PROM_QUERY results) share one family, not one key per series
+        family = metric_name_from_fingerprint(fingerprint) or 'unknown'
+        return family, result.get('reason', 'unknown'), severity_bucket(result.get('confidence'))
+
+    def narrative(self, key: tuple) -> dict:
+        """Cached narrative for (family, reason, severity), generating it at most once at a time per key."""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = concurrent.futures.Future()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            narrative = self.llm.narrative(*key)
+        except Exception as e:
+            logging.error(f"[Explain] Narrative generation crashed for {key}: {e}")
+            narrative = self.llm.template_narrative(key[0], key[1])
+        with self._lock:
+            # Template fallbacks of a failed model call are not cached, the next alert retries the model
+            if narrative.get('source') != 'template' or not self.llm.api_url:
+                self._cache[key] = (time.monotonic() + self.cache_ttl, narrative)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            self._inflight.pop(key, None)
+        future.set_result(narrative)
+        return narrative
+
+    def explain(self, fingerprint: str, result: dict) -> str:
+        return self.llm.render(result, self.narrative(self.key(fingerprint, result)))
+
+    def explain_async(self, fingerprint: str, result: dict, callback):
+        """Generate the text in the worker pool and hand it to `callback(text)`; never blocks the caller."""
+        if not isinstance(result, DetectionResult):
+            result = dict(result)
+        if not self._slots.acquire(blocking=False):
+            self.stats['overflow'] += 1
+            key = self.key(fingerprint, result)
+            callback(self.llm.render(result, self.llm.template_narrative(key[0], key[1])))
+            return
+
+        def job():
+            try:
+                text = self.explain(fingerprint, result)
+            except Exception as e:
+                logging.error(f"[Explain] {fingerprint}: {e}")
+                text = self.llm.explain_anomaly(fingerprint, result)
+            finally:
+                self._slots.release()
+            callback(text)
+
+        self._executor.submit(tracer.wrap(job))
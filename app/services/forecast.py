@@ -0,0 +1,247 @@
+"""
+Capacity forecasting: when does a disk fill up, when does a link saturate.
+
+FORECAST_RULES is a JSON list of {metric, threshold, direction}: `metric` is
+a regex on the metric name, `direction` 'down' (free space falling to the
+threshold) or 'up' (usage rising to it). Counters are cached as per-second
+rates, so a bandwidth rule compares bytes/s with the link capacity:
+
+    [{"metric": "node_filesystem_avail_bytes", "threshold": 0, "direction": "down"},
+     {"metric": "node_network_transmit_bytes_total", "threshold": 125000000, "direction": "up"}]
+
+Every eligible series gets an additive damped-trend Holt model (damping
+FORECAST_DAMPING per step, 1 = linear trend). All series are run together, one
+numpy operation per time step over a (series x parameter grid) array, and each
+series keeps the (alpha, beta) pair with the lowest running one-step error, so
+the smoothing is refitted continuously instead of by a per-series optimiser.
+The state (level, trend, error) is kept between cycles: a cycle only feeds the
+points cached since the previous one, a new series runs over its cached window once.
+
+The time to reach the threshold comes from the closed form of the damped
+forecast; the band is where the forecast -/+ FORECAST_Z standard errors
+crosses it, on a log-spaced horizon grid up to FORECAST_HORIZON_HOURS.
+"""
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+from core.config import settings
+from core.fingerprint import metric_name_from_fingerprint
+from services.calendar_features import to_epoch_seconds
+from services.history_cache import history_cache
+
+ALPHAS, BETAS = np.meshgrid([0.05, 0.2, 0.5], [0.01, 0.1])
+ALPHAS, BETAS = ALPHAS.ravel(), BETAS.ravel()  # parameter grid, fitted per series
+ERROR_DECAY = 0.02   # weight of the newest squared one-step error in the running error
+INIT_POINTS = 12     # points used for the initial trend of a new series
+BATCH = 1024         # series per padded matrix
+HORIZON_GRID = 256   # log-spaced horizons used for the bands
+
+
+class ForecastRule:
+    __slots__ = ('metric', 'threshold', 'direction', '_pattern')
+
+    def __init__(self, metric: str, threshold: float = 0.0, direction: str = 'down'):
+        if direction not in ('down', 'up'):
+            raise ValueError(f"forecast rule {metric!r}: direction must be 'down' or 'up'")
+        self.metric = metric
+        self.threshold = float(threshold)
+        self.direction = direction
+        self._pattern = re.compile(metric)
+
+    def matches(self, name: str) -> bool:
+        return self._pattern.fullmatch(name) is not None
+
+    @property
+    def sign(self) -> int:
+        return 1 if self.direction == 'up' else -1
+
+
+def load_rules(raw: str = None) -> list:
+    raw = settings.FORECAST_RULES if raw is None else raw
+    return [ForecastRule(e['metric'], e.get('threshold', 0), e.get('direction', 'down')) for e in json.loads(raw or '[]')]
+
+
+def holt_run(L, T, V, Y, phi: float) -> tuple:
+    """
+    Feed the columns of Y (k x n, NaN = no point) to damped Holt models with
+    state L, T, V (k x p, one column per grid parameter pair). Returns the new state.
+    """
+    for t in range(Y.shape[1]):
+        y = Y[:, t:t + 1]
+        ok = ~np.isnan(y)
+        pred = L + phi * T
+        err = np.where(ok, y - pred, 0.0)
+        level = pred + ALPHAS * err
+        T = np.where(ok, phi * T + BETAS * (level - L - phi * T), T)
+        V = np.where(ok, V + ERROR_DECAY * (err * err - V), V)
+        L = np.where(ok, level, L)
+    return L, T, V
+
+
+def damped_sum(h, phi: float):
+    """phi + phi^2 + ... + phi^h (h steps of damped trend)."""
+    return h if phi >= 1 else phi * (1 - phi ** h) / (1 - phi)
+
+
+def forecast_sd(sigma, alpha, beta, h):
+    """Standard error of the h-step forecast (undamped Holt approximation, conservative for phi < 1)."""
+    h = np.maximum(h, 1.0)
+    extra = (h - 1) + beta * h * (h - 1) + beta * beta * (h - 1) * h * (2 * h - 1) / 6
+    return sigma * np.sqrt(1 + alpha * alpha * extra)
+
+
+class CapacityForecaster:
+    def __init__(self, rules=None, damping: float = None, horizon_hours: float = None, min_points: int = None,
+                 z: float = None, cache=None):
+        self.rules = load_rules() if rules is None else rules
+        self.phi = settings.FORECAST_DAMPING if damping is None else damping
+        self.horizon_hours = horizon_hours or settings.FORECAST_HORIZON_HOURS
+        self.min_points = min_points or settings.FORECAST_MIN_POINTS
+        self.z = settings.FORECAST_Z if z is None else z
+        self.cache = cache or history_cache
+        self._state = {}   # metric id -> [L (p), T (p), V (p), points seen, last epoch ts, step seconds]
+        self.latest = []   # forecasts of the last cycle
+        self.covered = set()  # fingerprints matching a rule in the last cycle (forecast or not yet)
+
+    def rule_for(self, fingerprint: str):
+        name = metric_name_from_fingerprint(fingerprint)
+        return next((r for r in self.rules if r.matches(name)), None)
+
+    def forget(self, metric_ids):
+        for m_id in metric_ids:
+            self._state.pop(m_id, None)
+
+    def update(self, series: dict) -> list:
+        """
+        Fold the new cached points of every eligible series (fingerprint -> cache
+        id) into its model and return the forecasts, soonest exhaustion first.
+        """
+        eligible, covered = [], set()
+        for fp, m_id in series.items():
+            rule = self.rule_for(fp)
+            if rule is not None:
+                covered.add(fp)
+                frame = self.cache.peek(m_id)
+                if frame is not None and len(frame):
+                    eligible.append((fp, m_id, rule, frame))
+        for lo in range(0, len(eligible), BATCH):
+            self._fit(eligible[lo:lo + BATCH])
+        ready = [(fp, m_id, rule) for fp, m_id, rule, _ in eligible if m_id in self._state and self._state[m_id][3] >= self.min_points]
+        self.latest = self._forecast(ready) if ready else []
+        self.covered = covered
+        return self.latest
+
+    def _fit(self, batch):
+        tails = []
+        for fp, m_id, rule, frame in batch:
+            state = self._state.get(m_id)
+            ds = frame['ds'].to_numpy()  # plain arrays: this loop runs for every eligible series each cycle
+            start = 0
+            if state is not None:
+                last = np.datetime64(state[4], 's')
+                if ds[-1] <= last:
+                    continue  # nothing new since the last cycle
+                start = np.searchsorted(ds, last, side='right')
+            y = frame['y'].to_numpy()[start:]
+            if y.dtype != np.float64:
+                y = pd.to_numeric(pd.Series(y), errors='coerce').to_numpy(dtype=np.float64)
+            tails.append((m_id, y, to_epoch_seconds(ds[start:]), state))
+        if not tails:
+            return
+        p = len(ALPHAS)
+        Y = np.full((len(tails), max(len(y) for _, y, _, _ in tails)), np.nan)
+        L, T, V = np.zeros((len(tails), p)), np.zeros((len(tails), p)), np.zeros((len(tails), p))
+        for i, (m_id, y, ts, state) in enumerate(tails):
+            Y[i, :len(y)] = y
+            if state is None:
+                # Level from the first point, trend from the first INIT_POINTS
+                head = y[~np.isnan(y)][:INIT_POINTS]
+                if not len(head):
+                    continue
+                L[i] = head[0]
+                T[i] = (head[-1] - head[0]) / max(len(head) - 1, 1)
+                V[i] = np.var(np.diff(head)) if len(head) > 2 else 0.0
+                Y[i, 0] = np.nan  # the first point is the initial level
+            else:
+                L[i], T[i], V[i] = state[:3]
+        L, T, V = holt_run(L, T, V, Y, self.phi)
+        for i, (m_id, y, ts, state) in enumerate(tails):
+            seen = int(np.count_nonzero(~np.isnan(y)))
+            if state is None:
+                step = float(np.median(np.diff(ts[-50:]))) if len(ts) > 1 else float(settings.CHECK_INTERVAL_MINUTES * 60)
+                self._state[m_id] = [L[i], T[i], V[i], seen, int(ts[-1]), step]
+            else:
+                self._state[m_id] = [L[i], T[i], V[i], state[3] + seen, int(ts[-1]), state[5]]
+
+    def _forecast(self, ready) -> list:
+        k = len(ready)
+        states = [self._state[m_id] for _, m_id, _ in ready]
+        best = np.array([int(np.argmin(s[2])) for s in states])
+        L = np.array([s[0][b] for s, b in zip(states, best)])
+        T = np.array([s[1][b] for s, b in zip(states, best)])
+        sigma = np.sqrt(np.array([s[2][b] for s, b in zip(states, best)]))
+        step = np.array([s[5] for s in states])
+        alpha, beta = ALPHAS[best], BETAS[best]
+        threshold = np.array([r.threshold for _, _, r in ready])
+        sign = np.array([r.sign for _, _, r in ready], dtype=np.float64)
+
+        # Point estimate: closed form of L + T * damped_sum(h) = threshold
+        distance = sign * (threshold - L)   # > 0: not reached yet
+        rate = sign * T                     # > 0: moving towards the threshold
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.phi >= 1:
+                steps = np.where(rate > 0, distance / rate, np.inf)
+            else:
+                x = 1 - distance * (1 - self.phi) / (self.phi * rate)
+                steps = np.where((rate > 0) & (x > 0), np.log(x) / np.log(self.phi), np.inf)
+        steps = np.where(distance <= 0, 0.0, steps)
+        hours = steps * step / 3600
+
+        # Band: first horizon where the pessimistic / optimistic path crosses
+        grid_hours = np.geomspace(max(step.min() / 3600, 1e-3), self.horizon_hours, HORIZON_GRID)
+        h = grid_hours[None, :] * 3600 / step[:, None]
+        path = L[:, None] + T[:, None] * damped_sum(h, self.phi)
+        spread = self.z * forecast_sd(sigma[:, None], alpha[:, None], beta[:, None], h)
+        early = self._first_crossing(sign[:, None] * (path + sign[:, None] * spread - threshold[:, None]) >= 0, grid_hours)
+        late = self._first_crossing(sign[:, None] * (path - sign[:, None] * spread - threshold[:, None]) >= 0, grid_hours)
+        early = np.where(distance <= 0, 0.0, np.minimum(early, hours))
+        late = np.maximum(late, hours)
+
+        out = []
+        for i, (fp, m_id, rule) in enumerate(ready):
+            within = hours[i] <= self.horizon_hours
+            out.append({
+                'fingerprint': fp,
+                'threshold': rule.threshold,
+                'direction': rule.direction,
+                'current': round(float(L[i]), 3),
+                'trend_per_hour': round(float(T[i] * 3600 / step[i]), 6),
+                'exhaustion_hours': round(float(hours[i]), 2) if within else None,
+                'lower_hours': round(float(early[i]), 2) if early[i] <= self.horizon_hours else None,
+                'upper_hours': round(float(late[i]), 2) if within and late[i] <= self.horizon_hours else None,
+                'alpha': float(alpha[i]), 'beta': float(beta[i]),
+            })
+        out.sort(key=lambda f: (f['exhaustion_hours'] is None, f['exhaustion_hours'] or 0.0, f['fingerprint']))
+        return out
+
+    @staticmethod
+    def _first_crossing(crossed: np.ndarray, grid_hours: np.ndarray) -> np.ndarray:
+        first = crossed.argmax(axis=1)
+        return np.where(crossed.any(axis=1), grid_hours[first], np.inf)
+
+
+def capacity_summary(forecast: dict) -> str:
+    """Alert text of one forecast."""
+    hours = forecast['exhaustion_hours']
+    when = f"{hours / 24:.1f} ngày" if hours >= 48 else f"{hours:.1f} giờ"
+    lo, hi = forecast['lower_hours'], forecast['upper_hours']
+    band = f"{lo:.1f}–{hi:.1f} giờ" if hi is not None else f"sớm nhất {lo:.1f} giờ" if lo is not None else "không xác định"
+    verb = 'giảm' if forecast['direction'] == 'down' else 'tăng'
+    return (f"Metric {forecast['fingerprint']} dự kiến chạm ngưỡng {forecast['threshold']:g} sau ~{when} "
+            f"(khoảng tin cậy: {band}).\nGiá trị hiện tại {forecast['current']:g}, đang {verb} {abs(forecast['trend_per_hour']):g}/giờ.")
+
+
+capacity_forecaster = CapacityForecaster()
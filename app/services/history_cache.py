@@ -1,8 +1,17 @@
 import pandas as pd
+import numpy as np
+import os
+import time
 import logging
 from datetime import datetime, timedelta, timezone
 from sqlalchemy import func
-from models.metric import MetricValue
+from core.config import settings
+from services.baselines import SeasonalBaseline
+from services.sketches import RobustBaseline
+from services.calendar_features import to_epoch_seconds
+from services.counters import rate_frame
+from services.rollups import read_rollups
+from services.storage import storage
 
 class HistoryCache:
     """
@@ -12,47 +21,302 @@ class HistoryCache:
     def __init__(self):
         self._cache = {} # fingerprint -> DataFrame
         self.analysis_window_hours = 168
+        self._baselines = {} # metric_id -> SeasonalBaseline / RobustBaseline (DETECTION_MODE=seasonal/robust)
+        self._pending = {}   # metric_id -> (ts, y) newest point, folded once a newer one arrives
+        self._counter_last = {} # metric_id -> (ts, raw value) of the last counter sample, for incremental rates
+        # Memory budget (HISTORY_CACHE_MAX_MB / HISTORY_CACHE_TTL_MINUTES)
+        self._bytes = {}     # metric_id -> approximate size of its cached frame
+        self._last_seen = {} # metric_id -> time.time() of the last update/analysis
+        self._evicted = {}   # metric_id -> time.time() of eviction; reloaded from the DB on next access
+        self._counters = set() # metric ids cached as rates (needed to rebuild them on reload)
+        self._bind = None    # engine used for lazy reloads
 
-    def initialize(self, engine, analysis_window_hours=168):
-        """Pre-load all data from DB for the last N hours."""
-        self.analysis_window_hours = analysis_window_hours
+    def initialize(self, engine, analysis_window_hours=168, counter_ids=None, since=None):
+        """
+        Pre-load all data from DB for the last N hours. Series in `counter_ids` are cached as per-second rates.
+        `since` (metric id -> newest point, from `load_snapshot`) skips the DB rows a snapshot already
+        provided; series the snapshot does not cover get their whole window from the DB.
+        """
+        self.attach(engine, analysis_window_hours)
         logging.info(f"🚀 [TurboMode] Loading {analysis_window_hours}h history into RAM...")
         
         threshold = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=analysis_window_hours)
+        since = since or {}
+        # Rows older than the stalest snapshotted series are covered for every series in the snapshot
+        read_from = max(threshold, min(since.values()) + timedelta(seconds=1)) if since else threshold
         
         # Load in chunks to avoid memory spikes and long initial response
-        query = f"SELECT metric_id, timestamp as ds, value as y FROM metric_values WHERE timestamp >= '{threshold.isoformat()}'"
-        
         chunk_count = 0
         total_rows = 0
-        for chunk in pd.read_sql(query, engine, parse_dates=['ds'], chunksize=500000):
+        uncovered = set()  # series missing from the snapshot: their rows before `read_from` are still needed
+        for chunk in storage.read_since(engine, read_from, chunksize=500000):
             chunk_count += 1
             total_rows += len(chunk)
             for m_id, group in chunk.groupby('metric_id'):
+                if since:
+                    if m_id not in since:
+                        uncovered.add(m_id)
+                        continue
+                    group = group[group['ds'] > since[m_id]]
                 if m_id not in self._cache:
                     self._cache[m_id] = group
                 else:
                     self._cache[m_id] = pd.concat([self._cache[m_id], group], ignore_index=True)
             logging.info(f"🚀 [TurboMode] Loaded chunk {chunk_count}... ({total_rows} rows)")
 
-        # Final sort for each cache entry
+        counter_ids = counter_ids or set()
+        self._counters.update(counter_ids)
+        if settings.DETECTION_MODE == 'seasonal' and settings.ROLLUP_ENABLED:
+            self._warm_from_rollups(engine, threshold, counter_ids)
+
+        # Final sort for each cache entry; snapshot frames are folded into their baselines here too
         for m_id in self._cache:
             self._cache[m_id] = self._cache[m_id].sort_values('ds')
+            if m_id in counter_ids:
+                self._cache[m_id], self._counter_last[m_id] = rate_frame(self._cache[m_id])
+            self._fold(m_id, self._cache[m_id])
+            self._store(m_id, self._cache[m_id])
+        if uncovered:
+            total_rows += self.warm(uncovered)
         
         logging.info(f"✅ [TurboMode] Cached {total_rows} points across {len(self._cache)} metrics.")
 
+    def attach(self, engine, analysis_window_hours=168):
+        """Use `engine` for lazy reloads without bulk-loading anything (sharded replicas warm per shard)."""
+        self.analysis_window_hours = analysis_window_hours
+        self._bind = engine
+
+    def warm(self, metric_ids, counter_ids=None) -> int:
+        """Bulk-load the analysis window of `metric_ids` (e.g. a shard just taken over); returns the points loaded."""
+        metric_ids = [m for m in metric_ids if m not in self._cache]
+        if counter_ids:
+            self._counters.update(counter_ids)
+        if not metric_ids or self._bind is None:
+            return 0
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with self._bind.connect() as conn:
+            df = storage.read_range(conn, now - timedelta(hours=self.analysis_window_hours), now + timedelta(days=1), metric_ids=metric_ids)
+        for m_id, group in df.groupby('metric_id'):
+            frame = group[['ds', 'y']].sort_values('ds').reset_index(drop=True)
+            if m_id in self._counters:
+                frame, self._counter_last[m_id] = rate_frame(frame)
+            self._evicted.pop(m_id, None)
+            self._last_seen[m_id] = time.time()
+            self._fold(m_id, frame)
+            self._store(m_id, frame)
+        logging.info(f"🚀 [TurboMode] Warmed {len(df)} points for {df['metric_id'].nunique() if len(df) else 0} series")
+        return len(df)
+
+    def release(self, metric_ids):
+        """Forget series handed over to another replica (frame, baseline, counter state)."""
+        for m in metric_ids:
+            self._drop(m, forget=True)
+            self._evicted.pop(m, None)
+
+    def _warm_from_rollups(self, engine, threshold, counter_ids):
+        """Seed seasonal baselines with the hourly rollups older than the raw window (counters excluded: rollups hold raw values)."""
+        buckets = 0
+        try:
+            for chunk in read_rollups(engine, '1h', end=threshold, chunksize=500000):
+                for m_id, group in chunk.groupby('metric_id'):
+                    if m_id in counter_ids:
+                        continue
+                    baseline = self._baselines.get(m_id)
+                    if baseline is None:
+                        baseline = self._baselines[m_id] = self._new_baseline()
+                    baseline.update_aggregates(to_epoch_seconds(group['ds']), group['count'].to_numpy(), group['avg'].to_numpy(), group['std'].to_numpy())
+                    buckets += len(group)
+        except Exception as e:
+            logging.warning(f"[TurboMode] Could not read rollups for baseline warm-up: {e}")
+        if buckets:
+            logging.info(f"🚀 [TurboMode] Seeded seasonal baselines from {buckets} hourly rollups")
+
+    @staticmethod
+    def save_snapshot(path: str, frames) -> int:
+        """
+        Write raw points (iterable of DataFrames with metric_id, ds, y) to a
+        compressed .npz snapshot that `load_snapshot` reads back much faster
+        than a database scan. Returns the number of points written.
+        """
+        df = pd.concat(list(frames), ignore_index=True) if frames is not None else pd.DataFrame()
+        if df.empty:
+            df = pd.DataFrame({'metric_id': pd.Series(dtype=np.int64), 'ds': pd.Series(dtype='datetime64[s]'), 'y': pd.Series(dtype=float)})
+        df = df.sort_values(['metric_id', 'ds'], kind='stable')
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, metric_id=df['metric_id'].to_numpy(dtype=np.int64), ts=to_epoch_seconds(df['ds']),
+                                y=pd.to_numeric(df['y'], errors='coerce').to_numpy(dtype=np.float64))
+        os.replace(tmp, path)
+        return len(df)
+
+    def load_snapshot(self, path: str, analysis_window_hours=None) -> dict:
+        """
+        Fill the cache with the raw points of a snapshot inside the analysis window;
+        returns the newest timestamp of every series it holds, for `initialize(since=)`
+        (which merges the newer DB rows and folds the frames into their baselines).
+        """
+        if analysis_window_hours:
+            self.analysis_window_hours = analysis_window_hours
+        with np.load(path) as snap:
+            metric_ids, ts, y = snap['metric_id'], snap['ts'], snap['y']
+        threshold = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=self.analysis_window_hours)
+        keep = ts >= int(threshold.replace(tzinfo=timezone.utc).timestamp())
+        if not keep.any():
+            return {}
+        metric_ids, ts, y = metric_ids[keep], ts[keep], y[keep]
+        bounds = np.flatnonzero(np.diff(metric_ids)) + 1
+        newest = {}
+        for lo, hi in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(ts)]))):
+            m_id = int(metric_ids[lo])
+            self._store(m_id, pd.DataFrame({'ds': pd.to_datetime(ts[lo:hi], unit='s'), 'y': y[lo:hi]}))
+            newest[m_id] = datetime.fromtimestamp(int(ts[lo:hi].max()), tz=timezone.utc).replace(tzinfo=None)
+        logging.info(f"🚀 [TurboMode] Loaded {len(ts)} points for {len(bounds) + 1} metrics from snapshot {path}")
+        return newest
+
     def get_history(self, metric_id: int) -> pd.DataFrame:
+        self._last_seen[metric_id] = time.time()
+        if metric_id in self._evicted:
+            self._reload(metric_id)
         return self._cache.get(metric_id, pd.DataFrame())
 
-    def update(self, metric_id: int, df_delta: pd.DataFrame):
-        """Append new points and prune old ones in-memory (Optimized)."""
+    def peek(self, metric_id: int):
+        """Cached frame (or None) without counting as an access: no reload, no LRU/TTL refresh."""
+        return self._cache.get(metric_id)
+
+    def _store(self, metric_id: int, df: pd.DataFrame):
+        self._cache[metric_id] = df
+        self._bytes[metric_id] = int(df.memory_usage(index=True, deep=False).sum())
+        self._last_seen.setdefault(metric_id, time.time())
+
+    def memory_bytes(self) -> int:
+        return sum(self._bytes.values())
+
+    def _reload(self, metric_id: int):
+        """Bring an evicted series back from the history store (raw values; counters re-derived as rates)."""
+        self._evicted.pop(metric_id, None)
+        if self._bind is None:
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with self._bind.connect() as conn:
+            df = storage.read_range(conn, now - timedelta(hours=self.analysis_window_hours), now + timedelta(days=1), metric_ids=[metric_id])
+        if df.empty:
+            return
+        df = df[['ds', 'y']].sort_values('ds').reset_index(drop=True)
+        if metric_id in self._counters:
+            df, self._counter_last[metric_id] = rate_frame(df)
+        # Budget evictions keep the baseline (it already saw these points); TTL evictions rebuild it
+        if metric_id not in self._baselines:
+            self._pending.pop(metric_id, None)
+            self._fold(metric_id, df)
+        self._store(metric_id, df)
+
+    def _drop(self, metric_id: int, forget: bool):
+        self._cache.pop(metric_id, None)
+        self._bytes.pop(metric_id, None)
+        self._evicted[metric_id] = time.time()
+        if forget:
+            self._last_seen.pop(metric_id, None)
+            self._baselines.pop(metric_id, None)
+            self._pending.pop(metric_id, None)
+            self._counter_last.pop(metric_id, None)
+
+    def evict(self, ttl_minutes: float = None, max_bytes: int = None, now: float = None, checked=None) -> list:
+        """
+        Enforce the cache limits; returns the metric ids expired by the TTL
+        (series gone from Prometheus) so their alert state can be dropped too.
+
+        1. Series not updated or analysed for `ttl_minutes` lose their frame,
+           baseline and counter state. With `checked` (ids whose query completed
+           this cycle) only those can expire: while Prometheus or a query fails,
+           its series are not reported but not gone either.
+        2. While the cache is above `max_bytes`, the least recently analysed
+           series lose their frame only (baselines are small and keep learning
+           once the series is reloaded).
+        Evicted series are reloaded from the DB the next time they are accessed.
+        """
+        ttl_minutes = settings.HISTORY_CACHE_TTL_MINUTES if ttl_minutes is None else ttl_minutes
+        max_bytes = settings.HISTORY_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        now = now or time.time()
+
+        expired = []
+        if ttl_minutes and ttl_minutes > 0:
+            limit = now - ttl_minutes * 60
+            expired = [m for m, seen in list(self._last_seen.items()) if seen < limit and (checked is None or m in checked)]
+            for m in expired:
+                self._drop(m, forget=True)
+
+        freed = 0
+        if max_bytes and max_bytes > 0:
+            total = self.memory_bytes()
+            if total > max_bytes:
+                for m in sorted(self._bytes, key=lambda m: self._last_seen.get(m, 0)):
+                    if total <= max_bytes:
+                        break
+                    size = self._bytes.get(m, 0)
+                    self._drop(m, forget=False)
+                    total -= size
+                    freed += 1
+
+        # Evicted series whose raw window has passed have nothing left to reload
+        horizon = now - self.analysis_window_hours * 3600
+        for m in [m for m, at in self._evicted.items() if at < horizon]:
+            del self._evicted[m]
+
+        if expired or freed:
+            logging.info(f"🧹 [TurboMode] Evicted {len(expired)} stale + {freed} LRU series, cache now {self.memory_bytes() / 1048576:.1f} MB for {len(self._cache)} series")
+        return expired
+
+    def get_baseline(self, metric_id: int):
+        return self._baselines.get(metric_id)
+
+    def _new_baseline(self):
+        if settings.DETECTION_MODE == 'robust':
+            return RobustBaseline(self.analysis_window_hours, settings.SKETCH_BUCKET_HOURS, settings.SKETCH_CAPACITY)
+        return SeasonalBaseline(settings.SEASONAL_PERIOD, settings.SEASONAL_MAX_WEIGHT)
+
+    def _fold(self, metric_id: int, df_new: pd.DataFrame):
+        """
+        Feed the per-series baseline with every new point except the newest one:
+        detect() compares the last point against history that excludes it.
+        """
+        if settings.DETECTION_MODE not in ('seasonal', 'robust') or df_new.empty:
+            return
+        ts = to_epoch_seconds(df_new['ds'])
+        y = pd.to_numeric(df_new['y'], errors='coerce').to_numpy(dtype=np.float64)
+        pending = self._pending.get(metric_id)
+        if pending is not None:
+            ts = np.concatenate(([pending[0]], ts))
+            y = np.concatenate(([pending[1]], y))
+
+        baseline = self._baselines.get(metric_id)
+        if baseline is None:
+            baseline = self._baselines[metric_id] = self._new_baseline()
+        baseline.update(ts[:-1], y[:-1])
+        self._pending[metric_id] = (ts[-1], y[-1])
+
+    def update(self, metric_id: int, df_delta: pd.DataFrame, is_counter: bool = False):
+        """Append new points and prune old ones in-memory (Optimized). Counters are stored as per-second rates."""
         if df_delta.empty:
             return
 
+        self._last_seen[metric_id] = time.time()
+        if metric_id in self._evicted:
+            self._reload(metric_id)
+
+        if is_counter:
+            self._counters.add(metric_id)
+            prev = self._counter_last.get(metric_id)
+            if prev is not None:
+                df_delta = df_delta[to_epoch_seconds(df_delta['ds']) > prev[0]]
+            df_delta, self._counter_last[metric_id] = rate_frame(df_delta, prev)
+            if df_delta.empty:
+                return
+
         df_existing = self._cache.get(metric_id)
         
         if df_existing is None or df_existing.empty:
-            self._cache[metric_id] = df_delta
+            self._store(metric_id, df_delta)
+            self._fold(metric_id, df_delta)
             return
 
         # Prometheus data is usually sorted. We can just append.
@@ -62,6 +326,7 @@ class HistoryCache:
         
         if df_new_points.empty:
             return
+        self._fold(metric_id, df_new_points)
 
         df_combined = pd.concat([df_existing, df_new_points], ignore_index=True)
 
@@ -70,6 +335,6 @@ class HistoryCache:
         if df_combined['ds'].iloc[0] < threshold:
             df_combined = df_combined[df_combined['ds'] >= threshold]
         
-        self._cache[metric_id] = df_combined
+        self._store(metric_id, df_combined)
 
 history_cache = HistoryCache()
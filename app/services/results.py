@@ -0,0 +1,127 @@
+"""
+Detector output.
+
+`DetectionResult` is one typed, fixed-layout result (`__slots__`, floats for
+last/mean/std/z/slope/confidence) instead of a dict per series; the
+human-readable `explanation` is only formatted when something reads it, i.e.
+for the alerts and events that are actually emitted. It still answers
+`result['reason']` / `result.get('z')` so existing callers keep working.
+
+`ResultTable` gathers the results of a cycle column by column (numpy arrays
+keyed by fingerprint); alerting, status, events and explanations all read the
+same table instead of per-query dicts.
+"""
+import numpy as np
+
+FIELDS = ('is_anomaly', 'confidence', 'reason', 'baseline', 'last', 'mean', 'std', 'z', 'slope')
+FLOAT_FIELDS = ('confidence', 'last', 'mean', 'std', 'z', 'slope')
+
+
+class DetectionResult:
+    __slots__ = FIELDS
+
+    def __init__(self, is_anomaly=False, confidence=0.0, reason='normal', baseline='global',
+                 last=np.nan, mean=np.nan, std=np.nan, z=np.nan, slope=np.nan):
+        self.is_anomaly = bool(is_anomaly)
+        self.confidence = float(confidence)
+        self.reason = reason
+        self.baseline = baseline
+        self.last = float(last)
+        self.mean = float(mean)
+        self.std = float(std)
+        self.z = float(z)
+        self.slope = float(slope)
+
+    @property
+    def explanation(self) -> str:
+        if np.isnan(self.last):
+            return self.reason
+        text = f"last={self.last:.3f}, mean={self.mean:.3f}, std={self.std:.3f}, z={self.z:.2f}, slope={self.slope:.4f}"
+        if self.reason == 'host_down':
+            text = f"CRITICAL: Host is DOWN (up=0). {text}"
+        return text
+
+    # ---- mapping compatibility (result['is_anomaly'], result.get('reason'), dict(result)) ----
+
+    def keys(self):
+        return [k for k in FIELDS if not (k in FLOAT_FIELDS and np.isnan(getattr(self, k)))]
+
+    def __getitem__(self, key):
+        if key == 'explanation':
+            return self.explanation
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key == 'explanation' or key in self.keys()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def to_dict(self) -> dict:
+        """JSON-safe dict (alert state file); NaN fields are left out."""
+        return {k: getattr(self, k) for k in self.keys()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DetectionResult':
+        return cls(**{k: data[k] for k in FIELDS if data.get(k) is not None})
+
+    def __eq__(self, other):
+        if not isinstance(other, DetectionResult):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"DetectionResult({', '.join(f'{k}={getattr(self, k)!r}' for k in self.keys())})"
+
+
+class ResultTable:
+    """Columnar results of one or more queries: `fingerprint` plus one numpy array per field."""
+
+    def __init__(self, fingerprints=(), columns: dict = None):
+        self.fingerprint = np.asarray(fingerprints, dtype=object)
+        n = len(self.fingerprint)
+        columns = columns or {}
+        self.is_anomaly = np.asarray(columns.get('is_anomaly', np.zeros(n, dtype=bool)), dtype=bool)
+        self.reason = np.asarray(columns.get('reason', np.full(n, 'normal', dtype=object)), dtype=object)
+        self.baseline = np.asarray(columns.get('baseline', np.full(n, 'global', dtype=object)), dtype=object)
+        for name in FLOAT_FIELDS:
+            setattr(self, name, np.asarray(columns.get(name, np.full(n, np.nan)), dtype=np.float64))
+
+    @classmethod
+    def from_results(cls, items) -> 'ResultTable':
+        """Build from (fingerprint, DetectionResult) pairs."""
+        items = list(items)
+        return cls([fp for fp, _ in items], {f: [getattr(r, f) for _, r in items] for f in FIELDS})
+
+    @classmethod
+    def concat(cls, tables) -> 'ResultTable':
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls()
+        return cls(np.concatenate([t.fingerprint for t in tables]),
+                   {f: np.concatenate([getattr(t, f) for t in tables]) for f in FIELDS})
+
+    def __len__(self):
+        return len(self.fingerprint)
+
+    def row(self, i: int) -> DetectionResult:
+        return DetectionResult(**{f: getattr(self, f)[i] for f in FIELDS})
+
+    def __iter__(self):
+        """(fingerprint, DetectionResult) pairs, in table order."""
+        for i in range(len(self)):
+            yield self.fingerprint[i], self.row(i)
+
+    def index(self) -> dict:
+        return {fp: i for i, fp in enumerate(self.fingerprint)}
+
+    def summary(self) -> dict:
+        reasons, counts = np.unique(self.reason[self.is_anomaly].astype(str), return_counts=True)
+        return {
+            'series': len(self),
+            'anomalies': int(self.is_anomaly.sum()),
+            'by_reason': {str(r): int(c) for r, c in zip(reasons, counts)},
+            'max_z': float(np.nanmax(self.z)) if len(self) and not np.isnan(self.z).all() else None,
+        }
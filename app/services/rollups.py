@@ -0,0 +1,153 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert, select
+
+from core.config import settings
+from models.metric import MetricRollup
+from services.calendar_features import to_epoch_seconds
+from services.storage import storage
+from services.archive import archive
+
+TIER_SECONDS = {'1h': 3600, '1d': 86400}
+AGG_COLUMNS = ['min', 'max', 'avg', 'std', 'count']
+KEYS = ['metric_id', 'bucket_start']
+# Rows per IN (...) list when deleting replaced rollups (SQLite caps bound parameters)
+_DELETE_BATCH = 5000
+
+
+def floor_time(dt: datetime, seconds: int) -> datetime:
+    """Floor a naive UTC datetime to a multiple of `seconds` since the epoch."""
+    epoch = int(dt.replace(tzinfo=timezone.utc).timestamp())
+    return datetime.fromtimestamp(epoch // seconds * seconds, tz=timezone.utc).replace(tzinfo=None)
+
+
+def tier_retention_hours() -> dict:
+    return {'1h': settings.ROLLUP_HOURLY_RETENTION_HOURS, '1d': settings.ROLLUP_DAILY_RETENTION_DAYS * 24}
+
+
+def aggregate(raw: pd.DataFrame, resolution: int) -> pd.DataFrame:
+    """Raw points (metric_id, ds, y) -> rollup rows (metric_id, bucket_start, min, max, avg, std, count)."""
+    raw = raw[raw['y'].notna()]
+    if raw.empty:
+        return pd.DataFrame(columns=KEYS + AGG_COLUMNS)
+    bucket = to_epoch_seconds(raw['ds']) // resolution * resolution
+    g = raw.assign(bucket_start=bucket).groupby(KEYS)['y']
+    out = g.agg(['min', 'max', 'mean', 'count']).rename(columns={'mean': 'avg'})
+    out['std'] = g.std(ddof=0)
+    out = out.reset_index()
+    out['bucket_start'] = pd.to_datetime(out['bucket_start'], unit='s').astype('datetime64[us]')
+    return out[KEYS + AGG_COLUMNS]
+
+
+def combine(frames) -> pd.DataFrame:
+    """Merge partial rollups of the same (metric_id, bucket_start): pooled mean/std, min of mins, max of maxes."""
+    df = pd.concat(frames, ignore_index=True)
+    df['w'] = df['count'] * df['avg']
+    g = df.groupby(KEYS)
+    mean = g['w'].transform('sum') / g['count'].transform('sum')
+    df['m2'] = df['count'] * (df['std'].fillna(0.0) ** 2 + (df['avg'] - mean) ** 2)
+    out = df.groupby(KEYS).agg(min=('min', 'min'), max=('max', 'max'), w=('w', 'sum'), m2=('m2', 'sum'), count=('count', 'sum')).reset_index()
+    out['avg'] = out['w'] / out['count']
+    out['std'] = np.sqrt(out['m2'] / out['count'])
+    return out[KEYS + AGG_COLUMNS]
+
+
+def _upsert(session, resolution: int, new: pd.DataFrame):
+    """Write rollup rows, merging with rows already stored for the same buckets (late or partial data)."""
+    if new.empty:
+        return
+    lo, hi = new['bucket_start'].min().to_pydatetime(), new['bucket_start'].max().to_pydatetime()
+    existing = session.execute(
+        select(MetricRollup.id, MetricRollup.metric_id, MetricRollup.bucket_start, *[getattr(MetricRollup, c) for c in AGG_COLUMNS])
+        .where(MetricRollup.resolution == resolution, MetricRollup.bucket_start >= lo, MetricRollup.bucket_start <= hi)
+    ).all()
+    if existing:
+        ex = pd.DataFrame(existing, columns=['id'] + KEYS + AGG_COLUMNS)
+        ex['bucket_start'] = ex['bucket_start'].astype('datetime64[us]')
+        ex = ex.merge(new[KEYS], on=KEYS)
+        if not ex.empty:
+            ids = ex['id'].tolist()
+            for i in range(0, len(ids), _DELETE_BATCH):
+                session.query(MetricRollup).filter(MetricRollup.id.in_(ids[i:i + _DELETE_BATCH])).delete(synchronize_session=False)
+            new = combine([new, ex.drop(columns='id')])
+
+    records = [
+        {'metric_id': int(m), 'resolution': resolution, 'bucket_start': b.to_pydatetime(), 'min': mn, 'max': mx, 'avg': a, 'std': s, 'count': int(c)}
+        for m, b, mn, mx, a, s, c in zip(new['metric_id'].tolist(), new['bucket_start'], new['min'].tolist(), new['max'].tolist(),
+                                         new['avg'].tolist(), new['std'].tolist(), new['count'].tolist())
+    ]
+    session.execute(insert(MetricRollup), records)
+
+
+def compact_raw(session, raw_cutoff: datetime, tiers=None) -> int:
+    """
+    Compact raw points older than `raw_cutoff` into every rollup tier (and the
+    Parquet archive when ARCHIVE_ENABLED), then delete them. Works one hour of
+    raw data at a time (one commit each), so a large backlog is compacted
+    incrementally and an interrupted run resumes where it stopped. Returns the
+    number of raw points compacted.
+    """
+    tiers = settings.ROLLUP_TIERS if tiers is None else tiers
+    resolutions = [TIER_SECONDS[t] for t in tiers if t in TIER_SECONDS]
+    total = 0
+    while True:
+        oldest = storage.oldest_timestamp(session, raw_cutoff)
+        if oldest is None:
+            break
+        start = floor_time(oldest, 3600)
+        end = min(start + timedelta(hours=1), raw_cutoff)
+
+        raw = storage.read_range(session, start, end)
+        for resolution in resolutions:
+            _upsert(session, resolution, aggregate(raw, resolution))
+        if settings.ARCHIVE_ENABLED:
+            archive.write(session, raw)
+        storage.delete_range(session, start, end)
+        session.commit()
+        total += len(raw)
+    return total
+
+
+def prune_rollups(session, now: datetime = None) -> int:
+    """Drop rollup rows older than their tier's retention."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    deleted = 0
+    for tier, hours in tier_retention_hours().items():
+        limit = now - timedelta(hours=hours)
+        deleted += session.query(MetricRollup).filter(MetricRollup.resolution == TIER_SECONDS[tier], MetricRollup.bucket_start < limit).delete(synchronize_session=False)
+    session.commit()
+    return deleted
+
+
+def read_rollups(bind, tier: str = '1h', metric_ids=None, start: datetime = None, end: datetime = None, chunksize=None):
+    """
+    Rollup rows of one tier as a DataFrame (metric_id, ds, min, max, avg, std,
+    count), ordered by metric and time. `end` is exclusive on the bucket end:
+    only buckets that finish before it are returned. With `chunksize` an
+    iterator of DataFrames is returned instead.
+    """
+    resolution = TIER_SECONDS[tier]
+    stmt = select(MetricRollup.metric_id, MetricRollup.bucket_start.label('ds'), *[getattr(MetricRollup, c) for c in AGG_COLUMNS]) \
+        .where(MetricRollup.resolution == resolution)
+    if metric_ids is not None:
+        stmt = stmt.where(MetricRollup.metric_id.in_(list(metric_ids)))
+    if start is not None:
+        stmt = stmt.where(MetricRollup.bucket_start >= start)
+    if end is not None:
+        stmt = stmt.where(MetricRollup.bucket_start <= end - timedelta(seconds=resolution))
+    stmt = stmt.order_by(MetricRollup.metric_id, MetricRollup.bucket_start)
+    return pd.read_sql(stmt, bind, parse_dates=['ds'], chunksize=chunksize)
+
+
+def compact_and_prune(session) -> None:
+    """Retention step of every cycle: raw -> rollup tiers, then expire old rollups."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    # Hour-aligned cutoff: the steady state compacts one complete hour at a time
+    raw_cutoff = floor_time(now - timedelta(hours=settings.RAW_RETENTION_HOURS), 3600)
+    compacted = compact_raw(session, raw_cutoff)
+    expired = prune_rollups(session, now)
+    if compacted or expired:
+        logging.info(f"🗜️ [Rollup] Compacted {compacted} raw points, expired {expired} rollup rows")
@@ -0,0 +1,133 @@
+"""
+Horizontal scaling: several detector replicas split the discovered queries
+between them with a consistent-hash ring.
+
+Membership lives in the `detector_leases` table. Every replica upserts its
+own row each cycle (heartbeat) and builds the ring from the rows whose
+heartbeat is younger than LEASE_TTL_SECONDS, so a replica that dies is
+dropped from everybody's ring once its lease expires and its queries move to
+the survivors; a replica that joins takes over only the ring segments that
+hash to it. A new replica enters the ring only after its lease is
+JOIN_GRACE_SECONDS old, so every replica switches to the new ring at the same
+instant (up to the clock skew between replicas and the time between their
+heartbeats) instead of whenever it happens to read the table.
+
+Queries are the shard unit: one replica does the instant + range fetch and
+the analysis of every series of a query, so Prometheus load does not grow
+with the number of replicas.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+
+from core.config import settings
+from models.metric import DetectorLease
+
+# Ring key of the singleton maintenance work (retention / compaction)
+MAINTENANCE_KEY = '__maintenance__'
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+def default_replica_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class HashRing:
+    """Consistent hashing with `vnodes` points per member."""
+    def __init__(self, members=(), vnodes: int = 64):
+        self.vnodes = vnodes
+        self.members = sorted(set(members))
+        points = sorted((_hash(f"{m}#{i}"), m) for m in self.members for i in range(vnodes))
+        self._keys = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def owner(self, key: str):
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[i]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ShardCoordinator:
+    def __init__(self, replica_id: str = None, lease_ttl: int = None, join_grace: int = None, vnodes: int = None):
+        self.replica_id = replica_id or settings.REPLICA_ID or default_replica_id()
+        self.lease_ttl = lease_ttl or settings.LEASE_TTL_SECONDS
+        self.join_grace = settings.JOIN_GRACE_SECONDS if join_grace is None else join_grace
+        self.vnodes = vnodes or settings.SHARD_VNODES
+        self.ring = HashRing([], self.vnodes)
+        self.owned = set()  # queries owned after the last assign()
+        self._stop = threading.Event()
+
+    def start_heartbeat(self, session_factory):
+        """Renew the lease every LEASE_TTL_SECONDS / 3 in the background, so a cycle longer than the TTL does not look like a dead replica."""
+        def beat():
+            while not self._stop.wait(max(1.0, self.lease_ttl / 3)):
+                session = session_factory()
+                try:
+                    session.query(DetectorLease).filter(DetectorLease.replica_id == self.replica_id).update({'heartbeat_at': _utcnow()})
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    logging.warning(f"[Shard] Lease renewal failed: {e}")
+                finally:
+                    session.close()
+        threading.Thread(target=beat, name='shard-heartbeat', daemon=True).start()
+
+    def heartbeat(self, session, now: datetime = None) -> list:
+        """Renew this replica's lease, expire dead ones and rebuild the ring; returns the live members."""
+        now = now or _utcnow()
+        lease = session.get(DetectorLease, self.replica_id)
+        if lease is None:
+            session.add(DetectorLease(replica_id=self.replica_id, started_at=now, heartbeat_at=now))
+        else:
+            lease.heartbeat_at = now
+        session.flush()
+        expired = session.query(DetectorLease).filter(DetectorLease.heartbeat_at < now - timedelta(seconds=self.lease_ttl)).delete(synchronize_session=False)
+        session.commit()
+        if expired:
+            logging.warning(f"🔀 [Shard] Expired {expired} dead replica lease(s)")
+
+        joined_before = now - timedelta(seconds=self.join_grace)
+        leases = session.query(DetectorLease.replica_id, DetectorLease.started_at).all()
+        # The oldest replica is always a member (bootstrap); others join once their grace period is over
+        oldest = min(leases, key=lambda l: (l[1], l[0]))[0] if leases else self.replica_id
+        members = [r for r, started in leases if started <= joined_before or r == oldest]
+        if not members:
+            members = [self.replica_id]
+        if sorted(members) != self.ring.members:
+            logging.info(f"🔀 [Shard] Ring members: {sorted(members)}")
+        self.ring = HashRing(members, self.vnodes)
+        return self.ring.members
+
+    def owns(self, key: str) -> bool:
+        return self.ring.owner(key) == self.replica_id
+
+    def assign(self, queries) -> tuple:
+        """(owned, gained, lost) queries for this cycle, given the discovered ones."""
+        owned = {q for q in queries if self.owns(q)}
+        gained, lost = owned - self.owned, self.owned - owned
+        self.owned = owned
+        if gained or lost:
+            logging.info(f"🔀 [Shard] {self.replica_id} owns {len(owned)}/{len(set(queries))} queries (+{len(gained)} -{len(lost)})")
+        return owned, gained, lost
+
+    def leave(self, session):
+        """Drop this replica's lease so the others take over without waiting for it to expire."""
+        self._stop.set()
+        session.query(DetectorLease).filter(DetectorLease.replica_id == self.replica_id).delete(synchronize_session=False)
+        session.commit()
+        self.owned = set()
+
+
+shard_coordinator = ShardCoordinator()
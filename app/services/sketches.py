@@ -0,0 +1,180 @@
+import math
+import numpy as np
+
+# Consistency constant: 1.4826 * MAD estimates the standard deviation of normal data
+MAD_TO_STD = 1.4826
+
+
+def _compress(means: np.ndarray, weights: np.ndarray, capacity: int):
+    """
+    Merge sorted-by-value centroids into at most `capacity` clusters using the
+    t-digest k1 scale (arcsine): clusters are small near the tails and wide
+    around the median, which keeps extreme quantiles accurate.
+    """
+    order = np.argsort(means, kind='stable')
+    means, weights = means[order], weights[order]
+    if len(means) <= capacity:
+        return means, weights
+    cum = np.cumsum(weights)
+    q = (cum - weights / 2) / cum[-1]
+    k = np.arcsin(np.clip(2 * q - 1, -1.0, 1.0)) / np.pi + 0.5
+    bins = np.minimum((k * capacity).astype(np.int64), capacity - 1)
+    w = np.bincount(bins, weights=weights, minlength=capacity)
+    m = np.bincount(bins, weights=weights * means, minlength=capacity)
+    keep = w > 0
+    return m[keep] / w[keep], w[keep]
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch (merging t-digest) holding at most `capacity`
+    centroids plus a buffer of up to `capacity` raw values.
+    """
+    __slots__ = ('capacity', 'means', 'weights', '_buf', '_n')
+
+    def __init__(self, capacity: int = 32):
+        self.capacity = int(capacity)
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self._buf = None
+        self._n = 0
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum()) + self._n
+
+    @property
+    def nbytes(self) -> int:
+        return self.means.nbytes + self.weights.nbytes + (self._buf.nbytes if self._buf is not None else 0)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        if self._n + len(values) < self.capacity:
+            if self._buf is None:
+                self._buf = np.empty(self.capacity)
+            self._buf[self._n:self._n + len(values)] = values
+            self._n += len(values)
+            return
+        means, weights = self.centroids()
+        self.means, self.weights = _compress(np.concatenate((means, values)), np.concatenate((weights, np.ones(len(values)))), self.capacity)
+        self._buf, self._n = None, 0
+
+    def flush(self):
+        """Fold buffered values into centroids and release the buffer."""
+        if self._n:
+            self.means, self.weights = _compress(*self.centroids(), self.capacity)
+        self._buf, self._n = None, 0
+
+    def centroids(self):
+        """(means, weights) including buffered values, without mutating the sketch."""
+        if not self._n:
+            return self.means, self.weights
+        return np.concatenate((self.means, self._buf[:self._n])), np.concatenate((self.weights, np.ones(self._n)))
+
+    @classmethod
+    def merged(cls, sketches, capacity: int = None) -> 'QuantileSketch':
+        sketches = [s for s in sketches if s is not None]
+        out = cls(capacity or (sketches[0].capacity if sketches else 32))
+        if sketches:
+            parts = [s.centroids() for s in sketches]
+            out.means, out.weights = _compress(np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]), out.capacity)
+        return out
+
+    def quantile(self, q: float) -> float:
+        means, weights = self.centroids()
+        if not len(means):
+            return float('nan')
+        if len(means) == 1:
+            return float(means[0])
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        positions = np.cumsum(weights) - weights / 2
+        return float(np.interp(q * weights.sum(), positions, means))
+
+    def median_mad(self):
+        """(median, MAD, mean absolute deviation) estimated from the centroids."""
+        means, weights = self.centroids()
+        if not len(means):
+            return float('nan'), float('nan'), float('nan')
+        median = self.quantile(0.5)
+        dev = np.abs(means - median)
+        order = np.argsort(dev, kind='stable')
+        dev_sorted, w_sorted = dev[order], weights[order]
+        cum = np.cumsum(w_sorted)
+        mad = float(dev_sorted[np.searchsorted(cum, cum[-1] / 2)])
+        mean_ad = float((dev * weights).sum() / weights.sum())
+        return median, mad, mean_ad
+
+
+class RobustBaseline:
+    """
+    Per-series robust statistics over the analysis window: a ring of
+    QuantileSketch, one per `bucket_hours` of data. Whole buckets expire as the
+    window slides, so memory is fixed at roughly
+    (window / bucket + 1) * capacity * 16 bytes per series, and median / MAD /
+    percentiles are read from a merge of a bounded number of centroids.
+    """
+    kind = 'robust'
+    __slots__ = ('bucket_seconds', 'capacity', 'slots', 'slot_ids', 'latest', '_closed')
+
+    def __init__(self, window_hours: int = 168, bucket_hours: int = 24, capacity: int = 32):
+        self.bucket_seconds = int(bucket_hours * 3600)
+        self.capacity = int(capacity)
+        size = int(math.ceil(window_hours / bucket_hours)) + 1
+        self.slots = [None] * size
+        self.slot_ids = [-1] * size
+        self.latest = -1       # newest bucket id seen
+        self._closed = None    # cached merge of every live bucket except the newest
+
+    @property
+    def nbytes(self) -> int:
+        return sum(s.nbytes for s in self.slots if s is not None)
+
+    def update(self, ts_seconds, values):
+        ids = np.asarray(ts_seconds, dtype=np.int64) // self.bucket_seconds
+        values = np.asarray(values, dtype=np.float64)
+        size = len(self.slots)
+        for bid in np.unique(ids):
+            bid = int(bid)
+            if bid <= self.latest - size:
+                continue  # older than the window
+            slot = bid % size
+            if self.slot_ids[slot] != bid:
+                self.slots[slot] = QuantileSketch(self.capacity)
+                self.slot_ids[slot] = bid
+                self._closed = None
+            self.slots[slot].add(values[ids == bid])
+            if bid > self.latest:
+                if self.latest >= 0 and self.slot_ids[self.latest % size] == self.latest:
+                    self.slots[self.latest % size].flush()
+                self.latest = bid
+                self._closed = None
+            elif bid < self.latest:
+                self._closed = None
+
+    def summary(self) -> QuantileSketch:
+        """Merged sketch of every live bucket."""
+        size = len(self.slots)
+        if self._closed is None:
+            live = [s for s, bid in zip(self.slots, self.slot_ids) if s is not None and self.latest - size < bid < self.latest]
+            self._closed = QuantileSketch.merged(live, self.capacity * 2)
+        current = self.slots[self.latest % size] if self.latest >= 0 and self.slot_ids[self.latest % size] == self.latest else None
+        return QuantileSketch.merged([self._closed, current], self.capacity * 2)
+
+    def quantile(self, q: float) -> float:
+        return self.summary().quantile(q)
+
+    def stats(self, ts_seconds: int = None):
+        """(median, robust std, count): the scale is 1.4826 * MAD, falling back to the mean absolute deviation."""
+        sketch = self.summary()
+        count = sketch.count
+        if not count:
+            return 0.0, 0.0, 0.0
+        median, mad, mean_ad = sketch.median_mad()
+        scale = MAD_TO_STD * mad
+        if scale <= 0:
+            scale = 1.2533 * mean_ad  # sqrt(pi/2): mean absolute deviation -> std for normal data
+        return median, float(scale), count
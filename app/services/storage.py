@@ -0,0 +1,290 @@
+import logging
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, insert, select, update
+
+from core.config import settings
+from models.metric import MetricValue, MetricChunk
+from services import gorilla
+from services.calendar_features import to_epoch_seconds
+
+# IN (...) lists are split into batches of this size (SQLite caps bound parameters)
+_IN_BATCH = 1000
+
+
+def _to_datetime(ts_seconds) -> datetime:
+    return datetime.fromtimestamp(int(ts_seconds), tz=timezone.utc).replace(tzinfo=None)
+
+
+def _epoch(dt: datetime) -> int:
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _frame(metric_ids, ts, values) -> pd.DataFrame:
+    return pd.DataFrame({'metric_id': metric_ids, 'ds': pd.to_datetime(ts, unit='s'), 'y': values})
+
+
+class RowStore:
+    """One row per sample in `metric_values` (default backend)."""
+    name = 'rows'
+
+    def last_timestamp(self, session, metric_ids):
+        return session.query(func.max(MetricValue.timestamp)).filter(MetricValue.metric_id.in_(list(metric_ids))).scalar()
+
+    def write(self, session, batches):
+        """Persist new points: `batches` is a list of (metric_id, DataFrame with ds/y)."""
+        records = []
+        for metric_id, df in batches:
+            records.extend({'metric_id': metric_id, 'timestamp': ts, 'value': y} for ts, y in zip(df['ds'].tolist(), df['y'].tolist()))
+        if records:
+            session.execute(insert(MetricValue), records)
+        return len(records)
+
+    def read_since(self, bind, since: datetime, chunksize: int = 500000):
+        """Iterator of DataFrames (metric_id, ds, y) with every point at or after `since`."""
+        query = select(MetricValue.metric_id, MetricValue.timestamp.label('ds'), MetricValue.value.label('y')).where(MetricValue.timestamp >= since)
+        return pd.read_sql(query, bind, parse_dates=['ds'], chunksize=chunksize)
+
+    def oldest_timestamp(self, session, before: datetime):
+        return session.query(func.min(MetricValue.timestamp)).filter(MetricValue.timestamp < before).scalar()
+
+    def read_range(self, session, start: datetime, end: datetime, metric_ids=None) -> pd.DataFrame:
+        """Points in [start, end) as a DataFrame (metric_id, ds, y), optionally only for `metric_ids`."""
+        stmt = select(MetricValue.metric_id, MetricValue.timestamp, MetricValue.value) \
+            .where(MetricValue.timestamp >= start, MetricValue.timestamp < end)
+        if metric_ids is None:
+            rows = session.execute(stmt).all()
+        else:
+            metric_ids = list(metric_ids)
+            rows = [r for i in range(0, len(metric_ids), _IN_BATCH)
+                    for r in session.execute(stmt.where(MetricValue.metric_id.in_(metric_ids[i:i + _IN_BATCH]))).all()]
+        return pd.DataFrame(rows, columns=['metric_id', 'ds', 'y'])
+
+    def delete_range(self, session, start, end: datetime) -> int:
+        """Delete points in [start, end); `start=None` deletes everything before `end`."""
+        q = session.query(MetricValue).filter(MetricValue.timestamp < end)
+        if start is not None:
+            q = q.filter(MetricValue.timestamp >= start)
+        return q.delete(synchronize_session=False)
+
+    def count_points(self, session) -> dict:
+        return dict(session.query(MetricValue.metric_id, func.count(MetricValue.id)).group_by(MetricValue.metric_id).all())
+
+    def reset(self, metric_ids=None):
+        pass
+
+
+class ChunkStore:
+    """
+    Compressed backend: one `metric_chunks` row per series and `chunk_hours`
+    window, holding Gorilla-encoded timestamps and values (services/gorilla.py).
+
+    The newest ("head") chunk of each series is kept decoded in memory, so a
+    cycle appends its points and rewrites one small blob per series with a
+    single executemany UPDATE instead of inserting one row per point.
+    """
+    name = 'chunks'
+
+    def __init__(self, chunk_hours: float = 2):
+        self.chunk_seconds = int(chunk_hours * 3600)
+        self._lock = threading.Lock()
+        self._heads = {}  # metric_id -> [row_id, window, ts, values]
+
+    def reset(self, metric_ids=None):
+        """
+        Forget the cached head chunks (all, or only those of `metric_ids`, e.g.
+        the series of a rolled back write); they are reloaded lazily.
+        """
+        with self._lock:
+            if metric_ids is None:
+                self._heads.clear()
+            else:
+                for m in metric_ids:
+                    self._heads.pop(m, None)
+
+    @staticmethod
+    def _merge(ts_a, v_a, ts_b, v_b):
+        """Union of two sorted series; on duplicate timestamps the second one wins."""
+        if len(ts_a) and len(ts_b) and ts_b[0] > ts_a[-1]:
+            return np.concatenate((ts_a, ts_b)), np.concatenate((v_a, v_b))
+        ts = np.concatenate((ts_a, ts_b))
+        v = np.concatenate((v_a, v_b))
+        order = np.argsort(ts, kind='stable')
+        ts, v = ts[order], v[order]
+        last = np.append(ts[1:] != ts[:-1], True)
+        return ts[last], v[last]
+
+    def _row(self, ts, values) -> dict:
+        return {'start_time': _to_datetime(ts[0]), 'end_time': _to_datetime(ts[-1]), 'count': len(ts), 'data': gorilla.encode(ts, values)}
+
+    def _load_heads(self, session, metric_ids):
+        """Fetch and decode the newest chunk of every series in `metric_ids` not cached yet."""
+        with self._lock:
+            missing = [m for m in metric_ids if m not in self._heads]
+        for i in range(0, len(missing), _IN_BATCH):
+            ids = missing[i:i + _IN_BATCH]
+            newest = select(MetricChunk.metric_id, func.max(MetricChunk.start_time).label('start_time')) \
+                .where(MetricChunk.metric_id.in_(ids)).group_by(MetricChunk.metric_id).subquery()
+            rows = session.execute(
+                select(MetricChunk.id, MetricChunk.metric_id, MetricChunk.start_time, MetricChunk.data)
+                .join(newest, (MetricChunk.metric_id == newest.c.metric_id) & (MetricChunk.start_time == newest.c.start_time))
+            ).all()
+            with self._lock:
+                for row_id, metric_id, start_time, data in rows:
+                    ts, values = gorilla.decode(data)
+                    self._heads[metric_id] = [row_id, _epoch(start_time) // self.chunk_seconds, ts, values]
+
+    def _merge_old_window(self, session, metric_id, window, ts, values):
+        """Late points for a window older than the head chunk: read-modify-write that chunk."""
+        lo, hi = _to_datetime(window * self.chunk_seconds), _to_datetime((window + 1) * self.chunk_seconds)
+        row = session.execute(select(MetricChunk.id, MetricChunk.data).where(
+            MetricChunk.metric_id == metric_id, MetricChunk.start_time >= lo, MetricChunk.start_time < hi)).first()
+        if row is None:
+            session.execute(insert(MetricChunk), [{'metric_id': metric_id, **self._row(ts, values)}])
+            return
+        old_ts, old_v = gorilla.decode(row.data)
+        ts, values = self._merge(old_ts, old_v, ts, values)
+        session.execute(update(MetricChunk), [{'id': row.id, **self._row(ts, values)}])
+
+    def write(self, session, batches):
+        """Persist new points: `batches` is a list of (metric_id, DataFrame with ds/y)."""
+        batches = [(m, df) for m, df in batches if not df.empty]
+        self._load_heads(session, [m for m, _ in batches])
+
+        updates, inserts, new_heads = [], [], []
+        written = 0
+        for metric_id, df in batches:
+            ts = to_epoch_seconds(df['ds'])
+            values = pd.to_numeric(df['y'], errors='coerce').to_numpy(dtype=np.float64)
+            order = np.argsort(ts, kind='stable')
+            ts, values = ts[order], values[order]
+            written += len(ts)
+            windows = ts // self.chunk_seconds
+            for window in np.unique(windows):
+                window = int(window)
+                sel = windows == window
+                w_ts, w_v = ts[sel], values[sel]
+                with self._lock:
+                    head = self._heads.get(metric_id)
+                if head is not None and window == head[1]:
+                    head[2], head[3] = self._merge(head[2], head[3], w_ts, w_v)
+                    if head[0] is None:
+                        continue  # inserted in this batch; written below with its final content
+                    updates.append({'id': head[0], **self._row(head[2], head[3])})
+                elif head is not None and window < head[1]:
+                    self._merge_old_window(session, metric_id, window, w_ts, w_v)
+                else:
+                    head = [None, window, w_ts, w_v]
+                    with self._lock:
+                        self._heads[metric_id] = head
+                    new_heads.append((metric_id, head))
+
+        if updates:
+            session.execute(update(MetricChunk), updates)
+        if new_heads:
+            inserts = [{'metric_id': m, **self._row(h[2], h[3])} for m, h in new_heads]
+            ids = session.execute(insert(MetricChunk).returning(MetricChunk.id, sort_by_parameter_order=True), inserts).scalars().all()
+            for (_, head), row_id in zip(new_heads, ids):
+                head[0] = row_id
+        return written
+
+    def last_timestamp(self, session, metric_ids):
+        return session.query(func.max(MetricChunk.end_time)).filter(MetricChunk.metric_id.in_(list(metric_ids))).scalar()
+
+    def _decode_rows(self, rows, start=None, end=None) -> pd.DataFrame:
+        """(metric_id, data) rows -> one DataFrame, optionally clipped to [start, end) epoch seconds."""
+        ids, ts_parts, v_parts = [], [], []
+        for metric_id, data in rows:
+            ts, values = gorilla.decode(data)
+            if start is not None or end is not None:
+                keep = np.ones(len(ts), dtype=bool)
+                if start is not None:
+                    keep &= ts >= start
+                if end is not None:
+                    keep &= ts < end
+                ts, values = ts[keep], values[keep]
+            ids.append(np.full(len(ts), metric_id, dtype=np.int64))
+            ts_parts.append(ts)
+            v_parts.append(values)
+        if not ids:
+            return _frame(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+        return _frame(np.concatenate(ids), np.concatenate(ts_parts), np.concatenate(v_parts))
+
+    def read_since(self, bind, since: datetime, chunksize: int = 500000):
+        """Iterator of DataFrames (metric_id, ds, y) with every point at or after `since`, decoded straight from the blobs."""
+        stmt = select(MetricChunk.metric_id, MetricChunk.data, MetricChunk.count) \
+            .where(MetricChunk.end_time >= since).order_by(MetricChunk.metric_id, MetricChunk.start_time)
+        since_s = _epoch(since)
+        with bind.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(stmt)
+            pending, points = [], 0
+            for metric_id, data, count in result:
+                pending.append((metric_id, data))
+                points += count or 0
+                if points >= chunksize:
+                    yield self._decode_rows(pending, since_s)
+                    pending, points = [], 0
+            if pending:
+                yield self._decode_rows(pending, since_s)
+
+    def oldest_timestamp(self, session, before: datetime):
+        return session.query(func.min(MetricChunk.start_time)).filter(MetricChunk.start_time < before).scalar()
+
+    def _overlapping(self, session, start, end, metric_ids=None):
+        stmt = select(MetricChunk.id, MetricChunk.metric_id, MetricChunk.start_time, MetricChunk.end_time, MetricChunk.count, MetricChunk.data) \
+            .where(MetricChunk.start_time < end)
+        if start is not None:
+            stmt = stmt.where(MetricChunk.end_time >= start)
+        if metric_ids is None:
+            return session.execute(stmt).all()
+        metric_ids = list(metric_ids)
+        return [r for i in range(0, len(metric_ids), _IN_BATCH)
+                for r in session.execute(stmt.where(MetricChunk.metric_id.in_(metric_ids[i:i + _IN_BATCH]))).all()]
+
+    def read_range(self, session, start: datetime, end: datetime, metric_ids=None) -> pd.DataFrame:
+        rows = self._overlapping(session, start, end, metric_ids)
+        return self._decode_rows([(r.metric_id, r.data) for r in rows], _epoch(start), _epoch(end))
+
+    def delete_range(self, session, start, end: datetime) -> int:
+        """Delete points in [start, end); whole chunks are dropped, partially covered ones rewritten."""
+        deleted, drop, rewrite, touched = 0, [], [], set()
+        for row in self._overlapping(session, start, end):
+            if (start is None or row.start_time >= start) and row.end_time < end:
+                drop.append(row.id)
+                touched.add(row.metric_id)
+                deleted += row.count or 0
+                continue
+            ts, values = gorilla.decode(row.data)
+            keep = ts >= _epoch(end)
+            if start is not None:
+                keep |= ts < _epoch(start)
+            deleted += int((~keep).sum())
+            touched.add(row.metric_id)
+            if keep.any():
+                rewrite.append({'id': row.id, **self._row(ts[keep], values[keep])})
+            else:
+                drop.append(row.id)
+        for i in range(0, len(drop), _IN_BATCH):
+            session.query(MetricChunk).filter(MetricChunk.id.in_(drop[i:i + _IN_BATCH])).delete(synchronize_session=False)
+        if rewrite:
+            session.execute(update(MetricChunk), rewrite)
+        self.reset(touched)
+        return deleted
+
+    def count_points(self, session) -> dict:
+        return {m: int(c) for m, c in session.query(MetricChunk.metric_id, func.sum(MetricChunk.count)).group_by(MetricChunk.metric_id).all()}
+
+
+def create_store(backend: str = None):
+    backend = (backend or settings.STORAGE_BACKEND).lower()
+    if backend == 'chunks':
+        return ChunkStore(settings.CHUNK_HOURS)
+    if backend != 'rows':
+        logging.warning(f"Unknown STORAGE_BACKEND '{backend}', using 'rows'")
+    return RowStore()
+
+
+storage = create_store()
@@ -0,0 +1,43 @@
+from services.alert_groups import AlertGrouper
+from services.results import DetectionResult
+
+
+def fp(name, instance, job='node', **labels):
+    labels = dict(labels, __name__=name, instance=instance, job=job)
+    return '|'.join(f"{k}={v}" for k, v in sorted(labels.items()))
+
+
+def res(reason='trend', confidence=0.5, z=1.0):
+    return DetectionResult(is_anomaly=True, confidence=confidence, reason=reason, last=0, mean=1, std=1, z=z, slope=-1)
+
+
+def test_host_down_suppresses_dependents():
+    up = fp('up', 'h1')
+    deps = [fp('node_cpu_seconds_total', 'h1', cpu=c, mode='user') for c in range(8)] + [fp('node_memory_MemAvailable_bytes', 'h1')]
+    notifications = [('firing', up, res('host_down', 1.0))] + [('firing', d, res()) for d in deps]
+    notifications.append(('firing', fp('node_load1', 'h2'), res('spike')))
+
+    grouper = AlertGrouper(min_size=3, enabled=True)
+    groups = grouper.group(notifications, [up])
+    assert len(groups) == 2
+    down = next(g for g in groups if g.instance == 'h1')
+    assert down.host_down and down.root[0] == up and len(down) == 10
+    assert down.counts() == {'node_cpu_seconds_total': 8, 'node_memory_MemAvailable_bytes': 1}
+    assert 'bị ẩn' in down.summary()
+
+    # Dependents crossing the threshold in later cycles: the host-down alert already went out
+    later = grouper.group([('firing', fp('node_network_receive_bytes_total', 'h1', device='eth0'), res())], [up])
+    assert later == []
+    assert grouper.stats == {'notifications': 12, 'alerts': 2, 'suppressed': 10}
+
+
+def test_storms_are_grouped_and_small_batches_are_not():
+    storm = [('firing', fp('node_filesystem_avail_bytes', 'h3', mountpoint=f'/m{i}'), res(confidence=0.1 * i)) for i in range(5)]
+    pair = [('resolved', fp('node_load1', 'h4'), res('normal')), ('resolved', fp('node_load5', 'h4'), res('normal'))]
+    groups = AlertGrouper(min_size=3, enabled=True).group(storm + pair)
+    assert sorted(len(g) for g in groups) == [1, 1, 5]
+    big = next(g for g in groups if len(g) == 5)
+    assert big.root[0].endswith('mountpoint=/m4')  # the most confident series explains the group
+    assert all(g.summary() == '' for g in groups if len(g) == 1)
+
+    assert len(AlertGrouper(enabled=False).group(storm)) == 5
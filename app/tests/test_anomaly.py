@@ -2,6 +2,9 @@ import pandas as pd
 import numpy as np
 import datetime
 from services.anomaly_service import AnomalyEngine
+from services.baselines import SeasonalBaseline
+from services.sketches import RobustBaseline
+from services.calendar_features import to_epoch_seconds
 
 def generate_data(n=300, anomaly_type=None, gaps=False):
     # Generate 300 points (approx 24h at 5m intervals)
@@ -66,12 +69,78 @@ def test_seasonality_features():
     assert 'hour_sin' in str(engine.__class__), "Just ensuring code path executes"
     print("PASS (Execution check)")
 
+def test_shared_calendar_features():
+    print("\nTesting Shared Calendar Features...")
+    df = generate_data(n=300)
+    engine = AnomalyEngine()
+    feats = engine.add_time_features(df)
+    assert 'hour_sin' not in df.columns, "Input frame must not be modified"
+    assert (feats['hour'].to_numpy() == df['ds'].dt.hour.to_numpy()).all()
+    assert (feats['weekday'].to_numpy() == df['ds'].dt.weekday.to_numpy()).all()
+    assert np.allclose(feats['hour_sin'], np.sin(2 * np.pi * df['ds'].dt.hour / 24))
+    # Sparse series are served by lookup instead of slicing
+    sparse = engine.add_time_features(df.iloc[::7])
+    assert (sparse['hour'].to_numpy() == df['ds'].iloc[::7].dt.hour.to_numpy()).all()
+    print("PASS")
+
+def generate_daily_job(days=3, job_hour=9, last_hour=9):
+    # Flat 50 with a daily batch job pushing the metric to 100 during `job_hour`
+    end = datetime.datetime(2026, 1, 10, last_hour, 30)
+    n = days * 288
+    timestamps = [end - datetime.timedelta(minutes=5*(n-1-i)) for i in range(n)]
+    y = np.array([100.0 if t.hour == job_hour else 50.0 for t in timestamps]) + np.random.normal(0, 1, n)
+    return pd.DataFrame({'ds': timestamps, 'y': y})
+
+def test_seasonal_baseline():
+    print("\nTesting Seasonal Baseline...")
+    engine = AnomalyEngine(contamination=0.05)
+
+    # The daily job at 09:00 is normal for that hour, but a spike against the global mean
+    df = generate_daily_job(last_hour=9)
+    baseline = SeasonalBaseline(period='day')
+    baseline.update(to_epoch_seconds(df['ds'])[:-1], df['y'].to_numpy()[:-1])
+    assert engine.train_and_detect(df.copy())['reason'] == 'spike'
+    result = engine.train_and_detect(df.copy(), baseline=baseline)
+    print(f"Result: {result}")
+    assert result['baseline'] == 'seasonal'
+    assert not result['is_anomaly'], "Recurring daily peak should match its hour bucket"
+
+    # The same level at 03:00 is anomalous for that hour
+    df = generate_daily_job(last_hour=3)
+    df.iloc[-1, df.columns.get_loc('y')] = 100.0
+    baseline = SeasonalBaseline(period='day')
+    baseline.update(to_epoch_seconds(df['ds'])[:-1], df['y'].to_numpy()[:-1])
+    result = engine.train_and_detect(df.copy(), baseline=baseline)
+    assert result['is_anomaly'] and result['reason'] == 'spike'
+    print("PASS")
+
+def test_robust_baseline_after_outage():
+    print("\nTesting Robust (median/MAD) Baseline...")
+    df = generate_data(n=2016)
+    y = df['y'].to_numpy(copy=True)
+    y[200:260] = 5000.0  # an old outage inflates the global std
+    y[-1] = y[-2] + 40.0
+    df['y'] = y
+    engine = AnomalyEngine(contamination=0.05)
+    assert not engine.train_and_detect(df.copy())['is_anomaly'], "Global std is masked by the outage"
+
+    baseline = RobustBaseline(window_hours=168, bucket_hours=24, capacity=32)
+    baseline.update(to_epoch_seconds(df['ds'])[:-1], y[:-1])
+    result = engine.train_and_detect(df.copy(), baseline=baseline)
+    print(f"Result: {result}")
+    assert result['baseline'] == 'robust'
+    assert result['is_anomaly'] and result['reason'] == 'spike'
+    print("PASS")
+
 if __name__ == "__main__":
     try:
         test_normal_behavior()
         test_gap_interpolation()
         test_spike_anomaly()
         test_seasonality_features()
+        test_shared_calendar_features()
+        test_seasonal_baseline()
+        test_robust_baseline_after_outage()
         print("\nALL V2 TESTS PASSED!")
     except AssertionError as e:
         print(f"\nTEST FAILED: {e}")
@@ -0,0 +1,140 @@
+import gzip
+import json
+import urllib.request
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from services.api import StatusAPI
+
+
+class FakeCache:
+    def __init__(self, frames):
+        self.frames = frames
+
+    def peek(self, metric_id):
+        return self.frames.get(metric_id)
+
+
+def make_api():
+    t0 = datetime(2024, 1, 1)
+    frame = pd.DataFrame({'ds': [t0 + timedelta(minutes=5 * i) for i in range(10)], 'y': np.arange(10, dtype=float)})
+    api = StatusAPI(FakeCache({1: frame}), page_size=2, max_page_size=50)
+    metrics = [{'fingerprint': f'__name__=up|instance=h{i}|job={"a" if i % 2 else "b"}', 'job': 'a' if i % 2 else 'b',
+                'instance': f'h{i}', 'stage': 'MONITORING', 'is_firing': i == 3} for i in range(5)]
+    firing = {metrics[3]['fingerprint']: {'reason': 'spike', 'confidence': 0.9, 'last_alert_at': '2024-01-01T00:00:00'}}
+    api.publish({'last_run': 'x', 'metrics': metrics[::-1]}, firing, {metrics[1]['fingerprint']: 1, metrics[2]['fingerprint']: 2})
+    return api, metrics
+
+
+def get(api, target, **headers):
+    status, out, body = api.handle(target, headers)
+    return status, out, json.loads(body) if body else None
+
+
+def test_series_pagination_and_filters():
+    api, metrics = make_api()
+    status, _, page = get(api, '/api/v1/series')
+    assert status == 200 and page['total'] == 5
+    assert [m['instance'] for m in page['items']] == ['h0', 'h1']
+    seen = [m['instance'] for m in page['items']]
+    while page['next_cursor']:
+        _, _, page = get(api, f"/api/v1/series?cursor={urllib.request.quote(page['next_cursor'])}")
+        seen += [m['instance'] for m in page['items']]
+    assert seen == ['h0', 'h1', 'h2', 'h3', 'h4']
+
+    _, _, page = get(api, '/api/v1/series?job=a&limit=10')
+    assert [m['instance'] for m in page['items']] == ['h1', 'h3'] and page['next_cursor'] is None
+    _, _, page = get(api, '/api/v1/series?firing=true')
+    assert [m['instance'] for m in page['items']] == ['h3']
+    assert get(api, '/api/v1/series?firing=maybe')[0] == 400
+
+    _, _, alerts = get(api, '/api/v1/alerts?instance=h3')
+    assert alerts['total'] == 1 and alerts['items'][0]['reason'] == 'spike'
+    # `instance` as the first label (aggregates, labels sorting before it)
+    api.publish({'metrics': []}, {'instance=h3|job=a': {'reason': 'spike'}, 'instance=h30|job=a': {'reason': 'spike'}})
+    _, _, alerts = get(api, '/api/v1/alerts?instance=h3')
+    assert [a['fingerprint'] for a in alerts['items']] == ['instance=h3|job=a']
+
+
+def test_history_slices_from_cache():
+    api, metrics = make_api()
+    fp = urllib.request.quote(metrics[1]['fingerprint'])
+    _, _, hist = get(api, f'/api/v1/series/history?fingerprint={fp}&since=2024-01-01T00:10:00&until=2024-01-01T00:30:00')
+    assert [p[1] for p in hist['points']] == [2.0, 3.0, 4.0, 5.0]
+    assert hist['points'][0][0] == int(pd.Timestamp('2024-01-01T00:10:00').timestamp())
+    _, _, hist = get(api, f'/api/v1/series/history?fingerprint={fp}&limit=3')
+    assert [p[1] for p in hist['points']] == [7.0, 8.0, 9.0]
+    # Known series evicted from memory: empty, never reloaded from the database
+    _, _, hist = get(api, f"/api/v1/series/history?fingerprint={urllib.request.quote(metrics[2]['fingerprint'])}")
+    assert hist == {'fingerprint': metrics[2]['fingerprint'], 'cached': False, 'points': []}
+    assert get(api, '/api/v1/series/history?fingerprint=nope')[0] == 404
+    for bad in ('inf', 'nan', '1e300', 'yesterday'):
+        assert get(api, f'/api/v1/series/history?fingerprint={fp}&since={bad}')[0] == 400
+    # Far-away times are clamped, not wrapped around
+    _, _, hist = get(api, f'/api/v1/series/history?fingerprint={fp}&since=0001-01-01T00:00:00&until=9999-01-01T00:00:00')
+    assert len(hist['points']) == 10
+
+
+def test_etag_and_gzip_over_http():
+    api, _ = make_api()
+    api.publish({'metrics': [{'fingerprint': f'__name__=up|instance=h{i:02d}', 'stage': 'LEARNING'} for i in range(40)]})
+    server = api.serve('127.0.0.1', 0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/series?limit=50"
+        with urllib.request.urlopen(urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'})) as r:
+            etag = r.headers['ETag']
+            assert r.headers['Content-Encoding'] == 'gzip'
+            assert json.loads(gzip.decompress(r.read()))['total'] == 40
+        try:
+            urllib.request.urlopen(urllib.request.Request(url, headers={'If-None-Match': etag}))
+            assert False, "expected 304"
+        except urllib.error.HTTPError as e:
+            assert e.code == 304
+
+        # A new snapshot invalidates the ETag
+        api.publish({'metrics': []})
+        with urllib.request.urlopen(urllib.request.Request(url, headers={'If-None-Match': etag})) as r:
+            assert r.status == 200 and r.headers['ETag'] != etag
+    finally:
+        api.shutdown()
+
+
+def test_events_page_through_the_alert_history():
+    from urllib.parse import quote
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models.anomaly_event import AnomalyEvent
+    from models.base import Base
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    t0 = datetime(2024, 1, 1)
+    session.add_all([AnomalyEvent(metric_fingerprint=f'__name__=up|instance=h{i % 2}', instance=f'h{i % 2}', timestamp=t0 + timedelta(minutes=i),
+                                  event_type='firing' if i % 3 else 'resolved', reason='spike') for i in range(10)])
+    session.commit()
+
+    api, _ = make_api()
+    assert api.handle('/api/v1/events', {})[0] == 503  # no database: not served
+    api.session_factory = factory
+    status, _, body = api.handle('/api/v1/events?instance=h0&limit=2', {})
+    page = json.loads(body)
+    assert status == 200 and [e['timestamp'] for e in page['items']] == ['2024-01-01T00:08:00', '2024-01-01T00:06:00']
+    seen = [e['id'] for e in page['items']]
+    while page['next_cursor']:
+        page = json.loads(api.handle(f"/api/v1/events?instance=h0&limit=2&cursor={quote(page['next_cursor'])}", {})[2])
+        seen += [e['id'] for e in page['items']]
+    assert len(seen) == len(set(seen)) == 5
+
+    # Read on every request: events written after a page was served show up without a new snapshot
+    session.add(AnomalyEvent(metric_fingerprint='__name__=up|instance=h0', instance='h0', timestamp=t0 + timedelta(hours=1), event_type='resolved'))
+    session.commit()
+    fired = json.loads(api.handle('/api/v1/events?fingerprint=__name__%3Dup%7Cinstance%3Dh1&type=firing', {})[2])['items']
+    assert fired and all(e['event_type'] == 'firing' and e['instance'] == 'h1' for e in fired)
+    assert json.loads(api.handle('/api/v1/events?instance=h0&limit=1', {})[2])['items'][0]['timestamp'] == '2024-01-01T01:00:00'
+    assert api.handle('/api/v1/events?type=exploded', {})[0] == 400
+    assert api.handle('/api/v1/events?cursor=yesterday', {})[0] == 400
+    session.close()
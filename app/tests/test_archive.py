@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+pytest.importorskip('pyarrow')
+
+from models.base import Base
+from models.metric import MetricModel
+from services.archive import ParquetArchive
+
+
+def test_archive_partitions_and_reads(tmp_path):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    fps = {1: '__name__=node_load1|instance=a', 2: '__name__=node_load1|instance=b', 3: '__name__=up|instance=a'}
+    session.add_all([MetricModel(id=m, metric_fingerprint=fp) for m, fp in fps.items()])
+    session.commit()
+
+    archive = ParquetArchive(str(tmp_path))
+    start = datetime(2024, 1, 1, 22)
+    ds = pd.date_range(start, periods=48, freq='5min')  # crosses midnight
+    # Archived hour by hour, as compaction does
+    for hour in range(4):
+        sl = ds[hour * 12:(hour + 1) * 12]
+        raw = pd.concat([pd.DataFrame({'metric_id': m, 'ds': sl, 'y': np.arange(len(sl), dtype=float) + m * 100}) for m in fps])
+        archive.write(session, raw)
+
+    assert archive.families() == ['node_load1', 'up']
+    assert archive.days('node_load1') == ['2024-01-01', '2024-01-02']
+    # The completed day was consolidated, the current one still has its parts
+    assert [p.rsplit('/', 1)[-1] for p in archive.files('node_load1', end=datetime(2024, 1, 2))] == ['data.parquet']
+    assert len(archive.files('node_load1', start=datetime(2024, 1, 2))) == 2
+
+    df = archive.read('node_load1', start=start + timedelta(hours=1), end=start + timedelta(hours=3))
+    assert len(df) == 2 * 24 and set(df['fingerprint']) == {fps[1], fps[2]}
+    ts, values = archive.read_series(fps[3], start=datetime(2024, 1, 2))
+    assert len(ts) == 24 and values[0] == 300.0
+    assert ts[0] == int(datetime(2024, 1, 2).timestamp() - datetime(1970, 1, 1).timestamp())
@@ -0,0 +1,60 @@
+import time
+from datetime import datetime, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import backfill
+from benchmarks.fake_prometheus import FakePrometheus, SyntheticDataset
+from clients.prometheus import PrometheusClient
+from models.base import Base
+from models.metric import MetricModel
+from services.history_cache import HistoryCache
+from services.storage import RowStore
+
+
+def test_plan_chunks_step_aligned():
+    chunks = backfill.plan_chunks(1000, 1000 + 7200, 300, 1)
+    assert chunks[0] == (1200, 1200 + 3300)
+    assert all(s % 300 == 0 and e - s <= 3300 for s, e in chunks)
+    assert all(b[0] - a[1] == 300 for a, b in zip(chunks, chunks[1:]))
+    assert chunks[-1][1] <= 8200
+
+
+def test_backfill_resumes_and_skips_stored_points(tmp_path, monkeypatch):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(backfill, 'SessionLocal', session_factory)
+    monkeypatch.setattr(backfill, 'storage', RowStore())
+
+    server = FakePrometheus(SyntheticDataset(series=6, metrics=2, hosts=3)).start()
+    try:
+        prom = PrometheusClient(server.url)
+        end = int(time.time()) // 300 * 300
+        checkpoint = str(tmp_path / 'ckpt.json')
+        args = (prom, 'bench_gauge_1', end - 6 * 3600, end, '5m', 1, 2, 0, checkpoint)
+
+        first = backfill.run_backfill(*args)
+        assert first['failed'] == 0 and first['loaded'] == first['chunks'] == 7
+        assert first['points'] == 3 * 73
+
+        again = backfill.run_backfill(*args)
+        assert again['skipped'] == 7 and again['points'] == 0
+
+        # Without the checkpoint every chunk is fetched again, but nothing is stored twice
+        again = backfill.run_backfill(*args[:-1], None)
+        assert again['loaded'] == 7 and again['points'] == 0
+
+        session = session_factory()
+        assert session.query(MetricModel).count() == 3
+        assert sum(RowStore().count_points(session).values()) == 3 * 73
+
+        # Snapshot round trip
+        path = str(tmp_path / 'history.npz')
+        assert HistoryCache.save_snapshot(path, RowStore().read_since(engine, datetime(2000, 1, 1))) == 3 * 73
+        cache = HistoryCache()
+        newest = cache.load_snapshot(path, analysis_window_hours=24)
+        assert set(newest.values()) == {datetime.fromtimestamp(end, tz=timezone.utc).replace(tzinfo=None)}
+        assert sorted(len(cache.get_history(m)) for m in (1, 2, 3)) == [73, 73, 73]
+    finally:
+        server.stop()
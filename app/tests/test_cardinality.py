@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from services.cardinality import CardinalityGuard
+
+
+def test_hash_sample_is_stable_and_global_budget_applies():
+    keys = [f'__name__=node_filesystem_avail_bytes|mountpoint=/m{i}' for i in range(100)]
+    guard = CardinalityGuard(per_query=10, total=15, policy='hash')
+    guard.begin_cycle()
+    first = guard.select('node_filesystem_avail_bytes', keys)
+    assert len(first) == 10
+    assert len(guard.select('other', [f'k{i}' for i in range(10)])) == 5  # global budget left
+    report = guard.report()
+    assert report['used'] == 15 and report['truncated']['node_filesystem_avail_bytes']['kept'] == 10
+
+    guard.begin_cycle()
+    # Same sample next cycle, regardless of the order Prometheus returns series in
+    assert guard.select('node_filesystem_avail_bytes', keys[::-1]) == first
+    assert guard.select('small', ['a', 'b']) == {'a', 'b'}
+
+
+def test_topk_and_drop_policies():
+    ds = pd.date_range('2024-01-01', periods=50, freq='5min')
+    frames = {
+        'flat': pd.DataFrame({'ds': ds, 'y': np.ones(50)}),
+        'noisy': pd.DataFrame({'ds': ds, 'y': np.random.default_rng(0).normal(0, 5, 50)}),
+        'shift': pd.DataFrame({'ds': ds, 'y': np.r_[np.zeros(38) + np.random.default_rng(1).normal(0, 0.1, 38), np.full(12, 3.0)]}),
+        'new': None,
+    }
+    keys = list(frames)
+    guard = CardinalityGuard(per_query=1, total=0, policy='topk_variance')
+    assert guard.select('q', keys, history=frames.get) == {'noisy'}
+    guard = CardinalityGuard(per_query=1, total=0, policy='topk_change')
+    assert guard.select('q', keys, history=frames.get) == {'shift'}
+    guard = CardinalityGuard(per_query=3, total=0, policy='drop')
+    assert guard.select('q', keys) == set()
+    assert guard.select('q', keys[:3]) == set(keys[:3])
+
+
+def test_global_budget_split_does_not_depend_on_query_order():
+    demand = {'big': 100, 'medium': 8, 'small': 2}
+    guard = CardinalityGuard(per_query=50, total=30, policy='hash')
+    assert guard.plan(demand) == {'small': 2, 'medium': 8, 'big': 20}
+    kept = []
+    for order in (['big', 'medium', 'small'], ['small', 'medium', 'big']):
+        guard.begin_cycle(demand)
+        kept.append({q: guard.select(q, [f'{q}{i}' for i in range(demand[q])]) for q in order})
+    assert kept[0] == kept[1] and len(kept[0]['big']) == 20
+    # Queries outside the plan share what the plan left over
+    guard.begin_cycle({'small': 2})
+    assert len(guard.select('new', [f'n{i}' for i in range(40)])) == 28
+
+
+def test_truncated_queries_are_logged_once_per_cycle(caplog):
+    guard = CardinalityGuard(per_query=10, total=0, policy='hash')
+    guard.begin_cycle()
+    guard.select('big', [f'k{i}' for i in range(25)])
+    guard.select('small', ['a', 'b'])
+    caplog.clear()
+    assert guard.log_cycle() == 15
+    (record,) = caplog.records
+    assert record.levelname == 'WARNING' and 'big (15/25)' in record.getMessage() and 'small' not in record.getMessage()
+
+    guard.begin_cycle()
+    caplog.clear()
+    assert guard.log_cycle() == 0 and caplog.records == []
@@ -0,0 +1,44 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from services.correlation import Correlator, lagged_correlation, normalise, related_summary
+from services.history_cache import HistoryCache
+
+
+def test_lagged_correlation_finds_the_lead():
+    rng = np.random.default_rng(0)
+    driver = np.cumsum(rng.normal(size=300))
+    follower = np.r_[np.zeros(3), driver[:-3]] + rng.normal(scale=0.1, size=300)
+    x = normalise(follower[None, :])[0]
+    lags, r = lagged_correlation(x, normalise(np.vstack([driver, rng.normal(size=300)])), 5)
+    assert lags[r[0].argmax()] == 3 and r[0].max() > 0.9
+    assert np.abs(r[1]).max() < 0.3
+
+
+def test_related_series_on_the_same_instance():
+    rng = np.random.default_rng(1)
+    ds = [datetime(2024, 1, 1) + timedelta(minutes=5 * i) for i in range(400)]
+    cache, series = HistoryCache(), {}
+
+    def add(fp, y):
+        series[fp] = len(series) + 1
+        cache._store(series[fp], pd.DataFrame({'ds': ds, 'y': y}))
+
+    restarts = np.cumsum(rng.normal(size=400))
+    add('__name__=node_cpu|instance=h1|job=node', np.r_[np.zeros(2), restarts[:-2]] * 3 + rng.normal(scale=0.2, size=400))
+    add('__name__=jvm_threads|instance=h1|job=node', restarts)
+    add('__name__=jvm_threads|instance=h2|job=node', restarts)  # other instance: not a candidate
+    for i in range(300):
+        add(f'__name__=noise|instance=h1|job=node|n={i}', rng.normal(size=400))
+
+    correlator = Correlator(window=288, max_lag=6, top_k=3, min_score=0.5, enabled=True, cache=cache)
+    started = time.perf_counter()
+    related = correlator.related('__name__=node_cpu|instance=h1|job=node', series)
+    assert time.perf_counter() - started < 1.0
+    assert related == [{'fingerprint': '__name__=jvm_threads|instance=h1|job=node', 'r': related[0]['r'], 'lag_minutes': 10.0}]
+    assert related[0]['r'] > 0.9
+    assert 'jvm_threads (r=+' in related_summary(related) and 'sớm hơn 10 phút' in related_summary(related)
+    assert correlator.related('__name__=unknown|instance=h1', series) == []
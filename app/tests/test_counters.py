@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from services.counters import is_counter, counter_to_rate
+from services.history_cache import HistoryCache
+
+
+def test_is_counter():
+    assert is_counter('node_cpu_seconds_total')
+    assert not is_counter('node_memory_MemAvailable_bytes')
+    # Metadata wins over naming; histogram children are counters
+    assert not is_counter('weird_total', {'weird_total': 'gauge'})
+    assert is_counter('http_latency_seconds_bucket', {'http_latency_seconds': 'histogram'})
+    assert is_counter('node_forks', {'node_forks': 'counter'})
+
+
+def test_counter_rate_with_reset():
+    ts = np.arange(6) * 300
+    v = np.array([100, 400, 700, 50, 350, 650], dtype=float)  # process restart after the 3rd sample
+    rates, prev = counter_to_rate(ts, v)
+    assert np.isnan(rates[0])
+    assert np.allclose(rates[1:], [1.0, 1.0, 50 / 300, 1.0, 1.0])
+    assert prev == (1500.0, 650.0)
+
+    # Incremental batches continue from the previous sample
+    rates, _ = counter_to_rate(np.array([1800.0]), np.array([950.0]), prev)
+    assert np.allclose(rates, [1.0])
+
+
+def test_history_cache_stores_counter_rates():
+    cache = HistoryCache()
+    start = pd.Timestamp.now(tz='UTC').tz_localize(None).floor('h') - pd.Timedelta(hours=1)
+    ds = pd.date_range(start, periods=4, freq='5min')
+    cache.update(1, pd.DataFrame({'ds': ds, 'y': [0.0, 300.0, 600.0, 900.0]}), is_counter=True)
+    cache.update(1, pd.DataFrame({'ds': ds[-1:] + pd.Timedelta(minutes=5), 'y': [1200.0]}), is_counter=True)
+    hist = cache.get_history(1)
+    assert len(hist) == 4
+    assert np.allclose(hist['y'], 1.0)
@@ -6,7 +6,7 @@ from core.config import settings
 
 class TestAutoDiscovery(unittest.TestCase):
     
-    @patch('clients.prometheus.requests.get')
+    @patch('clients.prometheus.requests.Session.get')
     def test_discover_metrics(self, mock_get):
         # Mock Prometheus response for label values
         mock_response = MagicMock()
@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from receivers.dispatcher import HttpDispatcher
+from receivers.slack import SlackReceiver, html_to_mrkdwn
+from receivers.webhook import WebhookReceiver
+
+
+class StubEndpoint:
+    """Local endpoint answering with the statuses of `script` in turn (then 200)."""
+    def __init__(self, script=()):
+        stub = self
+        self.script = list(script)
+        self.received = []
+        self.times = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                code = stub.script.pop(0) if stub.script else 200
+                if code == 200:
+                    stub.times.append((time.monotonic(), body))
+                    stub.received.append(body)
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_retries_then_delivers_and_drops_client_errors(tmp_path):
+    stub = StubEndpoint([503, 500, 400])
+    d = HttpDispatcher(queue_dir=str(tmp_path), backoff=0.01, max_attempts=5, timeout=2)
+    try:
+        d.register('hook', stub.url, concurrency=1, rate=0)
+        d.submit('hook', json_body={'n': 1})   # 503, 500, then 400: dropped, not retried
+        assert d.flush(5)
+        d.submit('hook', json_body={'n': 2})
+        assert d.flush(5)
+        assert stub.received == [{'n': 2}]
+        assert d.stats == {'sent': 1, 'retried': 2, 'failed': 1}
+        assert list(tmp_path.iterdir()) == []
+    finally:
+        stub.close()
+
+
+def test_rate_limit_and_receivers():
+    stub = StubEndpoint()
+    d = HttpDispatcher(queue_dir='', backoff=0.01, timeout=2)
+    try:
+        slack = SlackReceiver(stub.url, rate=5, dispatcher=d)
+        hook = WebhookReceiver(stub.url, headers={'X-Token': 't'}, dispatcher=d)
+        for _ in range(8):
+            assert slack.send("Anomaly Detected", "<b>CPU</b> <i>cao</i>", {'instance': 'h1', 'status': 'firing', 'severity': 'critical'})
+        assert hook.send("Anomaly Resolved", "<b>ok</b>", {'instance': 'h1', 'status': 'resolved'})
+        assert d.flush(5)
+        slack_times = [t for t, body in stub.times if 'text' in body]
+        # Burst of 5, then 5 requests/s: the last 3 wait ~0.6s in total
+        assert len(slack_times) == 8 and slack_times[-1] - slack_times[0] >= 0.5
+        texts = [b['text'] for b in stub.received if 'text' in b]
+        assert texts[0].endswith("*CPU* _cao_") and '`h1`' in texts[0]
+        webhook = next(b for b in stub.received if 'subject' in b)
+        assert webhook['description'] == 'ok' and webhook['status'] == 'resolved'
+    finally:
+        stub.close()
+
+
+def test_undelivered_requests_survive_restart(tmp_path):
+    dead = HttpDispatcher(queue_dir=str(tmp_path), backoff=60, max_attempts=5, timeout=0.5)
+    dead.register('hook', 'http://127.0.0.1:9/hook?token=s3cret', headers={'Authorization': 'Bearer s3cret'},
+                  concurrency=1, rate=0)
+    dead.submit('hook', json_body={'n': 1})  # nothing listens: retried later
+    deadline = time.monotonic() + 5
+    while dead.stats['retried'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    files = list(tmp_path.glob('*.json'))
+    assert len(files) == 1
+    # Only the receiver name and the body are on disk: no URL token, no auth header
+    assert 's3cret' not in files[0].read_text()
+    assert files[0].stat().st_mode & 0o777 == 0o600
+
+    # "Restart": a new dispatcher picks the request up from disk and delivers it to the endpoint now up
+    stub = StubEndpoint()
+    try:
+        d = HttpDispatcher(queue_dir=str(tmp_path), backoff=0.01, timeout=2)
+        d.register('hook', stub.url)
+        assert d.resume() == 1
+        assert d.flush(5)
+        assert stub.received == [{'n': 1}]
+        assert list(tmp_path.glob('*.json')) == []
+    finally:
+        stub.close()
+
+
+def test_resumed_webhooks_follow_their_url_not_their_position(tmp_path):
+    first, second = StubEndpoint([503]), StubEndpoint([503])
+    try:
+        dead = HttpDispatcher(queue_dir=str(tmp_path), backoff=60, max_attempts=5, timeout=2)
+        for stub in (first, second):
+            WebhookReceiver(stub.url, dispatcher=dead).send("Anomaly Detected", stub.url, {'status': 'firing'})
+        deadline = time.monotonic() + 5
+        while dead.stats['retried'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(list(tmp_path.glob('*.json'))) == 2
+
+        # Restart with the first URL removed from WEBHOOK_URLS: the second one keeps its alert, the first one's is dropped
+        d = HttpDispatcher(queue_dir=str(tmp_path), backoff=0.01, timeout=2)
+        WebhookReceiver(second.url, dispatcher=d)
+        assert d.resume() == 1
+        assert d.flush(5)
+        assert first.received == [] and [b['description'] for b in second.received] == [second.url]
+        assert list(tmp_path.glob('*.json')) == []
+    finally:
+        first.close()
+        second.close()
+
+def test_html_to_mrkdwn():
+    assert html_to_mrkdwn("<b>A</b>\n<i>b</i> <code>x</code>") == "*A*\n_b_ x"
+
+
+def test_resume_drops_requests_of_unconfigured_receivers(tmp_path):
+    (tmp_path / '1-a.json').write_text(json.dumps({'id': '1-a', 'destination': 'gone', 'method': 'POST',
+                                                     'json': {'n': 1}, 'data': None, 'attempt': 0}))
+    d = HttpDispatcher(queue_dir=str(tmp_path), backoff=0.01, timeout=2)
+    assert d.resume() == 0
+    assert list(tmp_path.glob('*.json')) == []
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from models.base import Base
+from services.events import EventRecorder, migrate, recent_events
+
+
+def test_recorder_batches_and_recent_events(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/events.db')
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    recorder = EventRecorder(batch_size=50, flush_seconds=0.05, max_queue=1000)
+    recorder.record('firing', 'ignored')  # not started yet: no-op
+    recorder.start(factory)
+
+    t0 = datetime(2024, 1, 1)
+    for i in range(120):
+        host = f'h{i % 3}'
+        recorder.record('firing' if i % 2 else 'resolved', f'__name__=up|instance={host}', host,
+                        {'reason': 'spike', 'confidence': 0.9, 'explanation': 'z=4'}, timestamp=t0 + timedelta(minutes=i))
+    assert recorder.flush()
+    assert recorder.written == 120 and recorder.dropped == 0
+
+    session = factory()
+    page = recent_events(session, instance='h1', limit=10)
+    assert len(page) == 10 and all(e['instance'] == 'h1' for e in page)
+    assert page[0]['timestamp'] > page[-1]['timestamp']
+    nxt = recent_events(session, instance='h1', limit=10, before=(datetime.fromisoformat(page[-1]['timestamp']), page[-1]['id']))
+    assert nxt[0]['timestamp'] < page[-1]['timestamp']
+    fired = recent_events(session, fingerprint='__name__=up|instance=h0', event_types=['firing'], since=t0 + timedelta(minutes=60))
+    assert fired and all(e['event_type'] == 'firing' and e['reason'] == 'spike' for e in fired)
+    session.close()
+
+
+def test_migrate_adds_columns_to_old_table(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/old.db')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE anomaly_events (id INTEGER PRIMARY KEY, metric_fingerprint VARCHAR, '
+                          'timestamp DATETIME, severity VARCHAR, description TEXT)'))
+        conn.execute(text('CREATE INDEX ix_anomaly_events_metric_fingerprint ON anomaly_events (metric_fingerprint)'))
+    migrate(engine)
+    columns = {c['name'] for c in inspect(engine).get_columns('anomaly_events')}
+    assert {'event_type', 'instance', 'reason', 'confidence'} <= columns
+    indexes = {i['name'] for i in inspect(engine).get_indexes('anomaly_events')}
+    assert 'idx_event_instance_ts' in indexes and 'ix_anomaly_events_metric_fingerprint' not in indexes
@@ -0,0 +1,110 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import main
+from models.base import Base
+from models.metric import MetricModel
+from services.alert_groups import AlertGrouper
+from services.results import DetectionResult
+
+FP = '__name__=node_load1|instance=h1|job=node'
+
+
+class FakeAlertManager:
+    def __init__(self):
+        self.sent = []
+
+    def async_broadcast(self, subject, text, metadata):
+        self.sent.append((subject, text, metadata))
+
+
+def test_expired_firing_series_are_closed_not_forgotten(monkeypatch):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(main, 'SessionLocal', session_factory)
+    session = session_factory()
+    session.add_all([MetricModel(id=1, metric_fingerprint=FP), MetricModel(id=2, metric_fingerprint=FP.replace('h1', 'h2'))])
+    session.commit()
+
+    firing = DetectionResult(is_anomaly=True, confidence=0.9, reason='spike', last=9, mean=1, std=1, z=8, slope=0)
+    state = {'windows': {FP: [1, 1, 1], FP.replace('h1', 'h2'): [0]}, 'firing': {FP: dict(firing.to_dict(), last_alert_at='2024-01-01T00:00:00')},
+             'last_alert_at': {}, 'capacity': {}}
+    notifications = main.forget_series([1, 2], state)
+    assert state == {'windows': {}, 'firing': {}, 'last_alert_at': {}, 'capacity': {}}
+    assert [(status, mid, res.reason) for status, mid, res in notifications] == [('expired', FP, 'expired')]
+
+    alert_manager = FakeAlertManager()
+    (group,) = AlertGrouper(enabled=True).group(notifications, [])
+    main.deliver_group(group, None, alert_manager)
+    subject, text, metadata = alert_manager.sent[0]
+    assert subject == "Anomaly Closed" and metadata['status'] == 'resolved' and metadata['reason'] == 'expired'
+    assert 'no longer reported' in text
+
+
+
+def test_dropped_series_close_their_capacity_alerts(monkeypatch):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(main, 'SessionLocal', session_factory)
+    disk = '__name__=node_filesystem_avail_bytes|instance=h1|job=node|mountpoint=/'
+    session = session_factory()
+    session.add(MetricModel(id=1, metric_fingerprint=disk))
+    session.commit()
+
+    forecast = {'fingerprint': disk, 'threshold': 0.0, 'direction': 'down', 'current': 10.0, 'trend_per_hour': -1.0,
+                'exhaustion_hours': 10.0, 'lower_hours': 8.0, 'upper_hours': 12.0, 'last_alert_at': '2024-01-01T00:00:00'}
+    state = {'windows': {}, 'firing': {}, 'last_alert_at': {}, 'capacity': {disk: forecast}}
+    notifications = main.forget_series([1], state)
+    assert state['capacity'] == {}
+    assert [(status, mid, res['kind'], res['reason']) for status, mid, res in notifications] == [('expired', disk, 'capacity', 'expired')]
+
+    alert_manager = FakeAlertManager()
+    (group,) = AlertGrouper(enabled=True).group(notifications, [])
+    main.deliver_group(group, None, alert_manager)
+    subject, text, metadata = alert_manager.sent[0]
+    assert subject == "Capacity Forecast Closed" and metadata['status'] == 'resolved' and 'no longer reported' in text
+
+def test_handed_over_queries_keep_their_alert_state(monkeypatch):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(main, 'SessionLocal', session_factory)
+    monkeypatch.setattr(main.settings, 'SHARDING_ENABLED', True)
+    monkeypatch.setattr(main, '_shared_rows', {})
+    session = session_factory()
+    kept = '__name__=node_load1_x|instance=h1|job=node'  # same prefix, still owned
+    clean = '__name__=node_load1_x|instance=h2|job=node'
+    session.add_all([MetricModel(id=1, metric_fingerprint=FP), MetricModel(id=2, metric_fingerprint=kept)])
+    session.commit()
+
+    class Coordinator:
+        def __init__(self, owned):
+            self.owned = set(owned)
+
+        def heartbeat(self, session):
+            pass
+
+        def assign(self, queries):
+            lost = self.owned - {'node_load1_x'}
+            self.owned = {'node_load1_x'}
+            return set(self.owned), set(), lost
+
+    replica = Coordinator({'node_load1', 'node_load1_x'})
+    monkeypatch.setattr(main, 'shard_coordinator', replica)
+    firing = DetectionResult(is_anomaly=True, confidence=0.9, reason='spike').to_dict()
+    main.save_state({'windows': {FP: [1], kept: [1], clean: [0, 0]}, 'firing': {FP: firing, kept: firing}, 'last_alert_at': {}, 'capacity': {}})
+    assert session.query(main.AlertState).count() == 2  # a clean window is not worth a row
+
+    # node_load1 moves to another replica: nothing is closed, its state stays for the new owner
+    assert main.take_shards(['node_load1', 'node_load1_x']) == ['node_load1_x']
+    state = main.load_state()
+    assert state['firing'] == {kept: firing}
+    state['firing'].pop(kept)
+    main.save_state(state)
+
+    # The new owner (or this replica after a restart with a new id) continues the firing alert
+    monkeypatch.setattr(main, 'shard_coordinator', Coordinator({'node_load1'}))
+    state = main.load_state()
+    assert state['firing'] == {FP: firing} and state['windows'] == {FP: [1]}
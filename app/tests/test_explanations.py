@@ -0,0 +1,87 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from clients.llm import LLMClient
+from services.explanations import ExplanationService
+
+RESULT = {'reason': 'spike', 'confidence': 0.9, 'last': 97.5, 'mean': 20.0, 'std': 3.0, 'z': 25.8, 'slope': 0.1,
+          'explanation': 'last=97.500, mean=20.000, std=3.000, z=25.83, slope=0.1000'}
+FP = '__name__=node_load1|instance=h1'
+
+
+class StubModel:
+    """Local OpenAI-compatible endpoint; `delay` seconds before each answer."""
+    def __init__(self, delay=0.0):
+        stub = self
+        self.delay = delay
+        self.calls = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                stub.calls += 1
+                time.sleep(stub.delay)
+                answer = json.dumps({'title': 'Tải hệ thống', 'impact': 'Chậm.', 'action': 'Kiểm tra top.'})
+                body = json.dumps({'choices': [{'message': {'content': answer}}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/chat/completions"
+
+    def close(self):
+        self.server.shutdown()
+
+
+def test_cache_and_coalescing_with_remote_model():
+    stub = StubModel(delay=0.2)
+    try:
+        service = ExplanationService(LLMClient(api_url=stub.url, timeout=5), workers=8)
+        texts = []
+        threads = [threading.Thread(target=lambda i=i: texts.append(service.explain(f'{FP}{i}', RESULT))) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert stub.calls == 1  # same (family, reason, severity): one model call
+        assert len(texts) == 10 and all('TẢI HỆ THỐNG' in t and '97.500' in t for t in texts)
+        service.explain(FP, {**RESULT, 'confidence': 0.2})  # other severity bucket
+        assert stub.calls == 2
+    finally:
+        stub.close()
+
+
+def test_deadline_falls_back_to_template_and_async_delivery():
+    stub = StubModel(delay=1.0)
+    try:
+        llm = LLMClient(api_url=stub.url, timeout=0.2)
+        service = ExplanationService(llm, workers=2)
+        delivered = threading.Event()
+        out = []
+        service.explain_async(FP, RESULT, lambda text: (out.append(text), delivered.set()))
+        assert delivered.wait(5)
+        assert out[0] == LLMClient(api_url='').explain_anomaly(FP, RESULT)
+        assert not service._cache  # fallbacks are not cached
+    finally:
+        stub.close()
+
+
+def test_template_matches_for_legacy_results():
+    llm = LLMClient(api_url='')
+    legacy = {k: RESULT[k] for k in ('reason', 'confidence', 'explanation')}
+    assert llm.explain_anomaly(FP, legacy) == llm.explain_anomaly(FP, RESULT)
+    assert 'Kết nối Server' not in llm.explain_anomaly('__name__=node_load1|group=backup', RESULT)
+
+
+def test_series_without_a_name_share_one_key():
+    a = ExplanationService.key('instance=h1|job=custom', RESULT)
+    assert a == ExplanationService.key('instance=h2|job=custom', RESULT) and a[0] == 'unknown'
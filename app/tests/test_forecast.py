@@ -0,0 +1,125 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from services.forecast import CapacityForecaster, ForecastRule, capacity_summary, load_rules
+from services.history_cache import HistoryCache
+
+DISK = '__name__=node_filesystem_avail_bytes|instance=h{}|mountpoint=/'
+
+
+def frames(values, start=None):
+    start = start or datetime.now(timezone.utc).replace(tzinfo=None, second=0, microsecond=0) - timedelta(minutes=5 * len(values))
+    return pd.DataFrame({'ds': [start + timedelta(minutes=5 * i) for i in range(len(values))], 'y': np.asarray(values, dtype=float)})
+
+
+def forecaster(cache, **kwargs):
+    rules = load_rules('[{"metric": "node_filesystem_(avail|free)_bytes", "threshold": 0, "direction": "down"},'
+                       ' {"metric": "link_rate", "threshold": 100, "direction": "up"}]')
+    return CapacityForecaster(rules, damping=kwargs.get('damping', 1.0), horizon_hours=720, min_points=48, z=1.96, cache=cache)
+
+
+def test_time_to_exhaustion_and_band():
+    rng = np.random.default_rng(0)
+    cache = HistoryCache()
+    # 1000 GB falling 1 GB per 5 minutes: 1000 - 400 = 600 left after the window -> 600 steps = 50 h
+    cache._store(1, frames(1000 - np.arange(400) + rng.normal(scale=2, size=400)))
+    cache._store(2, frames(np.full(400, 500.0) + rng.normal(scale=2, size=400)))
+    cache._store(3, frames(np.linspace(10, 50, 400)))
+    series = {DISK.format(1): 1, DISK.format(2): 2, '__name__=link_rate|instance=h3': 3, '__name__=other|instance=h1': 1}
+    out = {f['fingerprint']: f for f in forecaster(cache).update(series)}
+    assert set(out) == {DISK.format(1), DISK.format(2), '__name__=link_rate|instance=h3'}
+
+    disk = out[DISK.format(1)]
+    assert abs(disk['exhaustion_hours'] - 50) < 3
+    assert disk['lower_hours'] <= disk['exhaustion_hours'] <= disk['upper_hours']
+    assert abs(disk['trend_per_hour'] + 12) < 1
+    assert out[DISK.format(2)]['exhaustion_hours'] is None or out[DISK.format(2)]['exhaustion_hours'] > 200
+    link = out['__name__=link_rate|instance=h3']  # 50 -> 100 at 0.1 per step: 500 steps
+    assert abs(link['exhaustion_hours'] - 500 * 5 / 60) < 1
+    assert 'dự kiến chạm ngưỡng 0' in capacity_summary(disk)
+
+
+def test_warm_start_matches_a_single_pass():
+    rng = np.random.default_rng(1)
+    values = 1000 - 0.5 * np.arange(600) + rng.normal(scale=3, size=600)
+    full = frames(values)
+    cache_a, cache_b = HistoryCache(), HistoryCache()
+    cache_a._store(1, full)
+    once = forecaster(cache_a, damping=0.999).update({DISK.format(1): 1})
+
+    cache_b._store(1, full.iloc[:450].reset_index(drop=True))
+    incremental = forecaster(cache_b, damping=0.999)
+    incremental.update({DISK.format(1): 1})
+    cache_b._store(1, full)
+    assert incremental.update({DISK.format(1): 1}) == once
+    # Nothing new: same state, same forecast
+    assert incremental.update({DISK.format(1): 1}) == once
+
+
+def test_thousands_of_series_in_seconds():
+    rng = np.random.default_rng(2)
+    cache, series = HistoryCache(), {}
+    base = frames(np.zeros(576))  # two days of 5-minute points
+    for i in range(3000):
+        cache._store(i, base.assign(y=1e3 - rng.uniform(0, 1, 1) * np.arange(576) + rng.normal(size=576)))
+        series[DISK.format(i)] = i
+    started = time.perf_counter()
+    forecasts = forecaster(cache).update(series)
+    assert time.perf_counter() - started < 10
+    assert len(forecasts) == 3000
+
+
+def test_capacity_alerts_fire_repeat_and_resolve(monkeypatch):
+    import main
+    monkeypatch.setattr(main.settings, 'FORECAST_ALERT_HOURS', 24)
+    forecast = {'fingerprint': DISK.format(1), 'threshold': 0.0, 'direction': 'down', 'current': 10.0,
+                'trend_per_hour': -1.0, 'exhaustion_hours': 10.0, 'lower_hours': 8.0, 'upper_hours': 12.0}
+    capacity = {}
+
+    def statuses(forecasts, covered=()):
+        return [(status, fp, res['kind']) for status, fp, res in main.alert_capacity(forecasts, capacity, covered)]
+
+    assert statuses([forecast]) == [('firing', DISK.format(1), 'capacity')]
+    assert statuses([dict(forecast, exhaustion_hours=9.0)]) == []  # within the repeat interval
+    assert capacity[DISK.format(1)]['exhaustion_hours'] == 9.0
+    assert statuses([dict(forecast, exhaustion_hours=30.0)]) == [] and DISK.format(1) in capacity  # hysteresis: still open
+    assert statuses([dict(forecast, exhaustion_hours=None)]) == [('resolved', DISK.format(1), 'capacity')] and capacity == {}
+
+    # Not forecast this cycle: kept while a rule still covers the series (or forecasting failed), resolved otherwise
+    statuses([forecast])
+    assert statuses([], covered={DISK.format(1)}) == [] and statuses(None) == [] and DISK.format(1) in capacity
+    assert statuses([]) == [('resolved', DISK.format(1), 'capacity')] and capacity == {}
+
+
+def test_capacity_alerts_are_grouped_and_suppressed_for_a_down_host(monkeypatch):
+    import main
+    from services.alert_groups import AlertGrouper
+    from services.results import DetectionResult
+    sent = []
+
+    class FakeAlertManager:
+        def async_broadcast(self, subject, text, metadata):
+            sent.append((subject, text, metadata['status']))
+
+    monkeypatch.setattr(main.settings, 'FORECAST_ALERT_HOURS', 24)
+    forecast = {'fingerprint': DISK.format(1), 'threshold': 0.0, 'direction': 'down', 'current': 10.0,
+                'trend_per_hour': -1.0, 'exhaustion_hours': 10.0, 'lower_hours': 8.0, 'upper_hours': 12.0}
+    disks = [dict(forecast, fingerprint=f'{DISK.format(1)}m{i}', exhaustion_hours=10.0 - i) for i in range(3)]
+    down = dict(forecast, fingerprint=DISK.format(2))
+    up = '__name__=up|instance=h2'
+    notifications = main.alert_capacity(disks + [down], {})
+    notifications.append(('firing', up, DetectionResult(is_anomaly=True, confidence=1.0, reason='host_down')))
+
+    groups = AlertGrouper(min_size=3, enabled=True).group(notifications, [up])
+    kinds = sorted((g.kind, g.instance, len(g)) for g in groups)
+    assert kinds == [('anomaly', 'h2', 1), ('capacity', 'h1', 3)]  # h2's disk is hidden behind its host-down alert
+    storm = next(g for g in groups if g.kind == 'capacity')
+    assert storm.root[0].endswith('m2')  # soonest exhaustion first
+    main.deliver_group(storm, None, FakeAlertManager())
+    subject, text, status = sent[0]
+    assert subject == "Capacity Exhaustion Forecast (3 series)" and status == 'firing'
+    assert 'dự kiến chạm ngưỡng 0' in text and 'cũng sắp chạm ngưỡng' in text
+
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.base import Base
+from services import history_cache as history_cache_module
+from services.history_cache import HistoryCache
+from services.storage import RowStore
+
+
+def _frame(n=50, offset=0.0):
+    start = pd.Timestamp.now(tz='UTC').tz_localize(None).floor('min') - pd.Timedelta(minutes=5 * n)
+    return pd.DataFrame({'ds': pd.date_range(start, periods=n, freq='5min'), 'y': np.arange(n, dtype=float) + offset})
+
+
+def test_evict_ttl_and_lru_with_lazy_reload(monkeypatch):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    store = RowStore()
+    monkeypatch.setattr(history_cache_module, 'storage', store)
+    session = sessionmaker(bind=engine)()
+    frames = {m: _frame(offset=m * 100) for m in (1, 2, 3)}
+    store.write(session, list(frames.items()))
+    session.commit()
+
+    cache = HistoryCache()
+    cache.initialize(engine, analysis_window_hours=24)
+    assert cache.memory_bytes() > 0
+    now = time.time()
+    cache._last_seen.update({1: now - 7200, 2: now - 60, 3: now - 30})
+
+    # Series 1 was not seen for 2h: expired with its state
+    assert cache.evict(ttl_minutes=60, max_bytes=0, now=now) == [1]
+    assert 1 not in cache._cache
+
+    # Budget for a single frame: the least recently analysed (2) goes, 3 stays
+    assert cache.evict(ttl_minutes=60, max_bytes=cache._bytes[3], now=now) == []
+    assert 2 not in cache._cache and 3 in cache._cache
+
+    # Evicted series come back from the DB on access, and keep growing on update
+    assert np.allclose(cache.get_history(2)['y'], frames[2]['y'])
+    assert np.allclose(cache.get_history(1)['y'], frames[1]['y'])
+    cache._drop(2, forget=False)
+    nxt = pd.DataFrame({'ds': [frames[2]['ds'].iloc[-1] + pd.Timedelta(minutes=5)], 'y': [999.0]})
+    cache.update(2, nxt)
+    hist = cache.get_history(2)
+    assert len(hist) == 51 and hist['y'].iloc[-1] == 999.0
+
+
+def test_snapshot_covers_series_individually(monkeypatch, tmp_path):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    store = RowStore()
+    monkeypatch.setattr(history_cache_module, 'storage', store)
+    monkeypatch.setattr(history_cache_module.settings, 'DETECTION_MODE', 'seasonal')
+    session = sessionmaker(bind=engine)()
+    frames = {m: _frame(offset=m * 100) for m in (1, 2, 3)}
+    store.write(session, list(frames.items()))
+    session.commit()
+
+    # Snapshot taken while series 2 lagged 10 points behind; series 3 is missing from it
+    path = str(tmp_path / 'history.npz')
+    snap = [frames[1].assign(metric_id=1), frames[2].iloc[:40].assign(metric_id=2)]
+    HistoryCache.save_snapshot(path, snap)
+    cache = HistoryCache()
+    since = cache.load_snapshot(path, analysis_window_hours=24)
+    assert since == {1: frames[1]['ds'].iloc[-1], 2: frames[2]['ds'].iloc[39]}
+    cache.initialize(engine, analysis_window_hours=24, since=since)
+    for m in (1, 2, 3):
+        assert np.allclose(cache.get_history(m)['y'], frames[m]['y'])
+        assert cache.get_baseline(m) is not None
+
+
+def test_ttl_only_expires_checked_series():
+    cache = HistoryCache()
+    for m in (1, 2):
+        cache.update(m, _frame())
+    now = time.time()
+    cache._last_seen.update({1: now - 7200, 2: now - 7200})
+    # The query of series 2 failed this cycle: not reported, but not gone either
+    assert cache.evict(ttl_minutes=60, max_bytes=0, now=now, checked={1}) == [1]
+    assert 2 in cache._cache
@@ -0,0 +1,36 @@
+import json
+
+import numpy as np
+
+from services.results import DetectionResult, ResultTable
+
+
+def test_result_is_typed_and_mapping_compatible():
+    r = DetectionResult(is_anomaly=1, confidence=0.9, reason='host_down', last=0, mean=1, std=0, z=10, slope=np.float64(-0.05))
+    assert r.is_anomaly is True and isinstance(r.slope, float)
+    assert r['reason'] == 'host_down' and r.get('z') == 10.0 and r.get('missing', 'x') == 'x'
+    assert r['explanation'].startswith('CRITICAL: Host is DOWN (up=0). last=0.000')
+    # The explanation is derived, never stored: state files carry typed fields only
+    state = json.loads(json.dumps(r.to_dict()))
+    assert 'explanation' not in state
+    assert DetectionResult.from_dict(state) == r
+
+
+def test_too_short_result_has_no_numbers():
+    r = DetectionResult(reason='too_short')
+    assert r.to_dict() == {'is_anomaly': False, 'confidence': 0.0, 'reason': 'too_short', 'baseline': 'global'}
+    assert 'last' not in r and r.explanation == 'too_short'
+
+
+def test_table_columns_rows_and_summary():
+    a = ResultTable.from_results([('fp1', DetectionResult(is_anomaly=True, confidence=0.8, reason='spike', last=5, mean=1, std=1, z=4, slope=0)),
+                                  ('fp2', DetectionResult(reason='too_short'))])
+    b = ResultTable.from_results([('fp3', DetectionResult(is_anomaly=True, confidence=0.4, reason='trend', last=2, mean=1, std=1, z=1, slope=0.5))])
+    table = ResultTable.concat([a, ResultTable(), b])
+
+    assert len(table) == 3 and table.z.dtype == np.float64 and table.is_anomaly.tolist() == [True, False, True]
+    assert table.index() == {'fp1': 0, 'fp2': 1, 'fp3': 2}
+    assert table.row(2) == b.row(0)
+    assert [fp for fp, _ in table] == ['fp1', 'fp2', 'fp3']
+    assert table.summary() == {'series': 3, 'anomalies': 2, 'by_reason': {'spike': 1, 'trend': 1}, 'max_z': 4.0}
+    assert ResultTable().summary()['max_z'] is None
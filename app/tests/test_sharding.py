@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.base import Base
+from services.sharding import HashRing, ShardCoordinator
+
+QUERIES = [f'metric_{i}' for i in range(300)]
+
+
+def test_hash_ring_balance_and_minimal_movement():
+    two = HashRing(['a', 'b'])
+    three = HashRing(['a', 'b', 'c'])
+    owners = [three.owner(q) for q in QUERIES]
+    assert all(owners.count(m) > 60 for m in 'abc')
+    # Adding 'c' only moves keys to 'c'
+    assert all(three.owner(q) in (two.owner(q), 'c') for q in QUERIES)
+
+
+def test_leases_split_queries_and_take_over_dead_replicas():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    t0 = datetime(2024, 1, 1)
+    a = ShardCoordinator('a', lease_ttl=60, join_grace=30)
+    b = ShardCoordinator('b', lease_ttl=60, join_grace=30)
+
+    a.heartbeat(session, now=t0)
+    assert a.assign(QUERIES)[0] == set(QUERIES)
+
+    # b joins: it owns nothing (and a keeps everything) until the grace period is over
+    b.heartbeat(session, now=t0 + timedelta(seconds=10))
+    a.heartbeat(session, now=t0 + timedelta(seconds=10))
+    assert b.assign(QUERIES)[0] == set() and a.assign(QUERIES)[0] == set(QUERIES)
+
+    now = t0 + timedelta(seconds=45)
+    a.heartbeat(session, now=now)
+    b.heartbeat(session, now=now)
+    owned_a, _, lost_a = a.assign(QUERIES)
+    owned_b, gained_b, _ = b.assign(QUERIES)
+    assert owned_a.isdisjoint(owned_b) and owned_a | owned_b == set(QUERIES)
+    assert lost_a == gained_b and owned_b
+
+    # b stops heartbeating: once its lease expires a takes its queries back
+    a.heartbeat(session, now=now + timedelta(seconds=90))
+    assert a.assign(QUERIES)[0] == set(QUERIES)
+    b.leave(session)
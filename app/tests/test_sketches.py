@@ -0,0 +1,36 @@
+import numpy as np
+from services.sketches import QuantileSketch, RobustBaseline
+
+
+def test_quantile_sketch_accuracy():
+    rng = np.random.default_rng(7)
+    x = rng.normal(100, 10, 20000)
+    sketch = QuantileSketch(capacity=32)
+    for chunk in np.array_split(x, 500):
+        sketch.add(chunk)
+    assert len(sketch.centroids()[0]) <= 2 * sketch.capacity
+    for q in (0.05, 0.5, 0.95):
+        assert abs(sketch.quantile(q) - np.quantile(x, q)) < 1.0
+    median, mad, _ = sketch.median_mad()
+    assert abs(median - 100) < 1.0
+    assert abs(mad - np.median(np.abs(x - np.median(x)))) < 1.0
+
+
+def test_robust_baseline_ignores_outage_and_expires():
+    rng = np.random.default_rng(3)
+    ts = 1_700_000_000 + np.arange(2016) * 300  # 7 days at 5m
+    y = rng.normal(50, 2, len(ts))
+    y[100:140] = 10_000  # past outage
+    baseline = RobustBaseline(window_hours=168, bucket_hours=24, capacity=32)
+    baseline.update(ts, y)
+    center, scale, count = baseline.stats()
+    assert count == len(ts)
+    assert abs(center - 50) < 1 and 1 < scale < 3, "Outage must not inflate the robust scale"
+
+    # Two days later only the most recent buckets are live
+    later = ts[-1] + np.arange(1, 577) * 300
+    baseline.update(later, np.full(len(later), 80.0))
+    baseline.update(later + 5 * 86400, np.full(len(later), 80.0))
+    center, _, count = baseline.stats()
+    assert center == 80.0
+    assert count < len(ts)
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import backfill
+from benchmarks.fake_prometheus import FakePrometheus, SyntheticDataset
+from clients.sources import load_sources, query_key, split_query_key, SOURCE_LABEL
+from core.config import settings
+from core.fingerprint import labels_from_fingerprint
+from main import series_of_query, query_key_of
+from models.base import Base
+from models.metric import MetricModel
+from services.storage import RowStore
+
+
+def test_load_sources(monkeypatch):
+    monkeypatch.setattr(settings, 'PROM_SOURCES', '')
+    (default,) = load_sources()
+    assert default.name is None and default.url == settings.PROM_URL and default.client.source is None
+
+    sources = load_sources('[{"name": "hn", "url": "http://a:9090"}, {"name": "eu", "url": "http://b:8428", "workers": 3, "step": "1m"}]')
+    assert [s.name for s in sources] == ['hn', 'eu']
+    assert sources[1].workers == 3 and sources[1].step == '1m' and sources[1].client.source == 'eu'
+    assert sources[0].pattern == settings.METRIC_DISCOVERY_PATTERN
+    with pytest.raises(ValueError):
+        load_sources('[{"name": "hn", "url": "http://a"}, {"name": "hn", "url": "http://b"}]')
+
+
+def test_query_key_round_trip(monkeypatch):
+    monkeypatch.setattr(settings, 'PROM_SOURCES', '[]')
+    assert split_query_key(query_key('eu', 'node_load1')) == ('eu', 'node_load1')
+    assert split_query_key(query_key(None, 'up')) == (None, 'up')
+    assert query_key_of(f'__name__=up|{SOURCE_LABEL}=eu|instance=h1') == 'eu::up'
+
+
+def test_named_sources_are_distinct_series(monkeypatch):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(backfill, 'SessionLocal', session_factory)
+    monkeypatch.setattr(backfill, 'storage', RowStore())
+
+    server = FakePrometheus(SyntheticDataset(series=4, metrics=2, hosts=2)).start()
+    try:
+        # Two sources scraping the same targets: same labels, different fingerprints
+        sources = load_sources(f'[{{"name": "a", "url": "{server.url}"}}, {{"name": "b", "url": "{server.url}"}}]')
+        end = int(time.time()) // 300 * 300
+        for source in sources:
+            summary = backfill.run_backfill(source.client, 'bench_gauge_1', end - 3600, end, '5m', 1, 1, 0, None)
+            assert summary['failed'] == 0
+
+        session = session_factory()
+        fps = [m.metric_fingerprint for m in session.query(MetricModel).all()]
+        assert len(fps) == 4
+        assert sorted(labels_from_fingerprint(fp)[SOURCE_LABEL] for fp in fps) == ['a', 'a', 'b', 'b']
+        for name in ('a', 'b'):
+            own = session.query(MetricModel).filter(series_of_query('bench_gauge_1', name)).all()
+            assert len(own) == 2 and all(f'{SOURCE_LABEL}={name}' in m.metric_fingerprint for m in own)
+        assert session.query(MetricModel).filter(series_of_query('bench_gauge_1', 'c')).count() == 0
+        session.close()
+    finally:
+        server.stop()
+
+
+def test_series_of_query_matches_the_metric_name_exactly():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    fps = ['__name__=node_filesystem_files|instance=h1', '__name__=node_filesystem_files_free|instance=h1',
+           '__name__=up|instance=h1', '__name__=upstream_x|instance=h1', '__name__=up', '__name__=nodeXfilesystem_files|instance=h1',
+           f'__name__=up|{SOURCE_LABEL}=eu|instance=h1', f'__name__=up|{SOURCE_LABEL}=eu_x|instance=h1']
+    session.add_all([MetricModel(metric_fingerprint=fp) for fp in fps])
+    session.commit()
+
+    def matching(query, source=None):
+        return sorted(m.metric_fingerprint for m in session.query(MetricModel).filter(series_of_query(query, source)))
+
+    assert matching('node_filesystem_files') == ['__name__=node_filesystem_files|instance=h1']
+    assert matching('up') == sorted(['__name__=up', '__name__=up|instance=h1', fps[-2], fps[-1]])
+    assert matching('up', 'eu') == [f'__name__=up|{SOURCE_LABEL}=eu|instance=h1']
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.base import Base
+from models.metric import MetricModel, MetricChunk
+from services import gorilla
+from services.storage import ChunkStore, RowStore
+
+
+def test_gorilla_roundtrip():
+    rng = np.random.default_rng(0)
+    ts = 1_700_000_000 + np.arange(500) * 300
+    ts[250:] += 7  # one irregular scrape
+    for values in (np.ones(500), np.round(rng.normal(50, 5, 500), 2), np.cumsum(rng.integers(0, 100, 500)).astype(float),
+                   np.where(rng.random(500) < 0.1, np.nan, rng.normal(size=500))):
+        t2, v2 = gorilla.decode(gorilla.encode(ts, values))
+        assert np.array_equal(t2, ts) and np.array_equal(v2, values, equal_nan=True)
+    # Regular timestamps + a constant series: about one bit per point per column
+    assert len(gorilla.encode(ts[:250], np.ones(250))) < 100
+    assert gorilla.decode(gorilla.encode([], []))[0].size == 0
+
+
+def _write_and_read(store):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([MetricModel(id=1, metric_fingerprint='a'), MetricModel(id=2, metric_fingerprint='b')])
+    start = datetime(2024, 1, 1)
+    ds = pd.date_range(start, periods=60, freq='5min')
+    # Three cycles of deltas, then one more after a restart (head chunk reloaded from the DB)
+    for lo, hi in ((0, 30), (30, 45), (45, 60)):
+        store.write(session, [(1, pd.DataFrame({'ds': ds[lo:hi], 'y': np.arange(lo, hi, dtype=float)})),
+                              (2, pd.DataFrame({'ds': ds[lo:hi], 'y': np.ones(hi - lo)}))])
+        session.commit()
+    store.reset()
+    store.write(session, [(1, pd.DataFrame({'ds': ds[-1:] + pd.Timedelta(minutes=5), 'y': [60.0]}))])
+    session.commit()
+
+    assert store.last_timestamp(session, [1]) == start + timedelta(minutes=300)
+    assert store.count_points(session) == {1: 61, 2: 60}
+    df = pd.concat(list(store.read_since(engine, start + timedelta(hours=2))))
+    s1 = df[df['metric_id'] == 1].sort_values('ds')
+    assert list(s1['y']) == [float(i) for i in range(24, 61)]
+
+    assert store.delete_range(session, None, start + timedelta(minutes=90)) == 36
+    session.commit()
+    assert store.oldest_timestamp(session, start + timedelta(hours=6)) == start + timedelta(minutes=90)
+    part = store.read_range(session, start + timedelta(hours=2), start + timedelta(hours=3))
+    assert len(part) == 24
+    return session
+
+
+def test_row_store():
+    _write_and_read(RowStore())
+
+
+def test_chunk_store():
+    session = _write_and_read(ChunkStore(chunk_hours=2))
+    # 2 series x 3 two-hour windows, the first one rewritten after the partial delete
+    assert session.query(MetricChunk).count() == 6
+
+
+def test_chunk_store_overwrites_duplicates():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    store = ChunkStore(chunk_hours=2)
+    ds = pd.date_range('2024-01-01', periods=30, freq='5min')
+    store.write(session, [(1, pd.DataFrame({'ds': ds[:20], 'y': np.zeros(20)}))])
+    store.write(session, [(1, pd.DataFrame({'ds': ds[10:], 'y': np.ones(20)}))])
+    session.commit()
+    df = next(store.read_since(engine, datetime(2024, 1, 1)))
+    assert len(df) == 30 and df['y'].sum() == 20
+
+
+def test_chunk_store_reset_after_rollback_keeps_other_series():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    store = ChunkStore(chunk_hours=2)
+    ds = pd.date_range('2024-01-01', periods=20, freq='5min')
+    store.write(session, [(1, pd.DataFrame({'ds': ds[:10], 'y': np.zeros(10)})), (2, pd.DataFrame({'ds': ds[:10], 'y': np.zeros(10)}))])
+    session.commit()
+    # A failed write of series 1 only invalidates its own head chunk
+    store.write(session, [(1, pd.DataFrame({'ds': ds[10:], 'y': np.ones(10)}))])
+    session.rollback()
+    store.reset([1])
+    assert 1 not in store._heads and 2 in store._heads
+    store.write(session, [(1, pd.DataFrame({'ds': ds[10:12], 'y': np.ones(2)})), (2, pd.DataFrame({'ds': ds[10:12], 'y': np.ones(2)}))])
+    session.commit()
+    assert store.count_points(session) == {1: 12, 2: 12}
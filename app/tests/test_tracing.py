@@ -0,0 +1,67 @@
+import concurrent.futures
+import json
+
+from core.tracing import Tracer, NOOP_SPAN, SPAN_KIND_CLIENT
+
+
+def read_spans(path):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            for rs in json.loads(line)['resourceSpans']:
+                for ss in rs['scopeSpans']:
+                    spans.extend(ss['spans'])
+    return spans
+
+
+def test_spans_form_one_trace_across_threads(tmp_path):
+    path = tmp_path / 'otlp.jsonl'
+    tracer = Tracer(enabled=True, sample_ratio=1.0, path=str(path), endpoint='', flush_seconds=0.05)
+
+    @tracer.traced('run_once')
+    def work(q):
+        tracer.current().set(query=q)
+        with tracer.span('prom.range', SPAN_KIND_CLIENT, points=10) as span:
+            span.set(bytes=123)
+        return tracer.traceparent()
+
+    with tracer.trace('cycle') as root:
+        with concurrent.futures.ThreadPoolExecutor(2) as ex:
+            futures = [ex.submit(tracer.wrap(work), q) for q in ['up', 'node_load1']]
+            parents = [f.result() for f in futures]
+    # A queued job continues the trace later, from its traceparent
+    with tracer.span_from(parents[0], 'http.send', SPAN_KIND_CLIENT, destination='slack'):
+        pass
+    assert tracer.flush(5)
+
+    spans = read_spans(path)
+    by_name = {}
+    for s in spans:
+        by_name.setdefault(s['name'], []).append(s)
+    assert {s['traceId'] for s in spans} == {root.trace_id}
+    assert len(by_name['run_once']) == 2 and all(s['parentSpanId'] == root.span_id for s in by_name['run_once'])
+    run_ids = {s['spanId'] for s in by_name['run_once']}
+    assert all(s['parentSpanId'] in run_ids and s['kind'] == SPAN_KIND_CLIENT for s in by_name['prom.range'])
+    attrs = {a['key']: a['value'] for a in by_name['prom.range'][0]['attributes']}
+    assert attrs == {'points': {'intValue': '10'}, 'bytes': {'intValue': '123'}}
+    assert by_name['http.send'][0]['parentSpanId'] in run_ids
+    assert 'parentSpanId' not in by_name['cycle'][0]
+
+
+def test_unsampled_traces_record_nothing(tmp_path):
+    path = tmp_path / 'otlp.jsonl'
+    tracer = Tracer(enabled=True, sample_ratio=0.0, path=str(path), endpoint='')
+    with tracer.trace('cycle'):
+        assert tracer.span('detect') is NOOP_SPAN and tracer.traceparent() is None
+    assert tracer.span('outside') is NOOP_SPAN
+    assert tracer.flush(1) and not path.exists()
+
+
+def test_file_rotation(tmp_path):
+    path = tmp_path / 'otlp.jsonl'
+    tracer = Tracer(enabled=True, sample_ratio=1.0, path=str(path), endpoint='', max_bytes=600, backups=2)
+    for i in range(6):
+        with tracer.trace('cycle', n=i) as span:
+            pass
+        tracer.export([span])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['otlp.jsonl', 'otlp.jsonl.1', 'otlp.jsonl.2']